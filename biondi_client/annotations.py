@@ -0,0 +1,225 @@
+"""Annotations of a body kept as vector strokes in the case database.
+
+The screenshot editor records every brush stroke, the location text and the
+angle and ring tool measurement lines as strokes: a kind, a color, a width and a
+packed array of points. The annotation overlay is rendered from the strokes only
+when it is needed, at any scale, so a body no longer needs a full size RGBA png
+next to its image and editing an annotation starts from what was drawn instead
+of a blank overlay. Bodies saved before strokes existed keep their annotation
+png, which is used as is.
+
+Typical usage example:
+    overlays = AnnotationStore.of(folder_path)
+    annotation_img = overlays.open(time)
+"""
+import sqlite3
+import os
+import struct
+import threading
+import time as clock
+from collections import namedtuple, OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+from image_store import ImageStore
+import schema
+
+Stroke = namedtuple("Stroke", ("kind", "color", "width", "points", "text"))
+Stroke.__doc__ = """One vector record of an annotation.
+
+kind is "brush" or "text" for what is drawn on the overlay, or one of the
+measurement kinds. points is a flat tuple x1, y1, x2, y2, ... in pixels of the
+body image; a text stroke has one point, the top left corner of the text."""
+
+# kinds drawn on the overlay, measurement lines are kept for editing but not drawn
+overlay_kinds = ("brush", "text")
+measurement_kinds = ("angle", "prong1", "prong2", "distance", "length")
+
+text_font = "calibrib.ttf"
+text_size = 20
+
+def pack_points(points):
+    """Packs a flat sequence of coordinates into little endian 32 bit floats."""
+    return struct.pack("<{0}f".format(len(points)), *points)
+
+def unpack_points(data):
+    return struct.unpack("<{0}f".format(len(data) // 4), data)
+
+def load_font(size):
+    try:
+        return ImageFont.truetype(text_font, size)
+    except OSError:
+        # machines exporting cases may not have the font the client annotates with
+        return ImageFont.load_default()
+
+def draw_strokes(image, strokes, scale = 1):
+    """Draws the overlay strokes onto an RGBA image, scaling every coordinate."""
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        points = [point * scale for point in stroke.points]
+        if stroke.kind == "brush" and len(points) >= 4:
+            draw.line(points, fill = stroke.color, width = max(1, round(stroke.width * scale)),
+                      joint = "curve")
+        elif stroke.kind == "text":
+            draw.text((points[0], points[1]), fill = stroke.color,
+                      font = load_font(max(1, round(text_size * scale))), text = stroke.text)
+    return image
+
+def render(strokes, size, scale = 1):
+    """Returns the overlay of strokes as an RGBA image of size scaled by scale."""
+    image = Image.new("RGBA", (max(1, round(size[0] * scale)), max(1, round(size[1] * scale))))
+    return draw_strokes(image, [stroke for stroke in strokes if stroke.kind in overlay_kinds], scale)
+
+class AnnotationStore():
+    """The annotation overlays of one case folder.
+
+    Has the same key, stamp, open and read methods as an ImageStore but takes the
+    TIME of a body instead of a file name, so the image cache, thumbnails and
+    export treat vector annotations and old annotation pngs the same way. Each
+    thread and export worker process uses its own connection to the case
+    database. The last few overlays rendered are kept with their strokes, so a
+    re-render after strokes are added to an annotation only draws the new ones.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+        store (ImageStore): Where the body images and older annotation pngs are kept.
+        rendered (OrderedDict): (size, strokes, image) of recent renders keyed by TIME.
+    """
+    rendered_kept = 8
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.db_path = folder_path + "body_database.db"
+        self.store = ImageStore.of(folder_path)
+        self.rendered = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @classmethod
+    def of(cls, folder_path):
+        """Returns the annotation store of a case folder, opening it on first use."""
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls(folder_path)
+                cls._stores[key] = store
+        return store
+
+    def connection(self):
+        """Returns the connection of the calling thread."""
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            # the thumbnail and export command lines can open a case the client never upgraded
+            schema.migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    def header(self, time):
+        """Returns the width, height and save time of a vector annotation, None for a png one."""
+        return self.connection().execute('''SELECT WIDTH, HEIGHT, MODIFIED FROM annotations WHERE TIME = ?''',
+                                         (time,)).fetchone()
+
+    def strokes(self, time, kinds = None):
+        """Returns the strokes of a body in the order they were drawn."""
+        strokes = read_strokes(self.connection(), time)
+        if kinds is not None:
+            strokes = [stroke for stroke in strokes if stroke.kind in kinds]
+        return strokes
+
+    def png_name(self, time):
+        row = self.connection().execute('''SELECT ANNOTATION_FILE_NAME FROM bodies WHERE TIME = ?''',
+                                        (time,)).fetchone()
+        if row is None or row[0] is None:
+            raise FileNotFoundError("no body with time {0} in {1}".format(time, self.db_path))
+        return row[0]
+
+    def key(self, time):
+        return "{0}annotation {1}".format(self.folder_path, time)
+
+    def stamp(self, time):
+        """Returns a stamp that changes whenever the annotation of a body is saved."""
+        header = self.header(time)
+        if header is None:
+            return self.store.stamp(self.png_name(time))
+        return ("vector", header[2])
+
+    def read(self, time):
+        """Returns bytes that change whenever the annotation changes, used to hash exports."""
+        header = self.header(time)
+        if header is None:
+            return self.store.read(self.png_name(time))
+        data = [struct.pack("<2i", header[0], header[1])]
+        for stroke in self.strokes(time, overlay_kinds):
+            data.append("{0}|{1}|{2}|{3}|".format(stroke.kind, stroke.color, stroke.width, stroke.text).encode())
+            data.append(pack_points(stroke.points))
+        return b"".join(data)
+
+    def open(self, time, scale = 1):
+        """Returns the annotation overlay of a body as an RGBA image.
+
+        Raises:
+            FileNotFoundError: The body has neither strokes nor an annotation png.
+        """
+        header = self.header(time)
+        if header is None:
+            image = self.store.open(self.png_name(time))
+            if scale != 1:
+                image = image.resize((round(image.width * scale), round(image.height * scale)))
+            return image
+
+        size = (header[0], header[1])
+        strokes = self.strokes(time, overlay_kinds)
+        if scale != 1:
+            return render(strokes, size, scale)
+        with self._lock:
+            previous = self.rendered.get(time)
+        if previous is not None and previous[0] == size and strokes[:len(previous[1])] == previous[1]:
+            # only the strokes added since the last render are drawn
+            image = draw_strokes(previous[2].copy(), strokes[len(previous[1]):])
+        else:
+            image = render(strokes, size)
+        with self._lock:
+            self.rendered[time] = (size, strokes, image)
+            self.rendered.move_to_end(time)
+            while len(self.rendered) > self.rendered_kept:
+                self.rendered.popitem(last = False)
+        return image
+
+def save_strokes(c, time, size, strokes, kinds = None):
+    """Replaces the strokes of a body, used by FileManagement on the shared connection.
+
+    Args:
+        c: A cursor to the case database.
+        time (int): The TIME of the body.
+        size (tuple): Width and height of the body image.
+        strokes (list): The new strokes.
+        kinds (tuple): Only strokes of these kinds are replaced, all of them if None.
+    """
+    # measurement lines alone do not replace the annotation png of an older body
+    c.execute('''SELECT 1 FROM annotations WHERE TIME = ?''', (time,))
+    if c.fetchone() is not None or any(stroke.kind in overlay_kinds for stroke in strokes):
+        c.execute('''INSERT OR REPLACE INTO annotations (TIME, WIDTH, HEIGHT, MODIFIED) VALUES (?, ?, ?, ?)''',
+                  (time, size[0], size[1], clock.time_ns()))
+    kept = [] if kinds is None else [stroke for stroke in read_strokes(c, time) if stroke.kind not in kinds]
+    c.execute('''DELETE FROM strokes WHERE TIME = ?''', (time,))
+    c.executemany('''INSERT INTO strokes (TIME, SEQ, KIND, COLOR, WIDTH, POINTS, TEXT) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  [(time, seq, stroke.kind, stroke.color, stroke.width, pack_points(stroke.points), stroke.text)
+                   for seq, stroke in enumerate(kept + list(strokes))])
+
+def read_strokes(c, time):
+    """Returns the strokes of a body in the order they were drawn.
+
+    Args:
+        c: A cursor or connection to the case database.
+    """
+    rows = c.execute('''SELECT KIND, COLOR, WIDTH, POINTS, TEXT
+                        FROM strokes
+                        WHERE TIME = ?
+                        ORDER BY SEQ''', (time,)).fetchall()
+    return [Stroke(kind, color, width, unpack_points(points), text) for kind, color, width, points, text in rows]
@@ -0,0 +1,223 @@
+"""Times the hot paths of the client on synthetic cases of growing size.
+
+Each size gets a fresh synthetic case (see synthetic_case.py) in a temporary
+folder. Saving, filter queries, counting, deleting a body (which renumbers the
+rest of its type), exporting and building the marker index and body list
+without a display are timed, and the results are written as JSON so runs of
+two versions of the client can be compared.
+
+Typical usage example:
+    python benchmark.py --sizes 100 1000 10000 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import argparse
+import statistics
+import subprocess
+import contextlib
+from file_management import FileManagement
+from case_session import CaseSession
+from persistence import WriteBehind
+from thumbnails import ThumbnailStore
+from case_export import CaseExport
+from spatial_index import GridIndex
+from body_list import BodyListModel
+from synthetic_case import generate_case, make_body_image, make_strokes
+import config
+
+default_sizes = (100, 1000, 10000)
+
+def timed(function, repeat = 5):
+    """Runs function repeat times and returns the median, min and max time in milliseconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "max_ms": max(times), "repeat": repeat}
+
+def filter_combinations():
+    """The filters the viewer and option bar run: every body or a single type, with each flag."""
+    combinations = [(config.all_bodies, False, False, False, False)]
+    for i in range(4):
+        flags = [False] * 4
+        flags[i] = True
+        combinations.append((config.all_bodies, *flags))
+    combinations.append((["green spear"], False, False, False, False))
+    return combinations
+
+def bench_save(folder_path, rnd, saves):
+    """Saves new bodies through WriteBehind.save_image, one at a time like the editor does.
+
+    Each save is timed until it is queued, which is how long the editor takes to
+    close. written_ms is the time from the first save until a flush returns with
+    every save written.
+    """
+    fm = FileManagement(folder_path)
+    writer = WriteBehind.of(folder_path)
+    body_img = make_body_image(rnd, (64, 48))
+    times = []
+    flush_start = time.perf_counter()
+    for i in range(saves):
+        body_name = rnd.choice(config.all_bodies)
+        body_time = fm.get_free_time(1900000000 + i)
+        body_info = {"time": body_time, "annotator_name": "SY", "body_name": body_name, "body_number": 0,
+                     "x": rnd.randrange(4000), "y": rnd.randrange(4000), "grid_id": "A",
+                     "GR": False, "MAF": False, "MP": False, "unsure": False, "notes": "",
+                     "body_file_name": "{0}_{1}.png".format(body_name, body_time),
+                     "annotation_file_name": None, "angle": None, "log": None, "dprong1": None, "lprong2": None}
+        strokes = make_strokes(rnd, body_img.size, "A 1, 1")
+        start = time.perf_counter()
+        writer.save_image(body_info, body_img, strokes)
+        times.append((time.perf_counter() - start) * 1000)
+    writer.flush()
+    flush_ms = (time.perf_counter() - flush_start) * 1000
+    # the thumbnails of the new bodies are made in the background, they are left out of the times
+    thumbnails = ThumbnailStore.of(folder_path)
+    while thumbnails.pending:
+        time.sleep(0.01)
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "max_ms": max(times), "repeat": saves,
+            "written_ms": flush_ms}
+
+def bench_queries(folder_path, repeat):
+    """Times every filter with an empty query cache and again answered from it."""
+    fm = FileManagement(folder_path)
+    queries = fm.session.queries
+    combinations = filter_combinations()
+
+    def run(method, cold):
+        for combination in combinations:
+            if cold:
+                queries.invalidate()
+            method(*combination)
+
+    return {"query_images_cold": timed(lambda: run(fm.query_images, True), repeat),
+            "query_images_cached": timed(lambda: run(fm.query_images, False), repeat),
+            "count_bodies_cold": timed(lambda: run(fm.count_bodies, True), repeat),
+            "count_bodies_cached": timed(lambda: run(fm.count_bodies, False), repeat),
+            "filters": len(combinations)}
+
+def bench_delete(folder_path, rnd, deletes):
+    """Deletes the first body of a random type, then lists that type so it is renumbered."""
+    fm = FileManagement(folder_path)
+    times = []
+    for i in range(deletes):
+        counts = fm.session.counter.by_type()
+        body_name = rnd.choice([name for name, count in counts.items() if count > 0])
+        start = time.perf_counter()
+        fm.delete_img(body_name, 1)
+        fm.query_images([body_name], False, False, False, False)
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "max_ms": max(times), "repeat": deletes}
+
+def bench_export(folder_path, export_path):
+    """Times a full export and an export right after it, which only checks what changed."""
+    results = {}
+    for run in ("full", "unchanged"):
+        start = time.perf_counter()
+        CaseExport(folder_path, export_path, "synthetic").run()
+        results[run + "_ms"] = (time.perf_counter() - start) * 1000
+    return results
+
+def bench_markers(folder_path, repeat):
+    """Builds the marker index like MarkerLayer.load and finds the markers of one screen."""
+    fm = FileManagement(folder_path)
+
+    def build():
+        index = GridIndex()
+        for time_, body_name, x, y, GR, MAF, MP, unsure in fm.query_markers():
+            index.insert(("m", time_), x, y)
+        for x, y in fm.query_all_ignored():
+            index.insert(("i", x, y), x, y)
+        return index
+
+    index = build()
+    return {"build": timed(build, repeat),
+            "viewport_query": timed(lambda: index.query(1000, 1000, 2920, 2080), repeat),
+            "markers": len(index)}
+
+def bench_list(folder_path, repeat):
+    """Fills the body list model with every body and searches it."""
+    fm = FileManagement(folder_path)
+    rows = fm.query_images(config.all_bodies, False, False, False, False)
+    model = BodyListModel()
+    return {"set_rows": timed(lambda: model.set_rows(rows), repeat),
+            "find": timed(lambda: [model.find(text) for text in ("green spear 14", "gre", "spear 1", "rod 3")],
+                          repeat)}
+
+def run_size(bodies, repeat, skip, seed):
+    """Runs every benchmark on a new case with a number of bodies."""
+    rnd = random.Random(seed)
+    results = {"bodies": bodies}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        folder_path = os.path.join(temp_dir, "case") + "/"
+        export_path = os.path.join(temp_dir, "export") + "/"
+        os.makedirs(folder_path)
+        os.makedirs(export_path)
+
+        start = time.perf_counter()
+        generate_case(folder_path, bodies, seed = seed)
+        results["generate_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        CaseSession.get(folder_path).counter.load()
+        results["open_ms"] = (time.perf_counter() - start) * 1000
+
+        if "query" not in skip:
+            results["query"] = bench_queries(folder_path, repeat)
+        if "markers" not in skip:
+            results["markers"] = bench_markers(folder_path, repeat)
+        if "list" not in skip:
+            results["list"] = bench_list(folder_path, repeat)
+        if "export" not in skip:
+            results["export"] = bench_export(folder_path, export_path)
+        if "save" not in skip:
+            results["save"] = bench_save(folder_path, rnd, max(repeat, 20))
+        if "delete" not in skip:
+            results["delete"] = bench_delete(folder_path, rnd, max(repeat, 20))
+        CaseSession.close_all()
+    return results
+
+def git_revision():
+    """Returns the commit the client is run from, None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)),
+                              capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Times the client on synthetic cases and writes the results as JSON.")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = default_sizes, help = "bodies per case")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--skip", nargs = "*", default = [],
+                        choices = ("save", "query", "delete", "export", "markers", "list"))
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--label", help = "a name for this run, the git commit if left out")
+    parser.add_argument("--output", help = "file to write the JSON to, printed if left out")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    report = {"label": args.label or revision,
+              "revision": revision,
+              "python": sys.version.split()[0],
+              "platform": platform.platform(),
+              "image_store": config.image_store,
+              "results": []}
+    # what the client prints while it works goes to stderr so stdout is only the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for bodies in args.sizes:
+            print("benchmarking {0} bodies".format(bodies))
+            report["results"].append(run_size(bodies, args.repeat, set(args.skip), args.seed))
+
+    output = json.dumps(report, indent = 2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
@@ -1,11 +1,17 @@
 import tkinter as tk
 from tkinter import filedialog
-from PIL import Image, ImageTk
-from math import floor
+from tkinter import ttk
+from PIL import Image
 import sys
+import queue
+import threading
 from image_viewer import ImageViewer
 from file_management import FileManagement
-from markings import GridMark, Marker, GridIgnored
+from case_export import CaseExport
+from persistence import WriteBehind
+from markings import Marker, GridIgnored, MarkerLayer
+from tiled_image import TilePyramid, TiledCanvas, canvas_to_image
+from instrumentation import timed
 import config
 
 class Application(tk.Frame):
@@ -24,20 +30,26 @@ class Application(tk.Frame):
             mousex and mouse y vars.
         body_count (tk.IntVar): Number of biondi bodies saved.
         body_count_label (tk.Label): Displays the number of biondi bodies saved.
+        writer (WriteBehind): Background writer the editors queue saves on.
+        pending_label (tk.Label): Displays how many saves are still being written.
         canvas (tk.Canvas): Used to hold and display the image.
         marker_canvas (tk.Canvas): A copy of canvas; used to store and display the clickable grid markings.
-        grid_canvas (tk.Canvas): A copy of canvas; used to store and display the 7x7 grid overlay.
+        grid_canvas (tk.Canvas): A copy of canvas; used to store and display the grid overlay.
         vbar (tk.Scrollbar): The vertical scrollbar used to scroll canvas.
         hbar (tk.Scrollbar): The horizontal scrollbar used to scroll canvas.
         path (str: The inputed used folder path directory).
         folder_path (str): Path with a slash added. This is so we can access different components in the folder easier
             (don't have to re add slash every time).
+        fm (FileManagement): Database access to the opened case folder.
         image (PIL Image): The image object to which the gridfile image is assigned to.
         width (int): The width of the image.
         height (int): The height of the image.
         container (tkinter rectangle): Used to enclose the image; allows scrolling on the canvas.
-        rows (int): 7 rows; used as a var to create the grid overlay.
-        columns (int): 7 columns; used as a var to create the grid overlay.
+        viewer (TiledCanvas): Shows the tiles of the image in view and handles zooming.
+        markers (MarkerLayer): Shows the body and ignored markers in view.
+        layout (GridLayout): The grid squares of the case over the image.
+        rows (int): Rows of grid squares; used as a var to create the grid overlay.
+        columns (int): Columns of grid squares; used as a var to create the grid overlay.
         toolbar (tk.Frame): object that is attributed to storing and displaying the top toolbar.
         grid_window (tk.Frame): object that is attributed to storing and displaying the bottom grid square tracker.
         all_bodies (list): List of all possible biondi bodies.
@@ -54,6 +66,7 @@ class Application(tk.Frame):
         self.master.title('Imaris Screenshot Tool')
 
         self.folder_path = path + "/"
+        self.fm = FileManagement(self.folder_path)
         
         #coord bar
         self.mousex = tk.IntVar(value = 0)
@@ -63,7 +76,9 @@ class Application(tk.Frame):
 
         # body count
         try:
-            self.body_count = tk.IntVar(value = FileManagement(self.folder_path).count_bodies(config.all_bodies, False, False, False, False))
+            # writes saves left queued by the last session before anything is counted
+            self.writer = WriteBehind.of(self.folder_path)
+            self.body_count = tk.IntVar(value = self.fm.session.counter.total)
         except: # incase the case is not initiated
             error_screen = tk.Toplevel()
             error_screen.focus_get()
@@ -76,7 +91,12 @@ class Application(tk.Frame):
             close_button.grid(row = 3, column = 0, sticky = 's')
         self.body_count_label = tk.Label(self.master, text = "{0} Bodies Annotated".format(self.body_count.get()))
         self.body_count_label.grid(row = 3, column = 0 , sticky = "se")
-        self.update_count()
+        self.fm.session.counter.subscribe(self.update_count)
+
+        # saves still being written in the background
+        self.pending_label = tk.Label(self.master, text = "", fg = "gray40")
+        self.pending_label.grid(row = 3, column = 0, sticky = "s")
+        self.update_pending()
         
         # Create canvas and put image on it
         self.canvas = tk.Canvas(self.master, highlightthickness=0)
@@ -93,7 +113,9 @@ class Application(tk.Frame):
         hbar = tk.Scrollbar(self.master, orient='horizontal', command = self.canvas.xview)
         vbar.grid(row=1, column=1, sticky='ns')
         hbar.grid(row=2, column=0, sticky='we')
-        self.canvas.configure(xscrollcommand = hbar.set, yscrollcommand = vbar.set, xscrollincrement = '2', yscrollincrement = '2')
+        self.canvas.configure(xscrollcommand = lambda *args: self.on_scroll(hbar, *args),
+                              yscrollcommand = lambda *args: self.on_scroll(vbar, *args),
+                              xscrollincrement = '2', yscrollincrement = '2')
         self.canvas.update()
 
         
@@ -104,6 +126,10 @@ class Application(tk.Frame):
         # Bind events to the Canvas
         self.canvas.bind('<MouseWheel>', self.verti_wheel)
         self.canvas.bind('<Shift-MouseWheel>', self.hori_wheel)  
+        self.canvas.bind('<Control-MouseWheel>', self.zoom_wheel)
+        self.master.bind('<Control-plus>', lambda event: self.viewer.zoom_in())
+        self.master.bind('<Control-equal>', lambda event: self.viewer.zoom_in())
+        self.master.bind('<Control-minus>', lambda event: self.viewer.zoom_out())
         self.canvas.bind('<Button-3>', self.open_popup)
         self.canvas.bind('<Motion>', self.update_coords)
 
@@ -117,8 +143,9 @@ class Application(tk.Frame):
 
         #self.master.geometry(str(600) + "x" + str(600))
         
-        self.rows = 7
-        self.columns = 7
+        self.layout = self.fm.get_layout(self.width, self.height)
+        self.rows = self.layout.rows
+        self.columns = self.layout.columns
         self.create_grid()
         
         self.initiate_markers()
@@ -128,91 +155,92 @@ class Application(tk.Frame):
         self.option_bar.grid(row = 0, column = 0, sticky = 'nswe')
         
         #grid window
-        grid_window = GridWindow(self.master, self.canvas, self.folder_path, self.width, self.height)
+        grid_window = GridWindow(self.master, self.canvas, self.folder_path, self.width, self.height, self.layout)
         grid_window.grid(row = 4, column = 0)
         
     def create_grid(self):
         """Creates the grid overlay.
         
-        Creates a 7x7 white grid overlay that is placed on top of canvas. 
-        The grid overlay is stored in grid_canvas. size of the grid overlay scales
-        with the image size using box_height and box_width.
+        Creates a white grid overlay of the case's rows and columns that is placed on
+        top of canvas. The grid overlay is stored in grid_canvas. size of the grid
+        overlay scales with the image size using box_height and box_width.
         """
-        box_width =  round(self.width / self.columns)
-        box_height = round(self.height / self.rows)
-        num_v_lines = self.rows - 1
+        box_width = self.layout.cell_width
+        box_height = self.layout.cell_height
+        num_v_lines = self.columns - 1
         num_h_lines = self.rows - 1
         
-        #for loops go through 7 times each creating equally spaced lines
+        #for loops go through each row and column creating equally spaced lines
         for i in range(0, num_v_lines): 
             self.grid_canvas.create_line(box_width * (i+1), 0, box_width * (i+1), self.height,
                                         fill = "cyan", width = 2, tag = "line")
         for i in range(0, num_h_lines):
             self.grid_canvas.create_line(0, box_height * (i+1), self.width, box_height * (i+1),
                                         fill = "cyan", width = 2, tag = "line")
-            
-        num_squares = self.rows * self.columns
         
-        if round(box_width / 5) > round(box_height / 5):
-            padding = round(box_height / 5)
-        else:
-            padding = round(box_width / 5)
+        padding = round(min(box_width, box_height) / 5)
+        # small squares of large grids get smaller ids so they stay inside the square
+        font_size = max(8, min(24, round(min(box_width, box_height) / 6)))
             
-        key = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
-        n = 0
-        for i in range(0, self.rows): #for loop that runs 49 times to create appropriatly scaled grid letters
-            for j in range(0, self.columns):
-                self.grid_canvas.create_text((j + 1) * box_height - padding, (i + 1) * box_width - padding,
-                                            font = ("Calibri", 24, "bold"), fill = 'cyan', text = key[n], tag = "letter")
-                n += 1
-                if n > num_squares:
-                    break
+        for grid_id in self.layout.ids: #creates appropriatly scaled grid ids in the bottom right of every square
+            left, top, right, bottom = self.layout.bounds(grid_id)
+            self.grid_canvas.create_text(right - padding, bottom - padding,
+                                        font = ("Calibri", font_size, "bold"), fill = 'cyan', text = grid_id, tag = "letter")
 
     def initiate_markers(self):
         """Initializes marker info in FileManagment.
     
-        Creates a marker for every body on the application's startup. Iterates
-        through the bodies in the database to do so. Also creates a marker for
-        every ignored marker
+        Loads a marker for every body and every ignored marker on the application's
+        startup. Only the markers in view are put on the canvas, see MarkerLayer.
         """
-        data = FileManagement(self.folder_path).query_images(config.all_bodies, False, False, False, False)
-        for i in data:
-            body_info = {}
-            x = 0
-            for choice in ("time", "body_name", "body_number", "x", "y"):
-                body_info[choice] = i[x]
-                x += 1
-            GridMark(self.marker_canvas, self.folder_path, body_info)
-        
-        # generates ignored markers
-        ignored = FileManagement(self.folder_path).query_all_ignored()
-        for coord in ignored:
-            GridIgnored(self.marker_canvas, self.folder_path, coord[0], coord[1])
+        self.markers = MarkerLayer.of(self.marker_canvas, self.folder_path)
+        self.markers.load(self.fm)
             
     def open_new_folder(self):
         """Opens a new folder with its respective image and Markings."""
         path = filedialog.askdirectory()
         i = Application(root, path=path)
 
-    def update_count(self):
-        self.body_count.set(FileManagement(self.folder_path).count_bodies(config.all_bodies, False, False, False, False))
+    def update_count(self, counter):
+        """Updates the body count label whenever the case's body counter changes.
+
+        Args:
+            counter (BodyCounter): The counter of the opened case folder.
+        """
+        self.body_count.set(counter.total)
         self.body_count_label.configure(text = "{0} Bodies Annotated".format(self.body_count.get()))
-        self.master.after(2000, self.update_count)
         
+    def update_pending(self):
+        """Shows how many saves the background writer has not written yet, checked every 250 ms."""
+        writer = getattr(self, "writer", None)
+        if writer is not None:
+            for kind, error in writer.take_failed():
+                print("a queued {0} could not be written: {1}".format(kind, error))
+            if writer.failed:
+                self.pending_label.configure(text = "{0} saves could not be written, they are kept in write_failed"
+                                             .format(writer.failed), fg = "red")
+            elif writer.error is not None:
+                self.pending_label.configure(text = "Saving failed, retrying: {0}".format(writer.error), fg = "red")
+            elif writer.pending:
+                self.pending_label.configure(text = "Saving {0} bodies...".format(writer.pending), fg = "gray40")
+            else:
+                self.pending_label.configure(text = "")
+        self.master.after(250, self.update_pending)
+
     def update_coords(self, event):
         """ Event method that updates mouse position on the image
 
         Activates on mouse movement. Gets current x y canvas position of the mouse. 
         Sets those values on the coord_label.
         """
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        self.mousex.set(x)
-        self.mousey.set(y)
+        x, y = canvas_to_image(self.canvas, self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.mousex.set(round(x))
+        self.mousey.set(round(y))
 
         self.coord_label.configure(text = "X: {0}  Y: {1}".format(self.mousex.get(), self.mousey.get()))
         self.coord_label.update()
 
+    @timed("client.open_popup")
     def open_popup(self, event):
         """Event method that opens up the Marker popup.
 
@@ -221,10 +249,9 @@ class Application(tk.Frame):
         """
         x = event.x
         y = event.y
-        canvas_x = self.marker_canvas.canvasx(x)
-        canvas_y = self.marker_canvas.canvasy(y)
+        canvas_x, canvas_y = canvas_to_image(self.marker_canvas, self.marker_canvas.canvasx(x), self.marker_canvas.canvasy(y))
         
-        Marker(self.master, canvas_x, canvas_y, self.marker_canvas, self.height, self.width, self.columns, self.rows, self.folder_path)
+        Marker(self.master, canvas_x, canvas_y, self.marker_canvas, self.height, self.width, self.layout, self.folder_path)
 
     def verti_wheel(self, event):
         """Event method that scrolls the image vertically using the mousewheel.
@@ -246,19 +273,31 @@ class Application(tk.Frame):
         if event.num == 4 or event.delta == 120:
             self.canvas.xview('scroll', -20, 'units')
 
+    def zoom_wheel(self, event):
+        """Event method that zooms in or out around the mouse using control + mousewheel."""
+        if event.num == 5 or event.delta < 0:
+            self.viewer.zoom_out(event.x, event.y)
+        if event.num == 4 or event.delta > 0:
+            self.viewer.zoom_in(event.x, event.y)
+
+    def on_scroll(self, scrollbar, *args):
+        """Moves the scrollbar and loads the tiles and markers that scrolled into view."""
+        scrollbar.set(*args)
+        if hasattr(self, "viewer"):
+            self.viewer.schedule_redraw()
+        if hasattr(self, "markers"):
+            self.markers.schedule_redraw()
+
     def show_image(self):
         """Displays the image on canvas
 
-        Configures a scroll region on canvas (allows it to be scrollable) and sets the dimensions to
-        self.container (has the witdh and height of the image). ImageTk.PhotoImage allows pngs and jpgs to be
-        displayed. 
+        The gridfile is cut into a tile pyramid saved in the case folder the first time
+        it is opened. Only the tiles in view are put on the canvas, see TiledCanvas. The
+        scroll region is the size of the image at the current zoom.
         """
-        self.canvas.configure(scrollregion=self.canvas.bbox(self.container))  # set scroll region
-        image = self.image
-        imagetk = ImageTk.PhotoImage(image)
-        imageid = self.canvas.create_image(0,0,anchor= 'nw', image=imagetk) #glues the image to the topleft of the place where the image is stored.
-        self.canvas.lower(imageid)  # set image into background
-        self.canvas.imagetk = imagetk  # keep an extra reference to prevent garbage-collection
+        pyramid = TilePyramid(self.folder_path + "gridfile.jpg", self.folder_path + "gridfile_tiles/")
+        self.viewer = TiledCanvas(self.canvas, pyramid)
+        self.viewer.schedule_redraw()
 
 class GridWindow(tk.Frame):
     """The grid square tool located at the bottom of Application
@@ -270,11 +309,13 @@ class GridWindow(tk.Frame):
         master (tk.Tk): The current instance of Application's master is stored here.
         main_canvas (tk.Canvas): The current instance of Application's canvas is stored here.
         folder_path (str): The path directory of the current opened folder.
+        fm (FileManagement): Database access to the opened case folder.
         final_order (list): The randomized grid order unique to the folder.
         width (int): The width of the image in Application.
         height (int): The height of the image in Application.
-        rows (int): Seven rows of grid squares.
-        columns (int): Seven columns of grid squares.
+        layout (GridLayout): The grid squares of the case and where they are on the image.
+        rows (int): Rows of grid squares.
+        columns (int): Columns of grid squares.
         i (int): The current index of the final_order list.
         v (tk.StringVar): The variable used to store the current grid square in the current_grid label.
         text (tk.Label): The label which displays the text "current grid square:".
@@ -284,18 +325,20 @@ class GridWindow(tk.Frame):
         jumpto_button (tk.Button): Calls the move_canvas method.
 
     Typical usage example:
-        grid_window = GridWindow(root, canvas, folder_path, width, height)
+        grid_window = GridWindow(root, canvas, folder_path, width, height, layout)
     """
-    def __init__(self, master, main_canvas, folder_path, width, height):
+    def __init__(self, master, main_canvas, folder_path, width, height, layout):
         tk.Frame.__init__(self)
         self.master = master
         self.main_canvas = main_canvas
         self.folder_path = folder_path
-        self.final_order = FileManagement(self.folder_path).get_grid()
+        self.fm = FileManagement(self.folder_path)
+        self.final_order = self.fm.get_grid()
         self.width = width
         self.height = height
-        self.rows = 7
-        self.columns = 7
+        self.layout = layout
+        self.rows = layout.rows
+        self.columns = layout.columns
         
         bools = [i[1] for i in self.final_order] # creates a list of just the booleans of whether grid is finished
         self.i = next((i for i, j in enumerate(bools) if j == False), 0) # finds the first instance of false and jumps to that
@@ -341,38 +384,22 @@ class GridWindow(tk.Frame):
 
         """
         fin = self.var_fin.get()
-        FileManagement(self.folder_path).finish_grid(grid_id, fin)
-        self.final_order = FileManagement(self.folder_path).get_grid()
+        self.fm.finish_grid(grid_id, fin)
+        self.final_order = self.fm.get_grid()
 
     def get_scrollx(self):
         """Figures out the amount of x units that need to be scrolled to a grid square.
 
-        w is the base amount of scrolling per one grid tile. The return statment calculates how far the grid is
-        on the x axis and scales it with w.
+        The left edge of the grid square is looked up in the layout.
         """
-        total_squares = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvw"
-        index = total_squares.find(self.final_order[self.i][0])
-        self.w = self.width / self.columns
-        return (index % self.columns) * self.w
+        return self.layout.origins[self.final_order[self.i][0]][0]
 
-    def get_scrolly(self): #look at later
+    def get_scrolly(self):
         """Figures out the amount of y units that need to be scrolled to a grid square
 
-        Uses the ASCII number of a character to calculate where in the grid it is to get the
-        amount to scroll on y. 
+        The top edge of the grid square is looked up in the layout.
         """
-        c = self.final_order[self.i][0]
-        self.h = self.height / self.rows
-        if c.islower():
-            index = ord(c) - 96 + 26
-        else:
-            index = ord(c) - 64
-        
-        if index % 7 == 0: # rows - 1 to ensure the right edge does not drop down a row
-            scrolly = (index / 7 - 1) * self.h
-        else:
-            scrolly = floor(index / (self.rows)) * self.h 
-        return scrolly    
+        return self.layout.origins[self.final_order[self.i][0]][1]
 
     def move_canvas(self):
         """Scrolls the canvas to the current grid square.
@@ -428,6 +455,7 @@ class OptionBar(tk.Frame):
     Attributes:
         master (tk.Tk): The current instance of Application's master is stored here.
         folder_path (str): the path directory of the current opened folder.
+        fm (FileManagement): Database access to the opened case folder.
         marker_canvas (tk.Canvas): Application's marker_canvas is stored here.
         grid_canvas (tk.Canvas): Application's grid_canvas is stored here.
         new_folder_path (tk.StringVar): Where a folder path would be stored if user opens a new folder.
@@ -453,6 +481,7 @@ class OptionBar(tk.Frame):
         tk.Frame.__init__(self)
         self.master = master
         self.folder_path = folder_path
+        self.fm = FileManagement(self.folder_path)
         self.marker_canvas = marker_canvas
         self.grid_canvas = grid_canvas
         
@@ -565,12 +594,55 @@ class OptionBar(tk.Frame):
             """
             if self.case_name.get() == "" or self.new_folder_path.get() == "/":
                 return
-            else:
-                FileManagement(self.folder_path).export_case(self.new_folder_path.get(), self.case_name.get())
-                export.destroy()
-        
+
+            # the export runs on a worker thread and reports back through a queue
+            # that is polled here, tkinter can only be touched from the main thread
+            updates = queue.Queue()
+            job = CaseExport(self.folder_path, self.new_folder_path.get(), self.case_name.get(),
+                             progress = lambda done, total: updates.put((done, total)))
+
+            def run():
+                try:
+                    # queued saves are written before the export reads the case
+                    WriteBehind.of(self.folder_path).flush()
+                    updates.put(job.run())
+                except Exception as error:
+                    updates.put(error)
+
+            def poll():
+                while not updates.empty():
+                    update = updates.get()
+                    if isinstance(update, tuple):
+                        done, total = update
+                        progress_bar.configure(maximum = max(total, 1), value = done)
+                        progress_label.configure(text = "Exported {0} of {1}".format(done, total))
+                    elif isinstance(update, Exception):
+                        progress_label.configure(text = "Export failed: {0}".format(update))
+                        ok_button.configure(state = "normal")
+                        export.protocol("WM_DELETE_WINDOW", export.destroy)
+                        return
+                    else:
+                        export.destroy()
+                        return
+                export.after(100, poll)
+
+            def cancel():
+                job.cancelled = True
+                progress_label.configure(text = "Cancelling, run the export again to resume")
+
+            ok_button.configure(state = "disabled")
+            export.protocol("WM_DELETE_WINDOW", cancel)
+            threading.Thread(target = run, daemon = True).start()
+            poll()
+
         ok_button = tk.Button(export, text = "Okay", command = confirm)
         ok_button.grid(row = 3, column = 1, padx = 10, pady = 10, sticky = "e")
+
+        progress_bar = ttk.Progressbar(export, mode = "determinate")
+        progress_bar.grid(row = 4, column = 0, columnspan = 2, padx = 10, sticky = "nsew")
+
+        progress_label = tk.Label(export, text = "")
+        progress_label.grid(row = 5, column = 0, columnspan = 2, padx = 10, pady = 10, sticky = "w")
         
     def add_ignored(self):
         def create_ignored_marker(event):
@@ -581,12 +653,11 @@ class OptionBar(tk.Frame):
             """
             x = event.x
             y = event.y
-            canvas_x = self.marker_canvas.canvasx(x)
-            canvas_y = self.marker_canvas.canvasy(y)
+            canvas_x, canvas_y = canvas_to_image(self.marker_canvas, self.marker_canvas.canvasx(x), self.marker_canvas.canvasy(y))
             coords = (canvas_x, canvas_y)
             
             GridIgnored(self.marker_canvas,self.folder_path, canvas_x, canvas_y)
-            FileManagement(self.folder_path).add_ignored(coords)
+            self.fm.add_ignored(coords)
             
         def reset(event):
             self.marker_canvas.configure(cursor = "")
@@ -650,38 +721,22 @@ class OptionBar(tk.Frame):
             secondary_selection.append(x)
         return secondary_selection
             
+    @timed("client.show_select_markers")
     def show_select_markers(self):
         """Toggles which markers get shown based on the filter
 
-        Takes seconday_selection and body_selection and shows the markers based on those requirements
-        from FileManagement.
+        Takes seconday_selection and body_selection and shows the markers based on those requirements,
+        matching what FileManagement.query_images returns.
         """
-        all_data = FileManagement(self.folder_path).query_images(config.all_bodies, False, False, False, False)
-        for i in all_data:
-            self.grid_canvas.delete("m" + str(i[0]))
-        
         bodies = self._get_body_selection()
         secondary_selection = self._get_secondary_selection()
         
-        data = FileManagement(self.folder_path).query_images(bodies, secondary_selection[0], secondary_selection[1], 
-                               secondary_selection[2], secondary_selection[3])
-        for i in data:
-            body_info = {}
-            x = 0
-            for choice in ("time", "body_name", "body_number", "x", "y"):
-                body_info[choice] = i[x]
-                x += 1
-            GridMark(self.marker_canvas, self.folder_path, body_info)
+        MarkerLayer.of(self.marker_canvas, self.folder_path).set_filter(bodies, secondary_selection[0], secondary_selection[1], 
+                                                                        secondary_selection[2], secondary_selection[3])
             
     def show_ignored(self):
-        ignored = FileManagement(self.folder_path).query_all_ignored()
-        if self.ignored_var.get() == False:
-            for coords in ignored:
-                tag = "i{0}{1}".format(coords[0], coords[1])
-                self.marker_canvas.delete(tag)
-        else:
-            for coords in ignored:
-                GridIgnored(self.marker_canvas,self.folder_path, coords[0], coords[1])
+        """Toggles ignored markers on and off."""
+        MarkerLayer.of(self.marker_canvas, self.folder_path).set_show_ignored(self.ignored_var.get())
             
 
 class OpeningWindow:
@@ -734,7 +789,7 @@ class OpeningWindow:
         self.button_frame.destroy()
         i = Application(root, path=path)
 
-    def confirm_function(self, name, folder_path, file_path, nf):
+    def confirm_function(self, name, folder_path, file_path, nf, rows = None, columns = None):
         """Initializes a new folder and creates a success label
 
         Calls FileManagement to initate a folder with a grid image file 
@@ -744,13 +799,17 @@ class OpeningWindow:
             folder_path (str): Path to folder where images will be saved selected from the askdirectory.
             file_path (str): Path to the gridfile image to be copied into the saving folder.
             nf (tk.Toplevel): Toplevel window to select the folder path and file path.
+            rows (int): Rows of grid squares, config.grid_rows if None.
+            columns (int): Columns of grid squares, config.grid_columns if None.
         """
         if folder_path == "" or file_path == "" or name == "":
             return
+        if (rows is not None and rows < 1) or (columns is not None and columns < 1):
+            return
         
         nf.destroy()
 
-        FileManagement(folder_path + "/").initiate_folder(file_path, name)
+        FileManagement(folder_path + "/").initiate_folder(file_path, name, rows, columns)
         
         done_screen = tk.Toplevel()
 
@@ -796,7 +855,23 @@ class OpeningWindow:
         name_ebox = tk.Entry(nf, textvariable = name, width = 50)
         name_ebox.grid(row = 6, column = 0)
 
-        confirm_button = tk.Button(nf, text = "Confirm", command = lambda: self.confirm_function(name.get(), folder_path.get(), file_name.get(), nf))
+        grid_frame = tk.Frame(nf)
+        grid_frame.grid(row = 7, column = 0, sticky = 'w')
+        rows = tk.IntVar(value = config.grid_rows)
+        columns = tk.IntVar(value = config.grid_columns)
+        tk.Label(grid_frame, text = "Grid rows:").pack(side = "left")
+        tk.Spinbox(grid_frame, from_ = 1, to = 99, textvariable = rows, width = 4).pack(side = "left")
+        tk.Label(grid_frame, text = "columns:").pack(side = "left")
+        tk.Spinbox(grid_frame, from_ = 1, to = 99, textvariable = columns, width = 4).pack(side = "left")
+
+        def confirm():
+            try:
+                grid_size = (rows.get(), columns.get())
+            except tk.TclError: # not a number
+                return
+            self.confirm_function(name.get(), folder_path.get(), file_name.get(), nf, *grid_size)
+
+        confirm_button = tk.Button(nf, text = "Confirm", command = confirm)
         confirm_button.grid(row = 8, column = 1)
 
         folder_label = tk.Label(nf, text = "Enter an empty folder directory:")
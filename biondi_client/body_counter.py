@@ -0,0 +1,182 @@
+import json
+
+class BodyCounter():
+    """Keeps running counts of the bodies saved in a case.
+
+    The counts are loaded from the database and the write queue once and then
+    kept up to date by FileManagement and WriteBehind whenever a body is saved,
+    deleted or edited. Anything that
+    shows a count subscribes to the counter and is called back on every change
+    instead of querying the database on a timer.
+
+    Counts are stored per combination of body name and the four secondary flags
+    so any filter can be answered from memory.
+
+    Attributes:
+        conn: A connection to the case's sqlite3 database used for the first load.
+        groups (dict): Count of bodies keyed by (body name, GR, MAF, MP, unsure).
+        listeners (list): Functions called with the counter after every change.
+
+    Typical usage example:
+        counter = FileManagement(folder_path).session.counter
+        counter.subscribe(lambda counter: print(counter.total))
+    """
+    flags = ("GR", "MAF", "MP", "unsure")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.groups = None
+        self.listeners = []
+
+    def load(self):
+        """Loads the counts from the database if they have not been loaded yet.
+
+        Saves still waiting in the write queue are counted as if they were written,
+        the same way the background writer counts them when they are queued. Both
+        tables are read in one transaction so a save the writer finishes meanwhile
+        is counted once.
+        """
+        if self.groups is not None:
+            return
+        count_query = '''SELECT BODY_NAME, GR, MAF, MP, UNSURE, COUNT(*)
+                        FROM bodies
+                        GROUP BY BODY_NAME, GR, MAF, MP, UNSURE'''
+        counted_query = '''SELECT BODY_NAME, GR, MAF, MP, UNSURE FROM bodies WHERE TIME = ?'''
+        queue_query = '''SELECT KIND, ARGS FROM write_queue ORDER BY SEQ'''
+        own_transaction = not self.conn.in_transaction
+        if own_transaction:
+            self.conn.execute("BEGIN")
+        try:
+            groups = {}
+            for row in self.conn.execute(count_query):
+                key = self._key(row[0], row[1:5])
+                groups[key] = groups.get(key, 0) + row[5]
+
+            # group of every body a queued save touches, by time
+            queued = {}
+            for kind, args in self.conn.execute(queue_query).fetchall():
+                args = json.loads(args)
+                if kind == "save_image":
+                    key = self._info_key(args["body_info"])
+                    queued[args["body_info"]["time"]] = key
+                    groups[key] = groups.get(key, 0) + 1
+                elif kind == "edit_info":
+                    edited_info = args["edited_info"]
+                    time = edited_info[-1]
+                    if time not in queued:
+                        row = self.conn.execute(counted_query, (time,)).fetchone()
+                        queued[time] = None if row is None else self._key(row[0], row[1:5])
+                    if queued[time] is None:
+                        continue
+                    groups[queued[time]] -= 1
+                    queued[time] = self._key(edited_info[0], edited_info[1:5])
+                    groups[queued[time]] = groups.get(queued[time], 0) + 1
+        finally:
+            if own_transaction:
+                self.conn.commit()
+        self.groups = {key: count for key, count in groups.items() if count > 0}
+
+    def _key(self, body_name, flags):
+        return (body_name,) + tuple(bool(flag) for flag in flags)
+
+    def _info_key(self, body_info):
+        return self._key(body_info["body_name"], [body_info[flag] for flag in self.flags])
+
+    def _loaded_with_change(self):
+        """Loads the counts if they were not loaded yet, True if it did.
+
+        Every change is made in the database or the write queue before the counter
+        hears of it, so counts loaded then already include the change.
+        """
+        if self.groups is not None:
+            return False
+        self.load()
+        return True
+
+    def _adjust(self, key, amount):
+        self.groups[key] = self.groups.get(key, 0) + amount
+        if self.groups[key] <= 0:
+            del self.groups[key]
+
+    def add(self, body_info):
+        """Counts a newly saved body.
+
+        Args:
+            body_info (dict): Body information with at least the body_name, GR,
+                MAF, MP and unsure keys.
+        """
+        if not self._loaded_with_change():
+            self._adjust(self._info_key(body_info), 1)
+        self.notify()
+
+    def remove(self, body_info):
+        """Removes a deleted body from the counts."""
+        if not self._loaded_with_change():
+            self._adjust(self._info_key(body_info), -1)
+        self.notify()
+
+    def change(self, old_info, new_info):
+        """Moves an edited body from its old group to its new group."""
+        if not self._loaded_with_change():
+            self._adjust(self._info_key(old_info), -1)
+            self._adjust(self._info_key(new_info), 1)
+        self.notify()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self):
+        for listener in list(self.listeners):
+            listener(self)
+
+    @property
+    def total(self):
+        """The number of bodies in the case."""
+        self.load()
+        return sum(self.groups.values())
+
+    def count(self, body_param, GR_param, MAF_param, MP_param, unsure_param):
+        """Counts bodies the same way as FileManagement.count_bodies.
+
+        Args:
+            body_param (list): a list of the requested biondi types.
+            GR_param (bool): True if counting only GR
+            MAF_param (bool): True if counting only MAF
+            MP_param (bool): True if counting only MP
+            unsure_param (bool): True if counting only unsure
+        """
+        self.load()
+        required = (GR_param, MAF_param, MP_param, unsure_param)
+        number = 0
+        for key, amount in self.groups.items():
+            if key[0] not in body_param:
+                continue
+            if all(flag or not needed for flag, needed in zip(key[1:], required)):
+                number += amount
+        return number
+
+    def count_type(self, body_name):
+        """Returns the number of bodies of a single type."""
+        return self.count([body_name], False, False, False, False)
+
+    def count_flag(self, flag):
+        """Returns the number of bodies with a secondary flag (GR, MAF, MP or unsure)."""
+        index = self.flags.index(flag) + 1
+        self.load()
+        return sum(amount for key, amount in self.groups.items() if key[index])
+
+    def by_type(self):
+        """Returns a dict of body name to count."""
+        self.load()
+        counts = {}
+        for key, amount in self.groups.items():
+            counts[key[0]] = counts.get(key[0], 0) + amount
+        return counts
+
+    def by_flag(self):
+        """Returns a dict of secondary flag to count."""
+        return {flag: self.count_flag(flag) for flag in self.flags}
@@ -0,0 +1,195 @@
+import tkinter as tk
+import re
+
+class BodyListModel():
+    """The rows of the body list and the type-ahead search over them.
+
+    Kept apart from the widget so it can be used without a display.
+
+    Attributes:
+        rows (list): Tuples of time, body name and body number, in display order.
+        labels (list): The "name number" label of every row.
+        positions (dict): Row index keyed by time.
+    """
+    def __init__(self):
+        self.set_rows([])
+
+    def set_rows(self, rows):
+        """Replaces the rows, taking anything shaped like a query_images result."""
+        self.rows = [(row[0], row[1], row[2]) for row in rows]
+        self.labels = ["{} {}".format(name, number) for time, name, number in self.rows]
+        self.positions = {row[0]: i for i, row in enumerate(self.rows)}
+        self._exact = {label.lower(): i for i, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def find(self, text):
+        """Returns the index of the row best matching typed text, or None.
+
+        "green spear 140" finds green spear number 140, "green spear" finds the first
+        one and "green spear 14" finds number 14, or the first whose number starts
+        with 14 if there is no 14. Names starting with the text are preferred over
+        names containing it, so "gre" finds green spears or rods and "spear 140"
+        finds a spear type numbered 140.
+        """
+        text = " ".join(text.lower().split())
+        if text == "":
+            return None
+        if text in self._exact:
+            return self._exact[text]
+
+        match = re.fullmatch(r"(.*?)\s*(\d+)", text)
+        if match is None:
+            return self._search(text, lambda body_number: True)
+        name, number = match.group(1), match.group(2)
+        found = self._search(name, lambda body_number: str(body_number) == str(int(number)))
+        if found is None:
+            found = self._search(name, lambda body_number: str(body_number).startswith(number))
+        return found
+
+    def _search(self, name, number_matches):
+        """Returns the index of the row best matching name whose number passes number_matches, or None."""
+        starts = None
+        contains = None
+        for i, (time, body_name, body_number) in enumerate(self.rows):
+            if not number_matches(body_number):
+                continue
+            body_name = body_name.lower()
+            if body_name == name:
+                return i
+            if starts is None and body_name.startswith(name):
+                starts = i
+            if contains is None and name in body_name:
+                contains = i
+        return starts if starts is not None else contains
+
+class BodyList(tk.Frame):
+    """A scrolling list of bodies that only draws the rows in view.
+
+    The rows are canvas items instead of buttons. A pool just big enough to fill
+    the visible height is moved and relabeled as the list scrolls, so the number
+    of items stays the same no matter how many bodies the case has. Changing the
+    rows updates the pool in place. Typing in the search box jumps to a body,
+    e.g. "spear 140", and enter opens it.
+
+    Attributes:
+        model (BodyListModel): The rows and their search.
+        command (function): Called with the time of a body when it is clicked.
+        search (tk.StringVar): The type-ahead text.
+        canvas (tk.Canvas): The canvas the rows are drawn on.
+        pool (list): (background, text) canvas item pairs reused for the visible rows.
+        selected (int): Time of the highlighted body, None if none is.
+
+    Typical usage example:
+        body_list = BodyList(master, command = self.open_file)
+        body_list.set_rows(fm.query_images(config.all_bodies, False, False, False, False))
+    """
+    row_height = 34
+    width = 210
+    font = "Dosis"
+
+    def __init__(self, master, command):
+        tk.Frame.__init__(self, master)
+        self.model = BodyListModel()
+        self.command = command
+        self.selected = None
+        self.pool = []
+        self._matched = None
+
+        self.search = tk.StringVar()
+        search_entry = tk.Entry(self, textvariable = self.search)
+        search_entry.pack(side = tk.TOP, fill = tk.X, padx = 10, pady = 5)
+        search_entry.bind("<KeyRelease>", self._on_search)
+        search_entry.bind("<Return>", self._on_search_enter)
+
+        scrollbar = tk.Scrollbar(self, orient = "vertical")
+        self.canvas = tk.Canvas(self, bd = 0, highlightthickness = 0, width = self.width,
+                                yscrollincrement = self.row_height,
+                                yscrollcommand = lambda *args: self._on_scroll(scrollbar, *args))
+        scrollbar.config(command = self.canvas.yview)
+        self.canvas.pack(side = tk.LEFT, fill = tk.Y)
+        scrollbar.pack(side = tk.LEFT, fill = tk.BOTH)
+
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+
+    def set_rows(self, rows):
+        """Shows new rows, keeping the scroll position where it can."""
+        self.model.set_rows(rows)
+        self._matched = self.model.find(self.search.get())
+        self.canvas.configure(scrollregion = (0, 0, self.width, len(self.model) * self.row_height))
+        self.redraw()
+
+    def _on_scroll(self, scrollbar, *args):
+        scrollbar.set(*args)
+        self.redraw()
+
+    def _on_wheel(self, event):
+        if event.num == 5 or event.delta < 0:
+            self.canvas.yview("scroll", 3, "units")
+        else:
+            self.canvas.yview("scroll", -3, "units")
+
+    def _ensure_pool(self, size):
+        while len(self.pool) < size:
+            background = self.canvas.create_rectangle(0, 0, 0, 0, width = 0)
+            text = self.canvas.create_text(0, 0, font = self.font, fill = "purple3")
+            self.pool.append((background, text))
+
+    def redraw(self):
+        """Moves the pooled items onto the rows currently in view."""
+        visible_rows = self.canvas.winfo_height() // self.row_height + 2
+        self._ensure_pool(visible_rows)
+        first = max(0, int(self.canvas.canvasy(0) // self.row_height))
+        for offset, (background, text) in enumerate(self.pool):
+            i = first + offset
+            if offset >= visible_rows or i >= len(self.model):
+                self.canvas.itemconfigure(background, state = "hidden")
+                self.canvas.itemconfigure(text, state = "hidden")
+                continue
+            top = i * self.row_height
+            fill = "gray80" if i == self._matched or self.model.rows[i][0] == self.selected else "gray99"
+            self.canvas.coords(background, 10, top + 3, self.width - 10, top + self.row_height - 3)
+            self.canvas.itemconfigure(background, state = "normal", fill = fill)
+            self.canvas.coords(text, self.width / 2, top + self.row_height / 2)
+            self.canvas.itemconfigure(text, state = "normal", text = self.model.labels[i])
+
+    def row_at(self, y):
+        i = int(self.canvas.canvasy(y) // self.row_height)
+        if 0 <= i < len(self.model):
+            return i
+        return None
+
+    def _on_click(self, event):
+        i = self.row_at(event.y)
+        if i is not None:
+            self.command(self.model.rows[i][0])
+
+    def select(self, time):
+        """Highlights a body and scrolls it into view."""
+        self.selected = time
+        if time in self.model.positions:
+            self.see(self.model.positions[time])
+        self.redraw()
+
+    def see(self, i):
+        """Scrolls so row i is in view."""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        row_top = i * self.row_height
+        if row_top < top or row_top + self.row_height > bottom:
+            self.canvas.yview_moveto(row_top / max(1, len(self.model) * self.row_height))
+
+    def _on_search(self, event):
+        self._matched = self.model.find(self.search.get())
+        if self._matched is not None:
+            self.see(self._matched)
+        self.redraw()
+
+    def _on_search_enter(self, event):
+        if self._matched is not None:
+            self.command(self.model.rows[self._matched][0])
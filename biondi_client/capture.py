@@ -0,0 +1,148 @@
+"""Screen capture backends used by LilSnippy.
+
+Every backend grabs a region of the screen as an RGB PIL image. mss reads the
+screen through X11 shared memory (or the native API on Windows and macOS) and
+is used when it is installed. pyautogui is the fallback the client always used.
+The file backend crops from an image file instead of the screen, so the
+capture step can run headless in benchmarks and give the same pixels every time.
+
+Typical usage example:
+    im = get_backend().grab(left, top, width, height)
+
+    python capture.py --repeat 50 --size 400 300
+"""
+import os
+import time
+import tempfile
+import argparse
+import statistics
+from PIL import Image
+import config
+
+class MssCapture():
+    """Captures through mss, which uses the XShm extension on X11.
+
+    One mss instance is kept open so the connection to the display and the shared
+    memory segment are reused between captures.
+
+    Raises:
+        ImportError: mss is not installed.
+    """
+    name = "mss"
+
+    def __init__(self):
+        import mss
+        self.sct = mss.mss()
+
+    def grab(self, left, top, width, height):
+        shot = self.sct.grab({"left": int(left), "top": int(top), "width": int(width), "height": int(height)})
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+    def close(self):
+        self.sct.close()
+
+class PyAutoGuiCapture():
+    """Captures through pyautogui, which saves a full screenshot and crops it on X11."""
+    name = "pyautogui"
+
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def grab(self, left, top, width, height):
+        return self.pyautogui.screenshot(region = (int(left), int(top), int(width), int(height))).convert("RGB")
+
+    def close(self):
+        pass
+
+class FileCapture():
+    """Crops regions from an image file as if it were the screen.
+
+    Regions are clipped to the image the same way a screen capture is clipped to
+    the screen.
+
+    Attributes:
+        image (PIL Image): The stand in for the screen.
+    """
+    name = "file"
+
+    def __init__(self, image_path):
+        with Image.open(image_path) as image:
+            self.image = image.convert("RGB")
+
+    def grab(self, left, top, width, height):
+        box = (max(0, int(left)), max(0, int(top)),
+               min(self.image.width, int(left + width)), min(self.image.height, int(top + height)))
+        return self.image.crop(box)
+
+    def close(self):
+        pass
+
+backends = {"mss": MssCapture,
+            "pyautogui": PyAutoGuiCapture}
+
+_backend = None
+
+def get_backend(name = None):
+    """Returns the capture backend, made on first use.
+
+    Args:
+        name (str): "mss", "pyautogui", "file:path/to/image" or "auto". Defaults to
+            config.capture_backend. "auto" uses mss if it is installed, otherwise
+            pyautogui.
+    """
+    global _backend
+    if name is None:
+        if _backend is None:
+            _backend = make_backend(config.capture_backend)
+        return _backend
+    return make_backend(name)
+
+def make_backend(name):
+    if name.startswith("file:"):
+        return FileCapture(name[len("file:"):])
+    if name == "auto":
+        try:
+            return MssCapture()
+        except ImportError:
+            return PyAutoGuiCapture()
+    return backends[name]()
+
+def benchmark(backend, width, height, repeat):
+    """Returns the capture times of a backend in milliseconds, after one warm up capture."""
+    backend.grab(0, 0, width, height)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        backend.grab(i % 8, i % 8, width, height)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compares capture latency of the screen capture backends.")
+    parser.add_argument("--repeat", type = int, default = 50)
+    parser.add_argument("--size", type = int, nargs = 2, default = (400, 300), metavar = ("WIDTH", "HEIGHT"))
+    parser.add_argument("--image", help = "image for the file backend, a noise 1920x1080 image if left out")
+    parser.add_argument("--backends", nargs = "+", default = ["mss", "pyautogui", "file"])
+    args = parser.parse_args()
+
+    for name in args.backends:
+        try:
+            if name == "file":
+                if args.image is None:
+                    with tempfile.TemporaryDirectory() as temp_dir:
+                        image_path = os.path.join(temp_dir, "screen.png")
+                        Image.effect_noise((1920, 1080), 64).convert("RGB").save(image_path)
+                        backend = FileCapture(image_path)
+                else:
+                    backend = FileCapture(args.image)
+            else:
+                backend = make_backend(name)
+            times = benchmark(backend, args.size[0], args.size[1], args.repeat)
+            backend.close()
+        except Exception as error:
+            # no display or the library is missing
+            print("{0:10} unavailable: {1}".format(name, error))
+            continue
+        print("{0:10} median {1:8.2f} ms  min {2:8.2f} ms  max {3:8.2f} ms".format(
+              name, statistics.median(times), min(times), max(times)))
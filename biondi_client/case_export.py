@@ -0,0 +1,308 @@
+import sqlite3
+import csv
+import json
+import os
+import filecmp
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from image_store import ImageStore
+from annotations import AnnotationStore
+
+def merge_img(folder_path, time, img, new_name, scale = 1):
+    """Concentate annotation and body image to one png.
+
+    Module level so it can run in a worker process. Vector annotations are
+    rendered at the scale of the output instead of being resized.
+
+    Args:
+        folder_path (str): The directory to the case folder with a slash added.
+        time (int): The TIME of the body whose annotation is merged
+        img (str): name of the image file to be merged
+        new_name (str): the path the concentated image is saved to
+        scale (float): size of the output relative to the screenshot
+    """
+    body_img = ImageStore.of(folder_path).open(img)
+    annotation_img = AnnotationStore.of(folder_path).open(time, scale)
+    if scale != 1:
+        body_img = body_img.resize(annotation_img.size, Image.LANCZOS)
+    body_img.paste(annotation_img, (0,0), annotation_img)
+    body_img.save(new_name)
+    return new_name
+
+def source_stamp(folder_path, time, img):
+    """Returns stamps that change whenever a body's image or annotation is saved."""
+    return list(ImageStore.of(folder_path).stamp(img) + AnnotationStore.of(folder_path).stamp(time))
+
+def source_hash(folder_path, time, img):
+    """Returns a hash of the contents of a body's image and annotation."""
+    digest = hashlib.sha1()
+    digest.update(ImageStore.of(folder_path).read(img))
+    digest.update(AnnotationStore.of(folder_path).read(time))
+    return digest.hexdigest()
+
+def export_body(folder_path, time, img, new_name, old_hash):
+    """Merges a body unless its output already holds the same image and annotation.
+
+    Module level so it can run in a worker process.
+
+    Args:
+        old_hash (str): The hash recorded when new_name was last exported, None
+            if the body was never exported under that name.
+
+    Returns:
+        content_hash (str): The hash of the body's image and annotation.
+    """
+    content_hash = source_hash(folder_path, time, img)
+    if content_hash != old_hash or not os.path.exists(new_name):
+        merge_img(folder_path, time, img, new_name)
+    return content_hash
+
+def export_name(case_name, annotator_name, body_name, body_number, GR, MAF, MP):
+    """Returns the exported file name of a body.
+
+    The format is CASE_BODY NAME_ANNOTATOR INITIALS_BODY NUMBER_GR_MAF_MP. GR, MAF,
+    and MP are only added if the body possesses those characteristics.
+    """
+    img_name = "{0}_{1}_{2}_{3}".format(case_name, body_name, annotator_name, body_number)
+    if GR == 1:
+        img_name += "_GR"
+    if MAF == 1:
+        img_name += "_MAF"
+    if MP == 1:
+        img_name += "_MP"
+    return img_name + ".png"
+
+class CaseExport():
+    """Exports every body of a case as merged images and csv files.
+
+    Rows are streamed from the case database in TIME order and the merges are run
+    in a process pool with a bounded number of merges in flight. The export is
+    incremental: a manifest in the export folder records the file name, the source
+    file stamps and a content hash of every exported body keyed by its TIME. A body
+    is only merged again when its name changed or its image or annotation hash
+    changed, files of deleted or renamed bodies are removed and the csv files are
+    only replaced when their contents change. The manifest is saved as the export
+    goes so an interrupted export picks up where it left off. The export opens its
+    own connection so it can run on a background thread while the client keeps
+    using the shared one.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+        new_folder_path (str): The directory the case is exported to with a slash added.
+        case_name (str): The case name put in front of every exported file.
+        progress (function): Called with the number of finished and total bodies.
+        workers (int): Number of worker processes. Merges run in this process if 1 or less.
+        manifest_path (str): Path to the manifest of the export.
+        exported (dict): Manifest entries (name, stamp and hash) keyed by the TIME of the body.
+        stale (set): File names that were replaced during this export.
+        merged (int): Number of bodies hashed and merged if needed during this export.
+        cancelled (bool): Set to stop the export after the merges in flight finish.
+
+    Typical usage example:
+        CaseExport(folder_path, new_folder_path, case_name, progress = print).run()
+    """
+    batch_size = 64
+    save_every = 25
+
+    def __init__(self, folder_path, new_folder_path, case_name, progress = None, workers = None):
+        self.folder_path = folder_path
+        self.new_folder_path = new_folder_path
+        self.case_name = case_name
+        self.progress = progress
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.manifest_path = "{0}{1}-manifest.json".format(new_folder_path, case_name)
+        self.exported = {}
+        self.stale = set()
+        self.merged = 0
+        self.cancelled = False
+
+    def load_manifest(self):
+        """Loads the bodies exported by an earlier run of the same export."""
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return
+        if manifest.get("case_name") != self.case_name:
+            return
+        self.exported = {int(time): entry for time, entry in manifest.get("exported", {}).items()
+                         if isinstance(entry, dict)}
+
+    def save_manifest(self):
+        """Writes the manifest to a temporary file first so it is never left half written."""
+        manifest = {"case_name": self.case_name,
+                    "source": self.folder_path,
+                    "exported": {str(time): entry for time, entry in self.exported.items()}}
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, self.manifest_path)
+
+    def report(self, done, total):
+        if self.progress is not None:
+            self.progress(done, total)
+
+    def is_unchanged(self, entry, name, stamp):
+        """True if the body was exported under the same name from files that were not touched since."""
+        return (entry is not None and entry["name"] == name and entry["stamp"] == stamp
+                and os.path.exists(self.new_folder_path + name))
+
+    def stream_rows(self, c):
+        """Yields the bodies of the case a batch at a time."""
+        all_files_query = '''SELECT TIME,
+                            ANNOTATOR_NAME,
+                            BODY_NAME,
+                            BODY_NUMBER,
+                            GR,
+                            MAF,
+                            MP,
+                            BODY_FILE_NAME
+                            FROM numbered_bodies
+                            ORDER BY TIME'''
+        c.execute(all_files_query)
+        while True:
+            rows = c.fetchmany(self.batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def export_images(self, conn):
+        """Merges every body that changed since the last export.
+
+        Returns:
+            bool: True if every image was exported, False if cancelled.
+        """
+        total = conn.execute('''SELECT COUNT(*) FROM bodies''').fetchone()[0]
+        done = 0
+        self.report(done, total)
+
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        pending = {}
+        seen = set()
+        try:
+            for row in self.stream_rows(conn.cursor()):
+                if self.cancelled:
+                    break
+                time = row[0]
+                seen.add(time)
+                name = export_name(self.case_name, *row[1:7])
+                stamp = source_stamp(self.folder_path, time, row[7])
+                entry = self.exported.get(time)
+                if self.is_unchanged(entry, name, stamp):
+                    done += 1
+                    self.report(done, total)
+                    continue
+
+                # the old hash only counts if the output still has the same name
+                old_hash = entry["hash"] if entry is not None and entry["name"] == name else None
+                args = (self.folder_path, time, row[7], self.new_folder_path + name, old_hash)
+                if pool is None:
+                    self.finish(time, name, stamp, export_body(*args))
+                    done += 1
+                    self.report(done, total)
+                    continue
+
+                pending[pool.submit(export_body, *args)] = (time, name, stamp)
+                # keeps the number of merges in flight bounded instead of queueing the whole case
+                if len(pending) >= self.workers * 2:
+                    done += self.collect(pending)
+                    self.report(done, total)
+
+            while pending:
+                done += self.collect(pending)
+                self.report(done, total)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+            if not self.cancelled:
+                for time in set(self.exported) - seen:
+                    self.stale.add(self.exported.pop(time)["name"])
+            self.remove_stale()
+            self.save_manifest()
+        return not self.cancelled
+
+    def collect(self, pending):
+        """Waits for at least one merge and returns how many finished."""
+        finished, _ = wait(pending, return_when = FIRST_COMPLETED)
+        for future in finished:
+            time, name, stamp = pending.pop(future)
+            self.finish(time, name, stamp, future.result())
+        return len(finished)
+
+    def finish(self, time, name, stamp, content_hash):
+        old_entry = self.exported.get(time)
+        if old_entry is not None and old_entry["name"] != name:
+            self.stale.add(old_entry["name"])
+        self.exported[time] = {"name": name, "stamp": stamp, "hash": content_hash}
+        self.merged += 1
+        if self.merged % self.save_every == 0:
+            self.save_manifest()
+
+    def remove_stale(self):
+        """Deletes replaced files that no body in the manifest is exported as anymore."""
+        current = set(entry["name"] for entry in self.exported.values())
+        for name in self.stale - current:
+            try:
+                os.remove(self.new_folder_path + name)
+            except FileNotFoundError:
+                pass
+        self.stale.clear()
+
+    def write_if_changed(self, path, c):
+        """Writes a query result to a csv file, leaving the file alone if nothing changed."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", newline = "") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow([i[0] for i in c.description])
+            while True:
+                rows = c.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                csv_writer.writerows(rows)
+        if os.path.exists(path) and filecmp.cmp(temp_path, path, shallow = False):
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, path)
+        return True
+
+    def export_csv(self, conn):
+        """Streams the body and grid tables into csv files for review."""
+        all_info_query = '''SELECT TIME,
+                            ANNOTATOR_NAME,
+                            BODY_NAME,
+                            BODY_NUMBER,
+                            X_POSITION,
+                            Y_POSITION,
+                            GRID_ID,
+                            GR,
+                            MAF,
+                            MP,
+                            UNSURE,
+                            NOTES,
+                            ANGLE,
+                            LOG,
+                            DPRONG1,
+                            LPRONG2
+                            FROM numbered_bodies
+                            ORDER BY TIME'''
+        grid_query = '''SELECT * from grid'''
+
+        for query, suffix in ((all_info_query, "bodies"), (grid_query, "grid")):
+            self.write_if_changed(f"{self.new_folder_path}{self.case_name}-{suffix}.csv", conn.execute(query))
+
+    def run(self):
+        """Runs the whole export.
+
+        Returns:
+            bool: True if the export finished, False if it was cancelled.
+        """
+        self.load_manifest()
+        conn = sqlite3.connect(self.folder_path + "body_database.db")
+        try:
+            if not self.export_images(conn):
+                return False
+            self.export_csv(conn)
+        finally:
+            conn.close()
+        return True
@@ -0,0 +1,125 @@
+import sqlite3
+import os
+import json
+import atexit
+import threading
+from body_counter import BodyCounter
+from query_cache import QueryCache
+import schema
+
+class WritesPending(Exception):
+    """Raised when a direct write to a case would run ahead of saves still being written."""
+
+class CaseSession():
+    """A long lived connection to the database of one case folder.
+
+    Opening a sqlite3 connection, running the backwards compatability DDL and
+    closing it again on every click is slow on network mounted case folders. A
+    CaseSession keeps one connection per case folder open for the whole process
+    so every FileManagement built for that folder shares it. The connection uses
+    WAL journaling and a large statement cache so the handful of queries the client
+    runs are only prepared once. Older case databases are migrated to the current
+    schema when the session is opened.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+        db_path (str): The path to the case database.
+        conn: The shared connection to the sqlite3 database.
+        counter (BodyCounter): Running body counts of the case, loaded on first use.
+        queries (QueryCache): Results of the body filter queries, cleared on every write.
+        reserved_times (set): TIMEs handed out to bodies that are not in the bodies table
+            yet, see FileManagement.get_free_time.
+        writer (WriteBehind): The background writer of the case once it is started.
+
+    Typical usage example:
+        session = CaseSession.get(folder_path)
+        c = session.cursor()
+    """
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.db_path = folder_path + "body_database.db"
+
+        self.conn = sqlite3.connect(self.db_path, cached_statements = 256)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+
+        # upgrades cases made with an older version of the client
+        schema.migrate(self.conn)
+
+        self.counter = BodyCounter(self.conn)
+        self.queries = QueryCache()
+        self.reserved_times = self._queued_times()
+        self.writer = None
+
+    def _queued_times(self):
+        """Returns the TIMEs of new bodies still waiting in the write queue or kept in write_failed."""
+        if schema.get_version(self.conn) < 7:
+            return set()
+        times = set()
+        for table in ("write_queue", "write_failed"):
+            for (args,) in self.conn.execute('''SELECT ARGS FROM {0} WHERE KIND = 'save_image' '''.format(table)):
+                times.add(json.loads(args)["body_info"]["time"])
+        return times
+
+    @staticmethod
+    def _key(folder_path):
+        return os.path.normcase(os.path.abspath(folder_path))
+
+    @classmethod
+    def get(cls, folder_path):
+        """Returns the session of a case folder, opening it on first use.
+
+        Args:
+            folder_path (str): The directory to the case folder with a slash added.
+        """
+        key = cls._key(folder_path)
+        with cls._sessions_lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                session = cls(folder_path)
+                cls._sessions[key] = session
+        return session
+
+    @classmethod
+    def close_all(cls):
+        """Commits and closes every open session. Registered to run on exit."""
+        with cls._sessions_lock:
+            sessions = list(cls._sessions.values())
+            cls._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def wait_for_writes(self, timeout):
+        """Waits for the background writer before a write that does not go through it.
+
+        Edits and deletes on the shared connection would otherwise run before saves
+        queued earlier, which then overwrite the edit or bring back the deleted body.
+
+        Args:
+            timeout (float): Seconds to wait for the queued saves.
+
+        Raises:
+            WritesPending: The queued saves were not written within timeout.
+        """
+        if self.writer is not None and not self.writer.flush(timeout):
+            raise WritesPending("{0} saves are still being written".format(self.writer.pending))
+
+    def cursor(self):
+        """Returns a new cursor on the shared connection."""
+        return self.conn.cursor()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        """Commits and closes the connection. Only used when the process exits."""
+        try:
+            self.conn.commit()
+            self.conn.close()
+        except sqlite3.Error as error:
+            print("Error while closing sqlite", error)
+
+atexit.register(CaseSession.close_all)
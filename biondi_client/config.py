@@ -15,4 +15,22 @@ all_bodies = list(body_index.keys())
 
 angler_types = ("green spear", "crescent_spear")
 
-kbell_types = ("ring_kettlebell")
\ No newline at end of file
+kbell_types = ("ring_kettlebell")
+
+# memory budget for decoded body and annotation images kept by the image viewer
+image_cache_mb = 256
+
+# where new cases keep body and annotation images, "loose" png files or "packed" into images.db
+# cases that already have images keep what they use, see image_store.py to convert them
+image_store = "loose"
+
+# how LilSnippy captures the screen: "auto" uses mss when installed and pyautogui otherwise,
+# "mss", "pyautogui", or "file:path/to/image.png" to crop from an image instead of the screen
+capture_backend = "auto"
+
+# rows and columns of grid squares of new cases, cases keep the grid they were made with
+grid_rows = 7
+grid_columns = 7
+
+# seconds the Tk thread waits for the background writer before showing that saves are still pending
+write_wait_seconds = 2
@@ -0,0 +1,110 @@
+import tkinter as tk
+from math import ceil
+from PIL import ImageTk
+from thumbnails import ThumbnailStore
+
+class ContactSheet(tk.Toplevel):
+    """A window paging through thumbnails of the bodies in the image viewer's list.
+
+    Shows a page of thumbnails at a time, labelled with the body name and number,
+    so bodies can be scanned for misclassifications without opening each one.
+    Clicking a thumbnail opens the body in the image viewer. Thumbnails that are
+    not made yet are queued on the store's background thread and filled in as
+    they arrive, until the thread has nothing left to make.
+
+    Attributes:
+        image_viewer (ImageViewer): The viewer whose filtered list is shown.
+        store (ThumbnailStore): The thumbnails of the case.
+        rows (list): Tuples of time, body name and body number being paged through.
+        page (int): The index of the current page.
+        cells (list): The label of every thumbnail on the page.
+        photos (list): The PhotoImages on the page, kept to prevent garbage collection.
+
+    Typical usage example:
+        ContactSheet(image_viewer, image_viewer.body_list.model.rows)
+    """
+    columns = 6
+    page_rows = 4
+
+    def __init__(self, image_viewer, rows):
+        tk.Toplevel.__init__(self)
+        self.title("Contact Sheet")
+        self.image_viewer = image_viewer
+        self.store = ThumbnailStore.of(image_viewer.folder_path)
+        self.rows = list(rows)
+        self.page = 0
+        self.cells = []
+        self.photos = []
+        # an empty image keeps label sizes in pixels while thumbnails are missing
+        self.blank = tk.PhotoImage(width = ThumbnailStore.size, height = ThumbnailStore.size)
+
+        # queues every body of the case, current thumbnails are skipped by the store
+        self.store.schedule_case(image_viewer.fm)
+
+        grid_frame = tk.Frame(self)
+        grid_frame.pack(side = tk.TOP)
+        for i in range(self.columns * self.page_rows):
+            cell = tk.Label(grid_frame, compound = tk.TOP, image = self.blank, width = ThumbnailStore.size + 10,
+                            height = ThumbnailStore.size + 30, bg = "gray99", fg = "purple3", font = "Dosis")
+            cell.grid(row = i // self.columns, column = i % self.columns, padx = 2, pady = 2)
+            cell.bind("<Button-1>", lambda event, i = i: self._on_click(i))
+            self.cells.append(cell)
+
+        nav_frame = tk.Frame(self)
+        nav_frame.pack(side = tk.BOTTOM, fill = tk.X)
+        tk.Button(nav_frame, text = "<", command = lambda: self.show_page(self.page - 1)).pack(side = tk.LEFT, padx = 10, pady = 5)
+        self.page_label = tk.Label(nav_frame, text = "")
+        self.page_label.pack(side = tk.LEFT, expand = True)
+        tk.Button(nav_frame, text = ">", command = lambda: self.show_page(self.page + 1)).pack(side = tk.RIGHT, padx = 10, pady = 5)
+
+        self.bind("<Left>", lambda event: self.show_page(self.page - 1))
+        self.bind("<Right>", lambda event: self.show_page(self.page + 1))
+
+        self.show_page(0)
+
+    @property
+    def page_size(self):
+        return self.columns * self.page_rows
+
+    @property
+    def page_count(self):
+        return max(1, ceil(len(self.rows) / self.page_size))
+
+    def show_page(self, page):
+        """Fills the cells with the thumbnails of a page."""
+        self.page = min(max(page, 0), self.page_count - 1)
+        self.page_label.configure(text = "Page {0} of {1}".format(self.page + 1, self.page_count))
+        self.photos = []
+        missing = False
+        # read before the thumbnails so the last ones made are shown once the thread is done
+        making = self.store.pending > 0
+        first = self.page * self.page_size
+        for i, cell in enumerate(self.cells):
+            if first + i >= len(self.rows):
+                cell.configure(image = self.blank, text = "")
+                continue
+            time, name, number = self.rows[first + i][:3]
+            thumbnail = self.store.get(time)
+            if thumbnail is None:
+                if making and time not in self.store.failed:
+                    missing = True
+                    cell.configure(image = self.blank, text = "{} {} ...".format(name, number))
+                else:
+                    cell.configure(image = self.blank, text = "{} {}".format(name, number))
+                continue
+            photo = ImageTk.PhotoImage(thumbnail)
+            self.photos.append(photo)
+            cell.configure(image = photo, text = "{} {}".format(name, number))
+
+        # fills in thumbnails the background thread is still making, failed ones are left blank
+        if missing:
+            self.after(500, lambda page = self.page: self._refresh(page))
+
+    def _refresh(self, page):
+        if self.winfo_exists() and page == self.page:
+            self.show_page(page)
+
+    def _on_click(self, i):
+        i += self.page * self.page_size
+        if i < len(self.rows):
+            self.image_viewer.open_file(self.rows[i][0])
@@ -1,8 +1,18 @@
 import sqlite3
-import csv
 from shutil import copy
+from instrumentation import instrumented
 from PIL import Image
-from grid_tracker import GridRandomizer
+from grid_tracker import GridRandomizer, GridLayout
+from case_session import CaseSession
+import schema
+import case_export
+from case_export import CaseExport
+from thumbnails import ThumbnailStore
+from image_store import ImageStore
+import annotations
+from query_cache import QueryCache
+import config
+@instrumented
 class FileManagement():
     """A collection of functions used in sqlite3 data manipulation.
 
@@ -13,7 +23,9 @@ class FileManagement():
     Attributes:
         folder_path (str): the directory to the selected folder where all images
             are saved
-        conn: A connection to the sqlite3 database 
+        session (CaseSession): the long lived session of the case folder which is
+            shared by every FileManagement of that folder
+        conn: A connection to the sqlite3 database, owned by the session
         c: the cursor the the previously mentioned sqlite3 database
         
     Typical usage example:
@@ -24,23 +36,17 @@ class FileManagement():
     def __init__(self, folder_path):
         self.folder_path = folder_path
         try:
-            self.conn = sqlite3.connect(self.folder_path + 'body_database.db')
-            self.c = self.conn.cursor()
-            
-            # here for backwards compatability
-            create_ignored_query = '''CREATE TABLE IF NOT EXISTS ignored (X INTEGER NOT NULL,
-                                                                    Y INTEGER NOT NULL)'''
-            self.c.execute(create_ignored_query)
+            # the connection is shared for the whole process instead of reopened per instance
+            self.session = CaseSession.get(self.folder_path)
+            self.conn = self.session.conn
+            self.c = self.session.cursor()
 
         except sqlite3.Error as error:
             print("Error while connecting to sqlite", error)
-            self.conn.close()
-            self.c.close()
 
     def close(self):
+        """Commits any changes. The shared connection is left open for reuse."""
         self.conn.commit()
-        self.c.close()
-        self.conn.close()
     
     def get_grid(self):
         """Returns a tuple of grid ids
@@ -58,6 +64,17 @@ class FileManagement():
         self.close()
         return result
     
+    def get_layout(self, width, height):
+        """Returns the grid layout of the case over a gridfile of width by height.
+
+        Cases without a stored layout have the original 7x7 grid.
+        """
+        self.c.execute('''SELECT ROWS, COLUMNS, SEED FROM grid_layout''')
+        row = self.c.fetchone()
+        if row is None:
+            row = (7, 7, None)
+        return GridLayout(row[0], row[1], width, height, row[2])
+
     def finish_grid(self, grid_id, state):
         """Marks a grid id as finished in the database.
         
@@ -90,6 +107,11 @@ class FileManagement():
         Returns: 
             number (int): The number of bodies counted
         """
+        key = QueryCache.key("count_bodies", body_param, GR_param, MAF_param, MP_param, unsure_param)
+        return self.session.queries.get(key, lambda: self._count_bodies(body_param, GR_param, MAF_param,
+                                                                        MP_param, unsure_param))
+
+    def _count_bodies(self, body_param, GR_param, MAF_param, MP_param, unsure_param):
         counted_bodies = body_param.copy()
         body_param_ph = "?,"*(len(counted_bodies)-1)+"?"
         
@@ -111,7 +133,7 @@ class FileManagement():
         number = c_result[0]
         return number
     
-    def initiate_folder(self, img_path, name):
+    def initiate_folder(self, img_path, name, rows = None, columns = None, seed = None):
         """Preps a folder for biondi body analysis.
         
         Takes a folder directory and creates a new database and gridfile
@@ -120,41 +142,19 @@ class FileManagement():
         Args:
             img_path (str): the path of the grid file being initiated into a new 
                 casefolder.
+            rows (int): Rows of grid squares, config.grid_rows if None.
+            columns (int): Columns of grid squares, config.grid_columns if None.
+            seed (int): Seed of the grid order, a random one if None. It is stored
+                with the grid so the order can be made again.
         """
 
         copy(img_path, self.folder_path + "gridfile.jpg")
-        create_table_query = '''CREATE TABLE IF NOT EXISTS bodies (TIME INTEGER NOT NULL,
-                                                            ANNOTATOR_NAME TEXT,
-                                                            BODY_NAME TEXT NOT NULL, 
-                                                            BODY_NUMBER INTEGER NOT NULL,
-                                                            X_POSITION INTEGER NOT NULL,
-                                                            Y_POSITION INTEGER NOT NULL,
-                                                            GRID_ID TEXT NOT NULL,
-                                                            GR INTEGER,
-                                                            MAF INTEGER,
-                                                            MP INTEGER,
-                                                            UNSURE INTEGER,
-                                                            NOTES TEXT,
-                                                            BODY_FILE_NAME TEXT,
-                                                            ANNOTATION_FILE_NAME TEXT,
-                                                            ANGLE REAL,
-                                                            LOG REAL,
-                                                            DPRONG1 REAL,
-                                                            LPRONG2 REAL)'''
-        self.c.execute(create_table_query)
-        
-        create_grid_query = '''CREATE TABLE IF NOT EXISTS grid (GRID_ID TEXT NOT NULL,
-                                                                    FINISHED INTEGER)'''
-        self.c.execute(create_grid_query)
-        
-        create_ignored_query = '''CREATE TABLE IF NOT EXISTS ignored (X INTEGER NOT NULL,
-                                                                    Y INTEGER NOT NULL)'''
-        self.c.execute(create_ignored_query)
-        
-        create_name_query = '''CREATE TABLE IF NOT EXISTS name (NAME TEXT NOT NULL)'''
-        self.c.execute(create_name_query)
-        
-        randomized = GridRandomizer().get_final_order()
+        schema.create_schema(self.c)
+        
+        randomizer = GridRandomizer(rows or config.grid_rows, columns or config.grid_columns, seed)
+        add_layout_query = '''INSERT INTO grid_layout (ROWS, COLUMNS, SEED) VALUES(?, ?, ?)'''
+        self.c.execute(add_layout_query, (randomizer.rows, randomizer.columns, randomizer.seed))
+        randomized = randomizer.get_final_order()
         random_list = []
         
         for i in randomized:
@@ -170,6 +170,27 @@ class FileManagement():
 
         self.close()
         
+    def get_free_time(self, time):
+        """Returns the first unix time from time onwards that no body uses yet.
+        
+        TIME is the primary key of bodies, so two bodies saved within the same second
+        need different times. Bodies still waiting for the background writer are not
+        in the table yet, so every time handed out is reserved in the session until
+        the process exits and is never handed out twice.
+        
+        Args:
+            time (int): The wanted unix time.
+        """
+        free_time_query = '''SELECT 1 FROM bodies WHERE TIME = ?'''
+        reserved = self.session.reserved_times
+        while True:
+            if time not in reserved:
+                self.c.execute(free_time_query, (time,))
+                if self.c.fetchone() is None:
+                    reserved.add(time)
+                    return time
+            time += 1
+        
     def get_annotator_name(self):
         """Pulls the annotator name from the database"""
         name_query = '''SELECT * FROM name'''
@@ -179,24 +200,36 @@ class FileManagement():
         return name[0]
         
                         
-    def save_image(self, body_info, body_img, annotation_img):
+    def save_image(self, body_info, body_img, strokes):
         """Saves screenshots as image files and adds information to database.
         
-        Takes the pillow images created in screenshotting and converts them to .png. 
+        Takes the pillow image created in screenshotting and converts it to .png. 
         In doing so, adds all relevant information entered in the marker popup into
-        the database for future use.
+        the database for future use. The annotation is saved as vector strokes and
+        rendered when it is viewed or exported.
         
         Args:
             body_info (dict): a collection of information created from the marker popup.
                 Dictionary values are a mixture of strings and ints, with booleans converted
                 to binary when entered into the database.
             body_img (PIL img): image of just the biondi body
-            annotation_img (pil img): image of just the annotation.
+            strokes (list): the annotation strokes, see annotations.Stroke.
         """
             
         data_values = tuple(body_info.values())
-        print(body_info.values())
-        insert_query = '''INSERT INTO bodies (TIME, 
+        self.c.execute(self.insert_query, data_values)
+        self.session.counter.add(body_info)
+        self.session.queries.invalidate()
+        
+        body_info["body_number"] = self.session.counter.count_type(body_info["body_name"]) + 1
+        annotations.save_strokes(self.c, body_info["time"], body_img.size, strokes)
+        ImageStore.of(self.folder_path).save(body_info["body_file_name"], body_img)
+        
+        self.close()
+        ThumbnailStore.of(self.folder_path).schedule([(body_info["time"], body_info["body_file_name"])])
+
+    # shared with the background writer, which runs them on its own connection
+    insert_query = '''INSERT INTO bodies (TIME, 
                                             ANNOTATOR_NAME, 
                                             BODY_NAME, 
                                             BODY_NUMBER, 
@@ -215,14 +248,26 @@ class FileManagement():
                                             DPRONG1,
                                             LPRONG2) 
                                             values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    def save_annotation(self, time, size, strokes, kinds = None):
+        """Replaces the annotation strokes of a saved body.
         
-        self.c.execute(insert_query, data_values)
-        
-        body_info["body_number"] = self.count_bodies([body_info["body_name"]], False, False, False, False) + 1
-        body_img.save(self.folder_path + body_info["body_file_name"])
-        annotation_img.save(self.folder_path + body_info["annotation_file_name"])
-        
+        Args:
+            time (int): Unix time of the body.
+            size (tuple): Width and height of the body image.
+            strokes (list): The new strokes, see annotations.Stroke.
+            kinds (tuple): Only strokes of these kinds are replaced, e.g. the measurement
+                lines of one tool. Every stroke is replaced if None.
+        """
+        annotations.save_strokes(self.c, time, size, strokes, kinds)
         self.close()
+
+    def get_strokes(self, time, kinds = None):
+        """Returns the annotation strokes of a body in the order they were drawn."""
+        strokes = annotations.read_strokes(self.c, time)
+        if kinds is not None:
+            strokes = [stroke for stroke in strokes if stroke.kind in kinds]
+        return strokes
     
     def get_image_time(self, time):
         """Pulls an image from the database using time as a parameter.
@@ -238,7 +283,13 @@ class FileManagement():
                 unsure (int), notes (str), body file name (str), and
                 annotation file name (str). Values may be enclosed in another tuple.
         """
-        select_time_query = '''SELECT *
+        # the body number is the position of the body within its type by time
+        select_time_query = '''SELECT TIME, ANNOTATOR_NAME, BODY_NAME,
+                (SELECT COUNT(*) 
+                    FROM bodies AS earlier 
+                    WHERE earlier.BODY_NAME = bodies.BODY_NAME AND earlier.TIME <= bodies.TIME),
+                X_POSITION, Y_POSITION, GRID_ID, GR, MAF, MP, UNSURE, NOTES, 
+                BODY_FILE_NAME, ANNOTATION_FILE_NAME, ANGLE, LOG, DPRONG1, LPRONG2
                 FROM bodies 
                 WHERE TIME = ?'''
 
@@ -267,15 +318,18 @@ class FileManagement():
                 annotation file name (str). Values may be enclosed in another tuple.
         """
             
-        select_query = '''SELECT *
-                        FROM bodies 
-                        WHERE BODY_NAME = ? AND BODY_NUMBER = ?'''
-        
-        self.c.execute(select_query, (body_name, body_number))
+        self.c.execute(self.get_time_query, (body_name, body_number - 1))
         row = self.c.fetchone()
         self.close()
         
-        return self.convert_tuple(row)
+        return self.get_image_time(row[0])
+    
+    # body numbers start from 1 and count up by time within a body type
+    get_time_query = '''SELECT TIME
+                        FROM bodies 
+                        WHERE BODY_NAME = ?
+                        ORDER BY TIME
+                        LIMIT 1 OFFSET ?'''
     
     def convert_tuple(self, group):
         """Converts the database fetch from a tuple to a dictionary.
@@ -349,9 +403,14 @@ class FileManagement():
         Returns: 
             group (tuple): Tuple of time (int), body name (str), body number (int), 
                 x position (int), and y position (int). Values may be included in another
-                tuple 
+                tuple. Results are cached until the next write to the case.
         """
-        
+        key = QueryCache.key("query_images", body_param, GR_param, MAF_param, MP_param, unsure_param)
+        # a copy so callers can change the list without changing the cached result
+        return list(self.session.queries.get(key, lambda: self._query_images(body_param, GR_param, MAF_param,
+                                                                             MP_param, unsure_param)))
+
+    def _query_images(self, body_param, GR_param, MAF_param, MP_param, unsure_param):
         query_bodies = body_param.copy()
         body_param_ph = "?,"*(len(query_bodies)-1)+"?"
         
@@ -360,21 +419,36 @@ class FileManagement():
         MP_param_ph = self.secondary_name_grouping(MP_param, query_bodies)
         unsure_param_ph = self.secondary_name_grouping(unsure_param, query_bodies)
         
+        # numbers are counted over every body of the type before the flags are filtered
         group_query = '''SELECT TIME, BODY_NAME, BODY_NUMBER, X_POSITION, Y_POSITION
-                        FROM bodies 
-                        WHERE BODY_NAME IN ({0}) 
-                        AND GR IN ({1}) 
+                        FROM (SELECT TIME, BODY_NAME, X_POSITION, Y_POSITION, GR, MAF, MP, UNSURE,
+                                ROW_NUMBER() OVER (PARTITION BY BODY_NAME ORDER BY TIME) AS BODY_NUMBER
+                                FROM bodies
+                                WHERE BODY_NAME IN ({0}))
+                        WHERE GR IN ({1}) 
                         AND MAF IN ({2}) 
                         AND MP IN ({3})
                         AND UNSURE IN ({4})
                         ORDER BY TIME DESC'''.format(body_param_ph, GR_param_ph, MAF_param_ph, MP_param_ph, unsure_param_ph)
         
         self.c.execute(group_query, query_bodies)
-        group = self.c.fetchall()
-        
+        group = tuple(self.c.fetchall())
+
         self.close()
         return group
-    
+
+    def query_markers(self):
+        """Pulls what is needed to place and filter the marker of every body.
+
+        Returns:
+            markers (list): Tuples of time (int), body name (str), x position (int),
+                y position (int), GR, MAF, MP and unsure (int).
+        """
+        markers_query = '''SELECT TIME, BODY_NAME, X_POSITION, Y_POSITION, GR, MAF, MP, UNSURE
+                        FROM bodies'''
+        self.c.execute(markers_query)
+        return self.c.fetchall()
+
     def add_ignored(self, coords):
         """Adds the information for an ignored marker in the database."""
         add_ignored_query = '''INSERT 
@@ -382,6 +456,7 @@ class FileManagement():
                             (X, Y) values (?, ?)'''
         self.c.execute(add_ignored_query, coords)
         self.close()
+        self.session.queries.invalidate()
         
     def delete_ignored(self, coords):
         """Deletes an ignored marker if the user wishes."""
@@ -391,6 +466,7 @@ class FileManagement():
                         
         self.c.execute(delete_ignored_query, coords)
         self.close()
+        self.session.queries.invalidate()
         
     def query_all_ignored(self):
         """Pulls all ignored markers to generate"""
@@ -401,8 +477,26 @@ class FileManagement():
         return ignored
     
     def edit_info(self, edited_info): # rewrite
-        """Edits the info of a biondi body if needed."""
-        edit_query = '''UPDATE bodies
+        """Edits the info of a biondi body if needed.
+
+        Args:
+            edited_info (tuple): The new body name, GR, MAF, MP, unsure, notes, angle,
+                log, dprong1 and lprong2 followed by the time of the edited body.
+
+        Raises:
+            WritesPending: Saves queued on the background writer are still being written.
+        """
+        self.session.wait_for_writes(config.write_wait_seconds)
+        old_info = self._get_counted_info("TIME = ?", (edited_info[-1],))
+        self.c.execute(self.edit_query, edited_info)
+        self.close()
+        self.session.queries.invalidate()
+
+        if old_info is not None:
+            new_info = dict(zip(("body_name", "GR", "MAF", "MP", "unsure"), edited_info[:5]))
+            self.session.counter.change(old_info, new_info)
+
+    edit_query = '''UPDATE bodies
                         SET BODY_NAME = ?,
                         GR = ?,
                         MAF = ?,
@@ -414,154 +508,91 @@ class FileManagement():
                         DPRONG1 = ?,
                         LPRONG2 = ?
                         WHERE TIME = ?'''
+
                         
-        
-        self.c.execute(edit_query, edited_info)
-        self.close()
+    def _get_counted_info(self, condition, params):
+        """Returns the body name and flags of a single body, or None if it does not exist.
 
+        Used to tell the body counter which group an edited or deleted body was in.
+        """
+        counted_query = '''SELECT BODY_NAME, GR, MAF, MP, UNSURE
+                        FROM bodies
+                        WHERE {0}'''.format(condition)
+        self.c.execute(counted_query, params)
+        row = self.c.fetchone()
+        if row is None:
+            return None
+        return dict(zip(("body_name", "GR", "MAF", "MP", "unsure"), row))
 
-                        
-    def renumber_img(self, body_name, body_number):
-        """Fixes body number if any discrepancies occur.
+    def delete_img(self, body_name, body_number):
+        """Deletes a body from the database.
         
-        Pulls a tuple of all the times sorted from oldest to newest
-        of a select body type. Reiterates through the entire database
-        of a select body and renumber the body numbers chronologically from
-        a certain body number.
+        Body numbers are derived from the order of the remaining bodies, so the
+        bodies after the deleted one are renumbered without rewriting their rows.
         
         Args:
-            body_name (str): name of the wanted body
-            body_number (int): number of the selected body where all following
-                bodies would be renumbered Starts from 1. 
-            
-        Returns:
-            bool: False if there are no bodies in the selected body type
+            body_name (str): name of the body type.
+            body_number (int): number of the body within its type. Starts from 1.
+
+        Raises:
+            WritesPending: Saves queued on the background writer are still being written.
         """
+        self.session.wait_for_writes(config.write_wait_seconds)
+        self.c.execute(self.get_time_query, (body_name, body_number - 1))
+        row = self.c.fetchone()
+        if row is None:
+            return
+        time = row[0]
         
-        renumber_query = '''UPDATE bodies 
-                            SET BODY_NUMBER = ?
-                            WHERE BODY_NAME = ? AND TIME = ?'''
-        
-        get_time_query = '''SELECT TIME 
-                            from bodies where 
-                            BODY_NAME = ?
-                            ORDER BY TIME'''
-                                        
-        
-        self.c.execute(get_time_query, (body_name,)) 
-        time = self.c.fetchall()
-        
-        num_bodies = len(time)
-        if num_bodies == 0:
-            return False
-        
-        for i in range(body_number, num_bodies + 1):
-            self.c.execute(renumber_query, (i, body_name, time[i-1][0]))
-
-    def delete_img(self, body_name, body_number):
+        deleted_info = self._get_counted_info("TIME = ?", (time,))
         delete_query = '''DELETE 
                         FROM bodies 
-                        WHERE BODY_NAME = ? and BODY_NUMBER = ?''' 
+                        WHERE TIME = ?''' 
                         
-        self.c.execute(delete_query, (body_name, body_number))
-        self.renumber_img(body_name, body_number)
+        self.c.execute(delete_query, (time,))
+        self.c.execute('''DELETE FROM annotations WHERE TIME = ?''', (time,))
+        self.c.execute('''DELETE FROM strokes WHERE TIME = ?''', (time,))
         self.close()
+        self.session.queries.invalidate()
 
-    def merge_img(self, img, annotation, new_name):
+        if deleted_info is not None:
+            self.session.counter.remove(deleted_info)
+        ThumbnailStore.of(self.folder_path).remove(time)
+
+    def merge_img(self, time, img, new_name, scale = 1):
         """Concentate annotation and body image to one png
         
-        Take two image files and merge them together with the annotations 
+        Take the body image and merge it with its annotation rendered
         on top. The file is then named accordingly
         
         Args:
+            time (int): Unix time of the body whose annotation is merged
             img (str): name of the image file to be merged
-            annotation (str): name of the annotation file to be merged
             new_name (str): the new name to be given to the new concentated
                 image
+            scale (float): size of the merged image relative to the screenshot
         """
-        
-        body_img = Image.open(self.folder_path + img)
-        annotation_img = Image.open(self.folder_path + annotation)
-        body_img.paste(annotation_img, (0,0), annotation_img)
-        body_img.save(new_name)
+        self.close()
+        case_export.merge_img(self.folder_path, time, img, new_name, scale)
 
-    def export_case(self, new_folder_path, case_name):
+    def export_case(self, new_folder_path, case_name, progress = None):
         """Turns all images into concentated images
         
-        Iterates through all rows in the database to turn each row into
-        a singular png. ALso creates a new file name in the format of
+        Turns each body into a singular png named in the format of
         BODY NAME_ANNOTATOR INITIALS_BODY NUMBER_GR_MAF_MP. GR, MAF, and 
         MP are optional if the body does not possess those characteristics.
-        Converts .db file into a csv file for review
+        Converts .db file into a csv file for review. The merges run in a
+        process pool and only bodies that changed since the last export to
+        the same folder are merged again, see CaseExport.
         
         Args:
             new_folder_path (str): File directory where the exported case will
                 be saved
+            case_name (str): The case name put in front of every exported file.
+            progress (function): Called with the number of finished and total bodies.
         """
-
-        all_files_query = '''SELECT ANNOTATOR_NAME, 
-                            BODY_NAME, 
-                            BODY_NUMBER, 
-                            GR, 
-                            MAF, 
-                            MP, 
-                            BODY_FILE_NAME, 
-                            ANNOTATION_FILE_NAME
-                            FROM bodies'''
-                            
-        self.c.execute(all_files_query)
-        
-        while True:
-            body_info = self.c.fetchone()
-            if body_info is None:
-                break
-            img_name = "{0}{1}_{2}_{3}_{4}".format(new_folder_path, case_name, body_info[1], body_info[0], body_info[2])
-            if body_info[3] == 1:
-                img_name += "_GR"
-            if body_info[4] == 1:
-                img_name += "_MAF"
-            if body_info[5] == 1:
-                img_name += "_MP"
-            img_name += ".png"
-            
-            self.merge_img(body_info[6], body_info[7], img_name)
-            
-        all_info_query = '''SELECT TIME,
-                            ANNOTATOR_NAME,
-                            BODY_NAME,
-                            BODY_NUMBER,
-                            X_POSITION,
-                            Y_POSITION,
-                            GRID_ID,
-                            GR,
-                            MAF,
-                            MP,
-                            UNSURE,
-                            NOTES,
-                            ANGLE,
-                            LOG,
-                            DPRONG1,
-                            LPRONG2
-                            FROM bodies'''
-                            
-        self.c.execute(all_info_query)
-        
-        data = self.c.fetchall()
-        with open(f"{new_folder_path}{case_name}-bodies.csv", "w", newline = "") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            csv_writer.writerow([i[0] for i in self.c.description])
-            csv_writer.writerows(data)
-        
-        grid_query = '''SELECT * from grid'''
-        
-        self.c.execute(grid_query)
-        grid = self.c.fetchall()
-        with open(f"{new_folder_path}{case_name}-grid.csv", "w", newline = "") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            csv_writer.writerow([i[0] for i in self.c.description])
-            csv_writer.writerows(grid)
-        
         self.close()
+        CaseExport(self.folder_path, new_folder_path, case_name, progress).run()
         
 if __name__ == "__main__":
     pass
\ No newline at end of file
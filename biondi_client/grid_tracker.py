@@ -2,13 +2,46 @@ import tkinter as tk
 from PIL import Image, ImageTk
 import random
 
+# ids of grids with up to 52 squares, the original 7x7 grid uses the first 49
+letter_key = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+def column_name(column):
+    """Returns the spreadsheet style name of a column: A to Z, then AA, AB and so on."""
+    name = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+def grid_ids(rows, columns):
+    """Returns the id of every grid square, row by row.
+
+    Grids of up to 52 squares keep the single letter ids of the original 7x7
+    grid. Larger grids name squares like a spreadsheet, column letters then the
+    row number counted from 1, e.g. "C12".
+    """
+    if rows * columns <= len(letter_key):
+        return list(letter_key[:rows * columns])
+    return ["{0}{1}".format(column_name(column), row + 1) for row in range(rows) for column in range(columns)]
+
 class GridRandomizer():
     """Randomizes the grid square order for a new instance of a folder.
-    
+
     Uses the original randomizing logic from the excel sheet: Randomizes if set 1 or 2 is first,
     Randomizes if a or b is first for both sets. Combines all into one list
-    
+
+    The sets are the two colors of a checkerboard over the grid and each set is
+    split by whether the row is even or odd: set1a is the squares in even rows and
+    even columns, set1b odd rows and odd columns, set2a even rows and odd columns and
+    set2b odd rows and even columns, counted from 0. For the 7x7 grid these are the
+    lists of the excel sheet. The same rows, columns and seed always give the same order.
+
     Attributes:
+        rows (int): The number of rows of grid squares.
+        columns (int): The number of columns of grid squares.
+        seed (int): Seed of the random generator, stored with the case so the order
+            can be made again.
         set1a (list): List of the original set1a
         set1b (list): List of the original set1b
         set2a (list): List of the original set2a
@@ -21,22 +54,31 @@ class GridRandomizer():
 
     Typical usage example:
          randomized = GridRandomizer().get_final_order()
+         randomized = GridRandomizer(rows = 12, columns = 16, seed = stored_seed).get_final_order()
     """
-    def __init__(self):
+    def __init__(self, rows = 7, columns = 7, seed = None):
+        self.rows = rows
+        self.columns = columns
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 31)
+        rnd = random.Random(self.seed)
 
-        self.set1a = ["A", "C", "E", "G", "O", "Q", "S", "U", "c", "e", "g", "i", "q", "s", "u", "w"] #16
-        self.set1b = ["I", "K", "M", "W", "Y", "a", "k", "m", "o"] #9
-        self.set2a = ["B", "D", "F", "P", "R", "T", "d", "f", "h", "r", "t", "v"] #12
-        self.set2b = ["H", "J", "L", "N", "V", "X", "Z", "b", "j", "l", "n", "p"] #12
+        ids = grid_ids(rows, columns)
+        subsets = {(0, 0): [], (1, 1): [], (0, 1): [], (1, 0): []}
+        for i, grid_id in enumerate(ids):
+            subsets[(i // columns % 2, i % columns % 2)].append(grid_id)
+        self.set1a = subsets[(0, 0)]
+        self.set1b = subsets[(1, 1)]
+        self.set2a = subsets[(0, 1)]
+        self.set2b = subsets[(1, 0)]
 
-        random.shuffle(self.set1a)
-        random.shuffle(self.set1b)
-        random.shuffle(self.set2a)
-        random.shuffle(self.set2b)
+        rnd.shuffle(self.set1a)
+        rnd.shuffle(self.set1b)
+        rnd.shuffle(self.set2a)
+        rnd.shuffle(self.set2b)
 
-        self.which_set = random.randint(1,2) # set 1 or 2
-        self.which_subset1 = random.randint(1,2) # 1 = a, 2 = b for set 1
-        self.which_subset2 = random.randint(1,2) # for set 2
+        self.which_set = rnd.randint(1,2) # set 1 or 2
+        self.which_subset1 = rnd.randint(1,2) # 1 = a, 2 = b for set 1
+        self.which_subset2 = rnd.randint(1,2) # for set 2
 
         self.final_order = []
         self.set_final_order()
@@ -48,7 +90,7 @@ class GridRandomizer():
         """
         set1 = []
         set2 = []
-        
+
         #orders subsets
         if self.which_subset1 == 1:
             set1.extend(self.set1a)
@@ -71,7 +113,7 @@ class GridRandomizer():
         else:
             self.final_order.extend(set2)
             self.final_order.extend(set1)
-            
+
     def get_final_order(self):
         """Returns final_order.
 
@@ -79,9 +121,57 @@ class GridRandomizer():
         """
         return self.final_order
 
+class GridLayout():
+    """The grid squares laid over a gridfile.
+
+    Every lookup is a table lookup or a single division, so finding the square
+    of a click or the corner of a square does not depend on the grid size.
+
+    Attributes:
+        rows (int): The number of rows of grid squares.
+        columns (int): The number of columns of grid squares.
+        seed (int): The seed the grid order of the case was made with, None for
+            cases made before it was stored.
+        width (int): The width of the gridfile.
+        height (int): The height of the gridfile.
+        cell_width (float): The width of a grid square.
+        cell_height (float): The height of a grid square.
+        ids (list): The id of every grid square, row by row.
+        cells (dict): The row and column of every grid square keyed by id.
+        origins (dict): The gridfile x and y of the top left corner of every grid
+            square keyed by id.
+
+    Typical usage example:
+        layout = fm.get_layout(width, height)
+        grid_id = layout.cell_at(x, y)
+        x, y = layout.origins[grid_id]
+    """
+    def __init__(self, rows, columns, width, height, seed = None):
+        self.rows = rows
+        self.columns = columns
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.cell_width = width / columns
+        self.cell_height = height / rows
+        self.ids = grid_ids(rows, columns)
+        self.cells = {grid_id: divmod(i, columns) for i, grid_id in enumerate(self.ids)}
+        self.origins = {grid_id: (column * self.cell_width, row * self.cell_height)
+                        for grid_id, (row, column) in self.cells.items()}
+
+    def cell_at(self, x, y):
+        """Returns the id of the grid square at a gridfile position, clamped to the grid."""
+        row = min(self.rows - 1, max(0, int(y / self.cell_height)))
+        column = min(self.columns - 1, max(0, int(x / self.cell_width)))
+        return self.ids[row * self.columns + column]
+
+    def bounds(self, grid_id):
+        """Returns the left, top, right and bottom of a grid square in gridfile pixels."""
+        x, y = self.origins[grid_id]
+        return x, y, x + self.cell_width, y + self.cell_height
 
 if __name__ == "__main__":
     #root = tk.Tk()
     gr = GridRandomizer()
-    gr.set_final_order()
-    #root.mainloop()
\ No newline at end of file
+    print(gr.get_final_order())
+    #root.mainloop()
@@ -0,0 +1,126 @@
+import threading
+import queue
+import sqlite3
+from collections import OrderedDict
+from instrumentation import span
+import config
+
+class ImageCache():
+    """A least recently used cache of decoded images with a memory budget.
+
+    Images are decoded once and kept until the budget is used up, then the least
+    recently used ones are dropped. An image is decoded again if it was saved
+    since it was cached, so edited annotations are never shown stale. A background
+    thread decodes prefetched images ahead of time; tkinter objects are never made
+    here so the thread does not touch Tk. Images are read through the ImageStore
+    of their case so loose and packed cases are cached the same way.
+
+    Attributes:
+        budget (int): The most bytes of decoded pixels kept at once.
+        size (int): The bytes of decoded pixels currently kept.
+        entries (OrderedDict): (image, stamp, bytes) keyed by the store's key of
+            the image, least recently used first.
+        hits (int): Number of gets answered from the cache.
+        misses (int): Number of gets that decoded the image.
+
+    Typical usage example:
+        cache = ImageCache.shared()
+        body_img = cache.get(store, body_file_name)
+        cache.prefetch([(store, next_file_name)])
+    """
+    _shared = None
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @classmethod
+    def shared(cls):
+        """Returns the cache shared by every image viewer, sized by config.image_cache_mb."""
+        if cls._shared is None:
+            cls._shared = cls(config.image_cache_mb * 1024 * 1024)
+        return cls._shared
+
+    def _lookup(self, key, stamp):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] != stamp:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def _store(self, key, image, stamp):
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.budget:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[2]
+        self.entries[key] = (image, stamp, nbytes)
+        self.size += nbytes
+        while self.size > self.budget:
+            _, (_, _, dropped) = self.entries.popitem(last = False)
+            self.size -= dropped
+
+    def get(self, store, name):
+        """Returns the decoded image from a case's image store.
+
+        Raises:
+            OSError: The image is missing or can not be decoded.
+        """
+        key = store.key(name)
+        stamp = store.stamp(name)
+        with self._lock:
+            image = self._lookup(key, stamp)
+            if image is not None:
+                self.hits += 1
+                return image
+            self.misses += 1
+        with span("image.decode"):
+            image = store.open(name)
+        with self._lock:
+            self._store(key, image, stamp)
+        return image
+
+    def prefetch(self, images):
+        """Decodes images on the background thread so a later get is a hit.
+
+        Args:
+            images (list): Tuples of an ImageStore and an image name.
+        """
+        for image in images:
+            self._queue.put(image)
+        if self._thread is None:
+            self._thread = threading.Thread(target = self._prefetch_loop, daemon = True)
+            self._thread.start()
+
+    def _prefetch_loop(self):
+        while True:
+            store, name = self._queue.get()
+            try:
+                key = store.key(name)
+                stamp = store.stamp(name)
+                with self._lock:
+                    if self._lookup(key, stamp) is not None:
+                        continue
+                with span("image.prefetch_decode"):
+                    image = store.open(name)
+                with self._lock:
+                    self._store(key, image, stamp)
+            except OSError:
+                # missing images are reported when they are opened for viewing
+                pass
+            except sqlite3.Error as error:
+                # e.g. the database is locked while the background writer commits,
+                # the image is read again when it is opened for viewing
+                print("unable to prefetch image", name, error)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
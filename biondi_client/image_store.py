@@ -0,0 +1,277 @@
+"""Where the body and annotation images of a case are kept.
+
+A case keeps its images either as loose png files next to the database, the way
+every case was saved before, or packed into one sqlite file, images.db, that is
+much faster to copy to the archive and to open over a network share. Both kinds
+of store have the same methods so the rest of the client does not care which
+one a case uses.
+
+Typical usage example:
+    store = ImageStore.of(folder_path)
+    store.save(body_file_name, body_img)
+    body_img = store.open(body_file_name)
+
+    python image_store.py pack "path/to/case folder"
+    python image_store.py unpack "path/to/case folder"
+"""
+import sqlite3
+import os
+import io
+import sys
+import time
+import threading
+from PIL import Image
+import config
+
+class ImageStore():
+    """The images of one case folder.
+
+    Images are named by the BODY_FILE_NAME and ANNOTATION_FILE_NAME of the body,
+    e.g. "drop_1650000000.png". Missing images raise FileNotFoundError from every
+    method, the same as opening a missing loose file.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+    """
+    packed = False
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+
+    @classmethod
+    def of(cls, folder_path):
+        """Returns the store of a case folder, opening it on first use.
+
+        A case with an images.db is packed. A case without one keeps loose files,
+        unless it has no images yet and config.image_store asks for new cases to
+        be packed.
+        """
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                if os.path.exists(folder_path + PackedImageStore.file_name):
+                    store = PackedImageStore(folder_path)
+                elif config.image_store == "packed" and not LooseFileStore(folder_path).has_images():
+                    store = PackedImageStore(folder_path)
+                else:
+                    store = LooseFileStore(folder_path)
+                cls._stores[key] = store
+        return store
+
+    @classmethod
+    def forget(cls, folder_path):
+        """Drops the store of a case folder so the next of() looks at the folder again."""
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with cls._stores_lock:
+            store = cls._stores.pop(key, None)
+        if store is not None:
+            store.close()
+
+    def open(self, name):
+        """Returns the decoded image."""
+        image = Image.open(io.BytesIO(self.read(name)))
+        image.load()
+        return image
+
+    def save(self, name, image):
+        data = io.BytesIO()
+        image.save(data, "PNG")
+        self.write(name, data.getvalue())
+
+    def key(self, name):
+        """A key for the image that is unique across case folders, used by the image cache."""
+        return self.folder_path + name
+
+    def close(self):
+        pass
+
+class LooseFileStore(ImageStore):
+    """Images kept as one png file each in the case folder."""
+
+    def has_images(self):
+        """True if the folder has any body images, stopping at the first one found.
+
+        Cases saved since annotations moved into the database have body images
+        without an _ANNOTATION.png beside them, so any png counts. The gridfile
+        is a jpg.
+        """
+        with os.scandir(self.folder_path) as entries:
+            return any(entry.name.lower().endswith(".png") and entry.is_file() for entry in entries)
+
+    def read(self, name):
+        with open(self.folder_path + name, "rb") as image_file:
+            return image_file.read()
+
+    def open(self, name):
+        image = Image.open(self.folder_path + name)
+        image.load()
+        return image
+
+    def save(self, name, image):
+        image.save(self.folder_path + name)
+
+    def write(self, name, data):
+        with open(self.folder_path + name, "wb") as image_file:
+            image_file.write(data)
+
+    def stamp(self, name):
+        """Returns the size and modification time of an image, they change whenever it is saved."""
+        stat = os.stat(self.folder_path + name)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def remove(self, name):
+        os.remove(self.folder_path + name)
+
+class PackedImageStore(ImageStore):
+    """Images kept as blobs in images.db in the case folder.
+
+    Each thread gets its own connection so the thumbnail and prefetch threads
+    can read while the Tk thread saves. The modification time is recorded with
+    every image so stamps behave like those of loose files.
+
+    Attributes:
+        db_path (str): Path to the image file of the case.
+    """
+    packed = True
+    file_name = "images.db"
+    create_query = '''CREATE TABLE IF NOT EXISTS images (NAME TEXT PRIMARY KEY,
+                                                        MODIFIED INTEGER NOT NULL,
+                                                        DATA BLOB NOT NULL)'''
+
+    def __init__(self, folder_path):
+        ImageStore.__init__(self, folder_path)
+        self.db_path = folder_path + self.file_name
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.connection()
+
+    def connection(self):
+        """Returns the connection of the calling thread."""
+        # export worker processes forked from the client must not share its connections
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._connections = []
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread = False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(self.create_query)
+            conn.commit()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def read(self, name):
+        row = self.connection().execute('''SELECT DATA FROM images WHERE NAME = ?''', (name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError("no image named {0} in {1}".format(name, self.db_path))
+        return row[0]
+
+    def write(self, name, data):
+        conn = self.connection()
+        conn.execute('''INSERT OR REPLACE INTO images (NAME, MODIFIED, DATA) VALUES (?, ?, ?)''',
+                     (name, time.time_ns(), sqlite3.Binary(data)))
+        conn.commit()
+
+    def stamp(self, name):
+        """Returns the size and save time of an image, they change whenever it is saved."""
+        row = self.connection().execute('''SELECT LENGTH(DATA), MODIFIED FROM images WHERE NAME = ?''',
+                                        (name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError("no image named {0} in {1}".format(name, self.db_path))
+        return (row[0], row[1])
+
+    def remove(self, name):
+        conn = self.connection()
+        conn.execute('''DELETE FROM images WHERE NAME = ?''', (name,))
+        conn.commit()
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+def case_image_names(folder_path):
+    """Returns the file names of every body and annotation image of a case."""
+    with sqlite3.connect(folder_path + "body_database.db") as conn:
+        rows = conn.execute('''SELECT BODY_FILE_NAME, ANNOTATION_FILE_NAME FROM bodies''').fetchall()
+    return [name for row in rows for name in row if name]
+
+def pack(folder_path, progress = None):
+    """Moves the loose images of a case into images.db.
+
+    The loose files are only deleted after every image is committed to the pack,
+    so an interrupted run leaves the case readable and can be run again. The case
+    should not be open in the client while it is converted.
+
+    Returns:
+        packed (int): The number of images moved into the pack.
+    """
+    ImageStore.forget(folder_path)
+    loose = LooseFileStore(folder_path)
+    store = PackedImageStore(folder_path)
+    names = case_image_names(folder_path)
+    moved = []
+    conn = store.connection()
+    for i, name in enumerate(names):
+        try:
+            data = loose.read(name)
+            modified = loose.stamp(name)[1]
+        except FileNotFoundError:
+            # already packed by an interrupted run, or missing from the case
+            continue
+        conn.execute('''INSERT OR REPLACE INTO images (NAME, MODIFIED, DATA) VALUES (?, ?, ?)''',
+                     (name, modified, sqlite3.Binary(data)))
+        moved.append(name)
+        if progress is not None:
+            progress(i + 1, len(names))
+    conn.commit()
+    store.close()
+    for name in moved:
+        loose.remove(name)
+    return len(moved)
+
+def unpack(folder_path, progress = None):
+    """Writes the images of a packed case back out as loose files and removes images.db.
+
+    Returns:
+        unpacked (int): The number of images written out.
+    """
+    ImageStore.forget(folder_path)
+    loose = LooseFileStore(folder_path)
+    store = PackedImageStore(folder_path)
+    conn = store.connection()
+    total = conn.execute('''SELECT COUNT(*) FROM images''').fetchone()[0]
+    unpacked = 0
+    for name, modified, data in conn.execute('''SELECT NAME, MODIFIED, DATA FROM images'''):
+        loose.write(name, data)
+        # keeps the modification time so incremental exports do not redo every body
+        os.utime(folder_path + name, ns = (modified, modified))
+        unpacked += 1
+        if progress is not None:
+            progress(unpacked, total)
+    store.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(store.db_path + suffix):
+            os.remove(store.db_path + suffix)
+    return unpacked
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("pack", "unpack"):
+        print('usage: python image_store.py pack|unpack "path/to/case folder" ...')
+        sys.exit(1)
+    convert = pack if sys.argv[1] == "pack" else unpack
+    for folder in sys.argv[2:]:
+        folder_path = folder.rstrip("/\\") + "/"
+        print("{0}: {1}ed {2} images".format(folder, sys.argv[1], convert(folder_path)))
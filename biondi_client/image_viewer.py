@@ -1,8 +1,16 @@
 import tkinter as tk
-from PIL import Image, ImageTk
+from PIL import ImageTk
 from file_management import FileManagement
 from datetime import datetime
 from screenshot import ScreenshotEditor, Angler, Ringer
+from body_list import BodyList
+from image_cache import ImageCache
+from image_store import ImageStore
+from annotations import AnnotationStore
+from persistence import WriteBehind
+from case_session import WritesPending
+from contact_sheet import ContactSheet
+from instrumentation import timed
 import config
 class ImageViewer(tk.Toplevel):
     """A window to view taken screenshots.
@@ -15,9 +23,12 @@ class ImageViewer(tk.Toplevel):
         marker_canvas (tk.Canvas): Tkinter canvas where markers are stored for viewing
             on the grid file image.
         folder_path (str): Directory leading to the save path of images.
+        fm (FileManagement): Database access to the opened case folder.
+        store (ImageStore): The body images of the case.
+        overlays (AnnotationStore): The annotation overlays of the case.
         all_bodies (list): A list of all the possible bodies for creating buttons.
-        button_list_canvas (tk.Canvas): A canvas holding a window of all buttons that allow
-            the user to open an image.
+        body_list (BodyList): The list of bodies that allows the user to open an image, only the
+            rows in view are drawn.
         biondi_image_canvas (tk.Canvas): A canvas storing the image being viewed at the time.
         filter_options_frame (tk.Frame): A frame holding a series of buttons for filtering the buttons
             for selecting what image to view.
@@ -29,6 +40,7 @@ class ImageViewer(tk.Toplevel):
         var_MP (tk.BooleanVar): Boolean value where True is when user wants to sort by MP.
         var_unsure (tk.BooleanVar): Boolean value where True is when user wants to sort by unsure.
         previous_body_time (int): The unix time of the previous body selected.
+        flush_job (str): The after job filling the list again once queued saves are written.
         
     Typical usage example:
         img_v = ImageViewer(folder_path, marker_canvas)
@@ -38,27 +50,23 @@ class ImageViewer(tk.Toplevel):
         self.title("Image Viewer")
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.folder_path = folder_path
+        self.fm = FileManagement(self.folder_path)
+        self.store = ImageStore.of(self.folder_path)
+        self.overlays = AnnotationStore.of(self.folder_path)
         self.marker_canvas = marker_canvas
             
         self.columnconfigure(2, weight=1)
         self.rowconfigure(1, weight=1)
-        # create a canvas object and a vertical scrollbar for scrolling it
-        scrollbar = tk.Scrollbar(self, orient = "vertical")
-        self.button_list_canvas = tk.Canvas(self, bd=0, highlightthickness=0,
-                        yscrollcommand=scrollbar.set)
-        
-        scrollbar.config(command=self.button_list_canvas.yview)
-        self.button_list_canvas.xview_moveto(0)
-        self.button_list_canvas.yview_moveto(0)
-        
-        self.make_button_frame()
+        self.body_list = BodyList(self, command = self.open_file)
+        # steps through the list, the neighbors of the open body are prefetched
+        self.bind("<Down>", lambda event: self.open_neighbor(1))
+        self.bind("<Up>", lambda event: self.open_neighbor(-1))
 
         self.biondi_image_canvas = tk.Canvas(self, bd = 0)
         self.filter_options_frame = tk.Frame(self)
         self.information_frame = tk.Frame(self)
         
-        self.button_list_canvas.pack(side = tk.LEFT, fill = tk.Y)
-        scrollbar.pack(side = tk.LEFT, fill = tk.BOTH)
+        self.body_list.pack(side = tk.LEFT, fill = tk.Y)
         self.filter_options_frame.pack(side = tk.TOP, fill = tk.X)
         self.biondi_image_canvas.pack(side = tk.TOP, expand = True, fill = tk.BOTH)
         self.information_frame.pack(side = tk.BOTTOM, expand = True, fill = tk.X)
@@ -72,6 +80,7 @@ class ImageViewer(tk.Toplevel):
         self.var_unsure = tk.BooleanVar()
         
         self.previous_body_time = 0
+        self.flush_job = None
         
         self.make_filter_buttons()
         self.create_buttons(config.all_bodies, False, False, False, False)
@@ -103,6 +112,8 @@ class ImageViewer(tk.Toplevel):
         unsure = tk.Checkbutton(self.filter_options_frame, text = "UNSURE", variable = self.var_unsure, onvalue = True, offvalue = False)
         apply  = tk.Button(self.filter_options_frame, text = "Apply", command = lambda : self.filter())
         reset = tk.Button(self.filter_options_frame, text = "Reset", command = lambda : self.reset())
+        contact_sheet = tk.Button(self.filter_options_frame, text = "Contact Sheet", 
+                                  command = lambda : ContactSheet(self, self.body_list.model.rows))
         
         grC.pack(padx=10, pady = 10, side = tk.LEFT)
         mafC.pack(padx=10, pady = 10, side = tk.LEFT)
@@ -110,38 +121,8 @@ class ImageViewer(tk.Toplevel):
         unsure.pack(padx=10, pady = 10, side = tk.LEFT)
         apply.pack(padx=10, pady = 10, side = tk.LEFT)
         reset.pack(padx=10, pady = 10, side = tk.LEFT)
+        contact_sheet.pack(padx=10, pady = 10, side = tk.LEFT)
         
-    def make_button_frame(self):
-        """Creates a frame within the button list canvas.
-        
-        Builds a new frame inside the button list canvas to allow from scrolling
-        down the list of buttons. This scrolling is adaptive and will change with the 
-        number of buttons to reflect the list's length.
-        """
-        # create a frame inside the canvas which will be scrolled with it
-        self.interior = interior = tk.Frame(self.button_list_canvas)
-        self.interior.grid(row = 0, column = 0, sticky = "ns")
-        interior_id = self.button_list_canvas.create_window(0, 0, window=interior,
-                                            anchor=tk.NW)
-        
-        # track changes to the canvas and frame width and sync them,
-        # also updating the scrollbar
-        def _configure_interior(event):
-            # update the scrollbars to match the size of the inner frame
-            size = (interior.winfo_reqwidth(), interior.winfo_reqheight())
-            self.button_list_canvas.config(scrollregion = "0 0 %s %s" % size)
-            if interior.winfo_reqwidth() != self.button_list_canvas.winfo_width():
-                # update the canvas's width to fit the inner frame
-                self.button_list_canvas.config(width=interior.winfo_reqwidth())
-
-        def _configure_canvas(event):
-            if interior.winfo_reqwidth() != self.button_list_canvas.winfo_width():
-                # update the inner frame's width to fill the canvas
-                self.button_list_canvas.itemconfigure(interior_id, width=self.button_list_canvas.winfo_width())
-        
-        self.button_list_canvas.bind('<Configure>', _configure_canvas)
-        interior.bind('<Configure>', _configure_interior)
-    
     def set_window_size(self, img):
         """Changes window size accordingly.
         
@@ -168,10 +149,11 @@ class ImageViewer(tk.Toplevel):
         self.geometry("{0}x{1}".format(str(w), str(h)))
 
     def create_buttons(self, body_param, GR_param, MAF_param, MP_param, unsure_param):
-        """Creates the buttons in the button list.
+        """Fills the body list.
         
-        Create a series of buttons reflecting the filter options which the user can click
-        to bring up the relevant information and images for the body selected.
+        Fills the list with the bodies matching the filter options which the user can click
+        to bring up the relevant information and images for the body selected. The list is
+        updated in place.
         
         Args:
             body_param (list): A list of all the selected bodies for filtering. Enter self.all_bodies
@@ -181,21 +163,19 @@ class ImageViewer(tk.Toplevel):
             MP_param (bool): True if sorting by MP.
             unsure_param (bool): True if sorting by unsure.
         """
+        # waits a moment for queued saves so the list has every body, if they are still
+        # being written the list is filled from the database and filled again later
+        if self.flush_job is not None:
+            self.after_cancel(self.flush_job)
+            self.flush_job = None
+        if WriteBehind.of(self.folder_path).flush(config.write_wait_seconds):
+            self.title("Image Viewer")
+        else:
+            self.title("Image Viewer - saves still being written")
+            self.flush_job = self.after(1000, self.create_buttons, body_param, GR_param, MAF_param, MP_param, unsure_param)
         # queries a list of all the selected bodies
-        fm = FileManagement(self.folder_path)
-        data = fm.query_images(body_param, GR_param, MAF_param, MP_param, unsure_param)
-        
-        # loops through generating bodies
-        for i in data:
-            time = i[0]
-            name = i[1]
-            number = i[2]
-            body_name = "{} {}".format(name, number)
-            # each button takes a different command depending on its selected data
-            btn = tk.Button(self.interior, height = 1, width = 20, relief=tk.FLAT, 
-                            bg="gray99", fg="purple3", font="Dosis", text = body_name,
-                            command = lambda i = time: self.open_file(i))
-            btn.pack(padx = 10, pady = 5, side = tk.TOP)
+        data = self.fm.query_images(body_param, GR_param, MAF_param, MP_param, unsure_param)
+        self.body_list.set_rows(data)
             
     def make_information_labels(self):
         """Creates the labels for the information data
@@ -228,6 +208,7 @@ class ImageViewer(tk.Toplevel):
             notes = tk.Label(self.information_frame, text = "Notes:", font = ("Dosis", 10, "bold"), anchor = "w")
             notes.grid(row = 2, column = 0, sticky = "w")
     
+    @timed("viewer.open_file")
     def open_file(self, time):
         """Brings up the relevant file information.
         
@@ -238,20 +219,49 @@ class ImageViewer(tk.Toplevel):
         Args:
             Time (int): Time added of selected body in unix time.
         """
-        body_info = FileManagement(self.folder_path).get_image_time(time)
+        body_info = self.fm.get_image_time(time)
         self.clear_information_canvas()
         self.show_information(body_info)
         self.open_annotation_image(body_info)
         
-        self.marker_canvas.itemconfig("m" + str(time), fill = "red")
         if self.previous_body_time != 0:
-            self.marker_canvas.itemconfig("m"+str(self.previous_body_time), fill = "white")
+            self.marker_layer().set_fill(self.previous_body_time, "white")
+        self.marker_layer().set_fill(time, "red")
         self.previous_body_time = time
+        self.body_list.select(time)
+        self.prefetch_neighbors(time)
+
+    def prefetch_neighbors(self, time):
+        """Decodes the images of the bodies before and after time in the list in the background."""
+        i = self.body_list.model.positions.get(time)
+        if i is None:
+            return
+        images = []
+        for j in (i + 1, i - 1):
+            if 0 <= j < len(self.body_list.model):
+                neighbor = self.fm.get_image_time(self.body_list.model.rows[j][0])
+                images.append((self.store, neighbor["body_file_name"]))
+                images.append((self.overlays, neighbor["time"]))
+        ImageCache.shared().prefetch(images)
+
+    def open_neighbor(self, step):
+        """Opens the body step rows after the open one in the list."""
+        i = self.body_list.model.positions.get(self.previous_body_time)
+        if i is None or not 0 <= i + step < len(self.body_list.model):
+            return
+        self.open_file(self.body_list.model.rows[i + step][0])
         
     def on_closing(self):
         """Resets marker color on window closing"""
-        self.marker_canvas.itemconfig("m"+str(self.previous_body_time), fill = "white")
+        self.marker_layer().set_fill(self.previous_body_time, "white")
+        if self.flush_job is not None:
+            self.after_cancel(self.flush_job)
         self.destroy()
+
+    def marker_layer(self):
+        """Returns the layer holding the markers on the gridfile."""
+        from markings import MarkerLayer
+        return MarkerLayer.of(self.marker_canvas, self.folder_path)
         
     def show_information(self, body_info):
         """Makes the information frame widgets.
@@ -377,29 +387,27 @@ class ImageViewer(tk.Toplevel):
             edited.extend((None, body_info["log"], body_info["dprong1"], body_info["lprong2"], time))
         else:
             edited.extend((None, None, None, None, time))
-        FileManagement(self.folder_path).edit_info(edited)
+        try:
+            self.fm.edit_info(edited)
+        except WritesPending:
+            self.title("Image Viewer - saves still being written, try again in a moment")
+            return
         
-        fm = FileManagement(self.folder_path)
-        new_info = fm.get_image_time(body_info["time"])
+        new_info = self.fm.get_image_time(body_info["time"])
         
-        # if the body name is changed, renumbers both the old and new type
-        # changes the gridfile marker to reflect the new letter
+        # if the body name is changed, refreshes the list since both types are renumbered
         if body_info["body_name"] != edited_body_name:
             if edited_body_name in config.angler_types:
-                body_image = Image.open(self.folder_path + body_info["body_file_name"])
+                body_image = self.store.open(body_info["body_file_name"])
         
                 Angler(body_info, self.folder_path, self.marker_canvas, body_image, False)
             elif edited_body_name == "ring_kettlebell":
-                body_image = Image.open(self.folder_path + body_info["body_file_name"])
+                body_image = self.store.open(body_info["body_file_name"])
         
                 Ringer(body_info, self.folder_path, self.marker_canvas, body_image, False)
-            fm = FileManagement(self.folder_path)
-            fm.renumber_img(body_info["body_name"], 1)
-            fm.renumber_img(edited_body_name, 1)
-            fm.close()
             self.filter()
-            tag = "m" + str(time)
-            self.marker_canvas.itemconfig(tag, text = config.body_index[edited_body_name])
+        # updates the gridfile marker's letter and filter
+        self.marker_layer().update_body(new_info)
             
 
         self.clear_information_canvas()
@@ -415,18 +423,18 @@ class ImageViewer(tk.Toplevel):
         Args:
             body_info
         """
-        body_image = Image.open(self.folder_path + body_info["body_file_name"])
+        body_image = self.store.open(body_info["body_file_name"])
         
         # new = False as the image is already saved in the DB so no need to resave
         ScreenshotEditor(body_info, self.folder_path, self.marker_canvas, body_image, False)
 
     def edit_angle(self, body_info):
-        body_image = Image.open(self.folder_path + body_info["body_file_name"])
+        body_image = self.store.open(body_info["body_file_name"])
         
         Angler(body_info, self.folder_path, self.marker_canvas, body_image, False)
         
     def edit_log(self, body_info):
-        body_image = Image.open(self.folder_path + body_info["body_file_name"])
+        body_image = self.store.open(body_info["body_file_name"])
         
         Ringer(body_info, self.folder_path, self.marker_canvas, body_image, False)
         
@@ -442,10 +450,12 @@ class ImageViewer(tk.Toplevel):
         name = body_info["body_name"]
         number = body_info["body_number"]
         time = body_info["time"]
-        fm  = FileManagement(self.folder_path)
-        fm.delete_img(name, number)
+        try:
+            self.fm.delete_img(name, number)
+        except WritesPending:
+            self.title("Image Viewer - saves still being written, try again in a moment")
+            return
         # refreshes the button list to reflect the new changes
-        self._remake_button_list()
         self.filter()
         self.information_frame.destroy()
         
@@ -453,9 +463,7 @@ class ImageViewer(tk.Toplevel):
         self.biondi_image_canvas.delete("all")
         
         # deletes the associated marker on the gridfile
-        tag = "m" + str(time)
-        self.marker_canvas.delete(tag)
-        self.marker_canvas.update()
+        self.marker_layer().remove_body(time)
         
     def add_information(self, body_info):
         """Fills the information frame with the current information.
@@ -495,18 +503,17 @@ class ImageViewer(tk.Toplevel):
     def open_annotation_image(self, body_info):
         """Displays the currently selected biondi image.
         
-        Pulls the annotation and body image from the save folder to display in the image_canvas
+        Pulls the body image from the case's image store and renders its annotation to display in the image_canvas
         when then user selects that body.
         
         Args:
             body_info (tuple): Tuple of the currently selected body's information
             """
         body_file_name = body_info['body_file_name']
-        annotation_file_name = body_info['annotation_file_name']
         # exits if there is missing an image
         # should only raise if body images are manually edited/moved
         try:
-            body_img = Image.open(self.folder_path + body_file_name)  # open image
+            body_img = ImageCache.shared().get(self.store, body_file_name)  # decoded or cached image
         except:
             print("missing biondi image")
             return
@@ -515,7 +522,7 @@ class ImageViewer(tk.Toplevel):
         self.biondi_image_canvas.b_img = b_img # a copy of the image is saved for garbage collection
         
         try:
-            annotation_img = Image.open(self.folder_path + annotation_file_name)  # open image
+            annotation_img = ImageCache.shared().get(self.overlays, body_info["time"])
         except:
             print("missing annotation image")
             return
@@ -525,10 +532,6 @@ class ImageViewer(tk.Toplevel):
         
         self.set_window_size(body_img)
 
-    def _remake_button_list(self):
-        self.interior.destroy()
-        self.make_button_frame()
-    
     def _get_body_selection(self):
         body_selection = []
         for name, var in self.choices.items():
@@ -538,11 +541,12 @@ class ImageViewer(tk.Toplevel):
             body_selection = config.all_bodies
         return body_selection
     
+    @timed("viewer.filter")
     def filter(self):
         """Refreshes button list to reflect filter selection.
         
-        Gets the user inputs into the filter and then remakes the button list
-        with only the buttons that fit under the parameters.
+        Gets the user inputs into the filter and then updates the body list
+        with only the bodies that fit under the parameters.
         """
         body_param = self._get_body_selection()
         GR_param = self.var_GR.get()
@@ -550,16 +554,15 @@ class ImageViewer(tk.Toplevel):
         MP_param = self.var_MP.get()
         unsure_param = self.var_unsure.get()
         
-        self._remake_button_list()
         self.create_buttons(body_param, GR_param, MAF_param, MP_param, unsure_param)
 
+    @timed("viewer.reset")
     def reset(self):
         """Removes any filters.
         
-        Resets all the filter buttons as well as remakes the button list to reflect
+        Resets all the filter buttons as well as refills the body list to reflect
         all the possible bodies organized by time.
         """
-        self._remake_button_list()
         self.create_buttons(config.all_bodies, False, False, False, False)
         for choice in config.all_bodies:
             self.choices[choice].set(0)
@@ -0,0 +1,167 @@
+"""Opt in timing of database calls, image decoding, captures and Tk callbacks.
+
+Set BIONDI_PROFILE to a file path before starting the client to record how
+often each instrumented step runs and how long it takes. When the client exits
+the results are written to that file, as a summary with a latency histogram per
+step, or as a Chrome trace (chrome://tracing or https://ui.perfetto.dev) with
+one event per call when BIONDI_PROFILE_FORMAT is "chrome". When BIONDI_PROFILE
+is not set the decorators return the functions unchanged and spans do nothing,
+so the client runs as fast as without them.
+
+Typical usage example:
+    @timed("viewer.filter")
+    def filter(self):
+        ...
+
+    with span("capture.grab"):
+        im = get_backend().grab(x1, y1, x2, y2)
+
+    BIONDI_PROFILE=profile.json python biondi_body_client.py
+    BIONDI_PROFILE=trace.json BIONDI_PROFILE_FORMAT=chrome python biondi_body_client.py
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+
+output_path = os.environ.get("BIONDI_PROFILE")
+output_format = os.environ.get("BIONDI_PROFILE_FORMAT", "summary")
+enabled = bool(output_path)
+
+# upper bounds of the histogram buckets in milliseconds, the last bucket has no bound
+bucket_bounds_ms = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+class Recorder():
+    """Collects the duration of every instrumented call.
+
+    Attributes:
+        stats (dict): Count, total, min, max and histogram of each step keyed by name.
+        events (list): (name, thread id, start, duration) of every call in
+            microseconds since the recorder started, kept for the Chrome trace.
+        max_events (int): Calls past this many are only added to stats.
+    """
+    max_events = 1000000
+
+    def __init__(self):
+        self.stats = {}
+        self.events = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end):
+        duration_ms = (end - start) * 1000
+        bucket = len(bucket_bounds_ms)
+        for i, bound in enumerate(bucket_bounds_ms):
+            if duration_ms <= bound:
+                bucket = i
+                break
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = {"count": 0, "total_ms": 0.0, "min_ms": duration_ms, "max_ms": duration_ms,
+                        "histogram": [0] * (len(bucket_bounds_ms) + 1)}
+                self.stats[name] = stat
+            stat["count"] += 1
+            stat["total_ms"] += duration_ms
+            stat["min_ms"] = min(stat["min_ms"], duration_ms)
+            stat["max_ms"] = max(stat["max_ms"], duration_ms)
+            stat["histogram"][bucket] += 1
+            if len(self.events) < self.max_events:
+                self.events.append((name, threading.get_ident(), (start - self.start) * 1e6, (end - start) * 1e6))
+
+    def summary(self):
+        """Returns the stats of every step, slowest total first, with mean times and bucket labels."""
+        labels = ["<={0}ms".format(bound) for bound in bucket_bounds_ms] + [">{0}ms".format(bucket_bounds_ms[-1])]
+        with self._lock:
+            steps = {}
+            for name, stat in sorted(self.stats.items(), key = lambda item: -item[1]["total_ms"]):
+                steps[name] = dict(stat, mean_ms = stat["total_ms"] / stat["count"],
+                                   histogram = dict(zip(labels, stat["histogram"])))
+        return {"pid": os.getpid(), "seconds": time.perf_counter() - self.start, "steps": steps}
+
+    def chrome_trace(self):
+        """Returns the calls as complete events of the Chrome trace event format."""
+        pid = os.getpid()
+        with self._lock:
+            events = [{"name": name, "cat": name.split(".")[0], "ph": "X", "pid": pid, "tid": tid,
+                       "ts": round(ts, 3), "dur": round(dur, 3)}
+                      for name, tid, ts, dur in self.events]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path, trace_format = "summary"):
+        """Writes the summary or the Chrome trace to path."""
+        data = self.chrome_trace() if trace_format == "chrome" else self.summary()
+        with open(path, "w") as output_file:
+            json.dump(data, output_file, indent = None if trace_format == "chrome" else 2)
+
+recorder = Recorder()
+
+class _Span():
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        recorder.add(self.name, self.start, time.perf_counter())
+        return False
+
+class _NoSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_span = _NoSpan()
+
+def span(name):
+    """Returns a context manager timing its block under name, or one doing nothing when disabled."""
+    if not enabled:
+        return _no_span
+    return _Span(name)
+
+def timed(name = None):
+    """Decorates a function to time every call under name, the qualified function name if None.
+
+    The function is returned unchanged when instrumentation is disabled.
+    """
+    def decorate(function):
+        if not enabled:
+            return function
+        step = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.add(step, start, time.perf_counter())
+        return wrapper
+    return decorate
+
+def instrumented(cls):
+    """Class decorator timing every method defined on the class as ClassName.method."""
+    if not enabled:
+        return cls
+    for attribute, value in list(vars(cls).items()):
+        if callable(value) and not attribute.startswith("__"):
+            setattr(cls, attribute, timed("{0}.{1}".format(cls.__name__, attribute))(value))
+    return cls
+
+def _dump_at_exit():
+    try:
+        recorder.dump(output_path, output_format)
+        print("timings written to", output_path)
+    except OSError as error:
+        print("unable to write timings", error)
+
+if enabled:
+    atexit.register(_dump_at_exit)
@@ -4,7 +4,8 @@ from image_viewer import ImageViewer
 from screenshot import LilSnippy
 from file_management import FileManagement
 from time import time
-from math import floor
+from tiled_image import image_to_canvas, canvas_to_image
+from spatial_index import GridIndex
 import config
 class Marker(tk.Frame):
     """The popup prompt to create a marker.
@@ -20,35 +21,35 @@ class Marker(tk.Frame):
         marker_canvas (tk.Canvas): The canvas holding all the markers.
         height (int): The height of the gridfile image.
         width (int): The width of the gridfile image.
-        columns (int): The number of columns in the grid.
-        rows (int): The number of rows in the grid.
-        canvas_x (int): X position of the mouse relative to the canvas.
-        canvas_y (int): Y position of the mouse relative to the canvas.
+        layout (GridLayout): The grid squares of the case.
+        canvas_x (int): X position of the mouse on the gridfile image, independent of zoom.
+        canvas_y (int): Y position of the mouse on the gridfile image, independent of zoom.
         folder_path (str): Directory of the folder where images are saved.
+        fm (FileManagement): Database access to the opened case folder.
         annotator (str): The name of the annotator.
         body_type (str): The type of biondi body.
         var_GR (bool): True if the body has a green ring.
         var_MAF (bool): True if the body has multi-autoflouresence.
         var_MP (bool): True if the body has multi-prong.
         var_unsure (bool): True if the user is unsure.
-        grid_id (char): The grid letter of the mouse click.
+        grid_id (str): The id of the grid square of the mouse click.
         notes (str): Any extra notes the user entered.
         
     Typical usage example:
-        Marker(master, x, y, marker_canvas, height, width, columns, rows, folder_path)
+        Marker(master, x, y, marker_canvas, height, width, layout, folder_path)
     """
-    def __init__(self, master, canvas_x, canvas_y, marker_canvas, height, width, columns, rows, folder_path):
+    def __init__(self, master, canvas_x, canvas_y, marker_canvas, height, width, layout, folder_path):
         self.master = master
         self.marker_canvas = marker_canvas
         self.height = height
         self.width = width
-        self.columns = columns
-        self.rows = rows
+        self.layout = layout
         self.canvas_x = canvas_x
         self.canvas_y = canvas_y
         self.folder_path = folder_path
+        self.fm = FileManagement(self.folder_path)
         
-        self.annotator = tk.StringVar(value = FileManagement(self.folder_path).get_annotator_name())
+        self.annotator = tk.StringVar(value = self.fm.get_annotator_name())
         self.body_type = tk.StringVar()
         self.body_type.set("drop")
         self.var_GR = tk.BooleanVar()
@@ -89,15 +90,14 @@ class Marker(tk.Frame):
         Takes the user inputs from the popup and enters them into a data dictionary.
         This dictionary is later entered into the database.
         """
-        time_added = int(time())
+        time_added = self.fm.get_free_time(int(time()))
         body_file_name = str(self.body_type.get()) + "_" + str(time_added)
         annotation_file_name = body_file_name + "_ANNOTATION"
-        fm = FileManagement(self.folder_path)
         
         data = {"time": time_added,
                 "annotator_name": self.annotator.get(),
                 "body_name": self.body_type.get(),
-                "body_number": fm.count_bodies([self.body_type.get()], False, False, False, False) + 1,
+                "body_number": self.fm.session.counter.count_type(self.body_type.get()) + 1,
                 "x": self.canvas_x,
                 "y": self.canvas_y,
                 "grid_id": self.grid_id,
@@ -122,10 +122,7 @@ class Marker(tk.Frame):
             x (int): The canvas x of the mouse.
             y (int): The canvas y of the mouse.
         """
-        row_num = floor(y / (self.height / self.rows))
-        column_num = floor(x / (self.width / self.columns))
-        key = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
-        return key[(row_num * self.columns) + column_num]
+        return self.layout.cell_at(x, y)
 
     
     def call_screenshot(self, data):
@@ -148,11 +145,195 @@ class Marker(tk.Frame):
         self.call_screenshot(data)
 
 
+class MarkerLayer():
+    """The body and ignored markers of a case drawn on the gridfile canvas.
+
+    Every marker is kept in a GridIndex in gridfile coordinates and canvas items
+    are only created for the markers in view, the rest are dropped as the canvas
+    scrolls. Filters hide and show the items instead of recreating them and a
+    single binding per marker kind handles every click. One layer is kept per
+    canvas as canvas.marker_layer so the client, the image viewer and the
+    screenshot tools all update the same markers.
+
+    Items are still tagged m{time} and i{x}{y}, along with "marker" or "ignored".
+
+    Attributes:
+        canvas (tk.Canvas): The canvas the markers are drawn on.
+        folder_path (str): Path to the folder where images are saved.
+        bodies (dict): Body name, flags and fill color of every body keyed by time.
+        index (GridIndex): Position of every marker keyed by ("m", time) or ("i", x, y).
+        items (dict): Canvas item of every marker in view keyed like index.
+        keys (dict): The index key of every canvas item.
+        body_filter (tuple): The shown body names and the four required flags.
+        show_ignored (bool): Whether ignored markers are shown.
+
+    Typical Usage Example:
+        layer = MarkerLayer.of(marker_canvas, folder_path)
+        layer.set_filter(config.all_bodies, False, False, False, False)
+    """
+    margin = 40
+
+    def __init__(self, canvas, folder_path):
+        self.canvas = canvas
+        self.folder_path = folder_path
+        self.bodies = {}
+        self.index = GridIndex()
+        self.items = {}
+        self.keys = {}
+        self.body_filter = (set(config.all_bodies), (False, False, False, False))
+        self.show_ignored = True
+        self._pending = None
+
+        self.canvas.tag_bind("marker", "<ButtonPress-1>", self._on_marker_click)
+        self.canvas.tag_bind("ignored", "<ButtonPress-1>", self._on_ignored_click)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw(), add = "+")
+
+    @classmethod
+    def of(cls, canvas, folder_path):
+        """Returns the layer of a canvas, making it on first use."""
+        layer = getattr(canvas, "marker_layer", None)
+        if layer is None:
+            layer = cls(canvas, folder_path)
+            canvas.marker_layer = layer
+        return layer
+
+    def load(self, fm):
+        """Adds every body and ignored marker saved in the case."""
+        for time, body_name, x, y, GR, MAF, MP, unsure in fm.query_markers():
+            self.bodies[time] = {"body_name": body_name, "flags": (GR, MAF, MP, unsure), "fill": "WHITE"}
+            self.index.insert(("m", time), x, y)
+        for x, y in fm.query_all_ignored():
+            self.index.insert(("i", x, y), x, y)
+        self.schedule_redraw()
+
+    def add_body(self, body_info):
+        flags = tuple(body_info.get(flag, False) for flag in ("GR", "MAF", "MP", "unsure"))
+        self.bodies[body_info["time"]] = {"body_name": body_info["body_name"], "flags": flags, "fill": "WHITE"}
+        self.index.insert(("m", body_info["time"]), body_info["x"], body_info["y"])
+        self._drop(("m", body_info["time"]))
+        self.schedule_redraw()
+
+    def update_body(self, body_info):
+        """Refreshes the letter and filter of an edited body."""
+        if body_info["time"] not in self.bodies:
+            return
+        body = self.bodies[body_info["time"]]
+        body["body_name"] = body_info["body_name"]
+        body["flags"] = tuple(body_info[flag] for flag in ("GR", "MAF", "MP", "unsure"))
+        item = self.items.get(("m", body_info["time"]))
+        if item is not None:
+            self.canvas.itemconfigure(item, text = config.body_index[body["body_name"]],
+                                      state = self._state(("m", body_info["time"])))
+
+    def remove_body(self, time):
+        self.bodies.pop(time, None)
+        self.index.remove(("m", time))
+        self._drop(("m", time))
+
+    def set_fill(self, time, fill):
+        """Colors a body marker, used to highlight the body open in the image viewer."""
+        if time not in self.bodies:
+            return
+        self.bodies[time]["fill"] = fill
+        item = self.items.get(("m", time))
+        if item is not None:
+            self.canvas.itemconfigure(item, fill = fill)
+
+    def add_ignored(self, x, y):
+        self.index.insert(("i", x, y), x, y)
+        self.schedule_redraw()
+
+    def remove_ignored(self, x, y):
+        self.index.remove(("i", x, y))
+        self._drop(("i", x, y))
+
+    def set_filter(self, body_param, GR_param, MAF_param, MP_param, unsure_param):
+        """Shows only the bodies FileManagement.query_images would return for the same filter."""
+        self.body_filter = (set(body_param), (GR_param, MAF_param, MP_param, unsure_param))
+        self._restate("m")
+
+    def set_show_ignored(self, show):
+        self.show_ignored = show
+        self._restate("i")
+
+    def _restate(self, kind):
+        for key, item in self.items.items():
+            if key[0] == kind:
+                self.canvas.itemconfigure(item, state = self._state(key))
+
+    def _state(self, key):
+        if key[0] == "i":
+            return "normal" if self.show_ignored else "hidden"
+        body = self.bodies[key[1]]
+        names, required = self.body_filter
+        if body["body_name"] not in names:
+            return "hidden"
+        if any(needed and not flag for flag, needed in zip(body["flags"], required)):
+            return "hidden"
+        return "normal"
+
+    def _drop(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            del self.keys[item]
+            self.canvas.delete(item)
+
+    def _create(self, key):
+        x, y = image_to_canvas(self.canvas, *self.index.positions[key])
+        if key[0] == "m":
+            body = self.bodies[key[1]]
+            item = self.canvas.create_text(x, y, font = ("Calibri", 18, "bold"), fill = body["fill"], activefill = "red",
+                                           text = config.body_index[body["body_name"]], state = self._state(key),
+                                           tags = ("marker", "m{0}".format(key[1])))
+        else:
+            item = self.canvas.create_text(x, y, font = ("Calibri", 24, "bold"), fill = 'magenta', activefill = "red",
+                                           text = "X", state = self._state(key),
+                                           tags = ("ignored", "i{0}{1}".format(key[1], key[2])))
+        self.items[key] = item
+        self.keys[item] = key
+
+    def schedule_redraw(self):
+        """Redraws once the current burst of scroll and resize events is handled."""
+        if self._pending is None:
+            self._pending = self.canvas.after_idle(self.redraw)
+
+    def redraw(self):
+        """Creates the markers that are in view and drops the ones that are not."""
+        self._pending = None
+        left, top = canvas_to_image(self.canvas, self.canvas.canvasx(-self.margin), self.canvas.canvasy(-self.margin))
+        right, bottom = canvas_to_image(self.canvas, self.canvas.canvasx(self.canvas.winfo_width() + self.margin),
+                                        self.canvas.canvasy(self.canvas.winfo_height() + self.margin))
+        visible = set(self.index.query(left, top, right, bottom))
+
+        for key in [key for key in self.items if key not in visible]:
+            self._drop(key)
+        for key in visible:
+            if key not in self.items:
+                self._create(key)
+
+    def _current_key(self):
+        items = self.canvas.find_withtag("current")
+        if not items:
+            return None
+        return self.keys.get(items[0])
+
+    def _on_marker_click(self, event):
+        key = self._current_key()
+        if key is not None:
+            ImageViewer(self.folder_path, self.canvas).open_file(key[1])
+
+    def _on_ignored_click(self, event):
+        key = self._current_key()
+        if key is not None:
+            self.remove_ignored(key[1], key[2])
+            FileManagement(self.folder_path).delete_ignored((key[1], key[2]))
+
 class GridMark():
     """Creates a clickable marking on the gridfile.
     
-    When called, this creates a marker on the mouse position which can be clicked
-    to open the imageviewer and show the correlating image.
+    When called, this adds a marker at the body's position which can be clicked
+    to open the imageviewer and show the correlating image. The marker is drawn
+    by the canvas' MarkerLayer once it is in view.
     
     Attributes:
         marker_canvas (tk.Canvas): Canvas where markers are stored.
@@ -165,31 +346,20 @@ class GridMark():
     def __init__(self, marker_canvas, folder_path, body_info):
         self.marker_canvas = marker_canvas
         self.folder_path = folder_path
-        body_name = body_info["body_name"]
-        x = body_info["x"]
-        y = body_info["y"]
         self.time = body_info["time"]
-        tag = "m{0}".format(self.time)
-        self.marker_canvas.create_text(x, y, font = ("Calibri", 18, "bold"), fill = 'WHITE', activefill = "red",
-                                       text = config.body_index[body_name], tag = tag)
-        
-        self.marker_canvas.tag_bind(tag, '<ButtonPress-1>', self._on_click)
-        self.marker_canvas.update 
-        
-    def _on_click(self, event):
-        ImageViewer(self.folder_path, self.marker_canvas).open_file(self.time)
+        MarkerLayer.of(self.marker_canvas, self.folder_path).add_body(body_info)
         
 class GridIgnored():
     """Creates a clickable ignored marker.
     
     Generates a marker_canvas marker that shows if something is being 
-    ignored for the time being.
+    ignored for the time being. Clicking it deletes it.
     
     Attributes:
         marker_canvas (tk.Canvas): Canvas where markers are stored.
         folder_path (str): Path to the folder where images are saved.
-        canvas_x (int) Canvas x coordinate where the user clicked
-        canvas_y (int): Canvas y coordinate where the user clicked
+        canvas_x (int) Gridfile image x coordinate where the user clicked
+        canvas_y (int): Gridfile image y coordinate where the user clicked
     
     Typical Usage Example:
     GridIgnored(marker_canvas, folder_path, canvas_x, canvas_y)
@@ -199,15 +369,4 @@ class GridIgnored():
         self.folder_path = folder_path
         self.canvas_x = canvas_x
         self.canvas_y = canvas_y
-        
-        self.tag = "i{0}{1}".format(canvas_x, canvas_y)
-        self.marker_canvas.create_text(canvas_x, canvas_y, font = ("Calibri", 24, "bold"), fill = 'magenta', activefill = "red",
-                                       text = "X", tag = self.tag)
-        
-        self.marker_canvas.tag_bind(self.tag, '<ButtonPress-1>', self._on_click)
-        self.marker_canvas.update 
-        
-    def _on_click(self, event):
-        self.marker_canvas.delete(self.tag)
-        coords = (self.canvas_x, self.canvas_y)
-        FileManagement(self.folder_path).delete_ignored(coords)
+        MarkerLayer.of(self.marker_canvas, self.folder_path).add_ignored(canvas_x, canvas_y)
@@ -0,0 +1,208 @@
+"""Angle, prong length and log ratio measurements computed from stored points.
+
+The angle and ring tools draw their lines on a Tk canvas and save the values
+they measured along with the lines themselves as strokes (see annotations.py).
+The functions here compute the same values from the stored lines without Tk,
+for one body or for every body of a case at once with numpy, so a fixed formula
+or a new microscope calibration can be applied to a whole case.
+
+Typical usage example:
+    log, distance, length = ring_measurements([distance_points], [length_points])
+
+    python measurements.py "path/to/case folder" --scale 0.65 --dry-run
+"""
+import sqlite3
+import argparse
+import numpy as np
+import schema
+import config
+
+# stroke kinds read for each measured value
+ring_kinds = ("distance", "length")
+angle_kinds = ("angle", "prong1", "prong2")
+
+def segment_length(segments):
+    """Returns the summed length of line segments given as (x1, y1, x2, y2) rows."""
+    segments = np.asarray(segments, dtype = float).reshape(-1, 4)
+    return float(np.hypot(segments[:, 0] - segments[:, 2], segments[:, 1] - segments[:, 3]).sum())
+
+def polyline_lengths(polylines):
+    """Returns the length of every polyline at once.
+
+    Args:
+        polylines (list): Flat x1, y1, x2, y2, ... coordinate sequences of any length.
+
+    Returns:
+        lengths (np.ndarray): One length per polyline, 0 for polylines of one point.
+    """
+    counts = np.array([len(points) // 2 for points in polylines])
+    if len(counts) == 0:
+        return np.zeros(0)
+    points = np.concatenate([np.asarray(points, dtype = float).reshape(-1, 2) for points in polylines])
+    steps = np.hypot(*np.diff(points, axis = 0).T)
+    # the step from the last point of one polyline to the first of the next is not part of either
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    steps = np.append(steps, 0)
+    steps[starts[1:] - 1] = 0
+    lengths = np.add.reduceat(steps, starts)
+    lengths[counts < 2] = 0
+    return lengths
+
+def ring_measurements(distances, lengths, scale = 1):
+    """Returns the log ratio, distance and length of ring kettlebells.
+
+    Args:
+        distances (list): The distance line of each body as flat coordinates.
+        lengths (list): The length polyline of each body as flat coordinates.
+        scale (float): Length units per pixel.
+
+    Returns:
+        log (np.ndarray): log10(length / distance) rounded to 4 places, the LOG column.
+        distance (np.ndarray): The DPRONG1 column.
+        length (np.ndarray): The LPRONG2 column.
+    """
+    distance = polyline_lengths(distances) * scale
+    length = polyline_lengths(lengths) * scale
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        log = np.round(np.log10(length / distance), 4)
+    return log, distance, length
+
+def _axis_angles(points, origin, flipped):
+    """Angles of points around origin in degrees with y up, turned 180 degrees where flipped."""
+    dx = points[:, 0] - origin[:, 0]
+    dy = -(points[:, 1] - origin[:, 1])
+    sign = np.where(flipped, -1, 1)
+    return np.degrees(np.arctan2(sign * dy, sign * dx))
+
+def angles(points, reference = None):
+    """Returns the angle between the arms of angle tool lines.
+
+    points[:, 0] is the end of the first arm, points[:, 1] the vertex and
+    points[:, 2] the end of the second arm, as clicked in the angle tool. The
+    tool measures from the first arm with the axes turned so the first arm points
+    right, the same is done here. The tool follows the mouse to tell angles past
+    180 degrees, and past 360 after a full turn, apart from their mirror images;
+    only the end points are stored, so the candidate the tool could have shown
+    that is closest to reference, the angle saved with the body, is returned. The
+    plain difference from the first arm is returned where there is no reference.
+
+    Args:
+        points (array): Shape (bodies, 3, 2).
+        reference (array): The saved angles, NaN where there is none.
+
+    Returns:
+        angles (np.ndarray): Angles in degrees rounded to 4 places.
+    """
+    points = np.asarray(points, dtype = float).reshape(-1, 3, 2)
+    vertex = points[:, 1]
+    first = _axis_angles(points[:, 0], vertex, np.zeros(len(points), dtype = bool))
+    flipped = np.abs(first) > 90
+    first = np.where(first > 90, first - 180, np.where(first < -90, first + 180, first))
+    difference = _axis_angles(points[:, 2], vertex, flipped) - first
+
+    if reference is None:
+        return np.round(np.abs(difference), 4)
+    # every value the tool can show: crossing the back of the vertex adds or removes a turn
+    # and a second turn is shown as 720 minus the angle
+    turns = np.abs(difference[:, None] + np.array([0, 360, -360])[None, :])
+    candidates = np.concatenate((turns, 720 - turns), axis = 1)
+    reference = np.asarray(reference, dtype = float)
+    best = candidates[np.arange(len(points)), np.argmin(np.abs(candidates - np.nan_to_num(reference, nan = 0)[:, None]), axis = 1)]
+    return np.round(np.where(np.isnan(reference), np.abs(difference), best), 4)
+
+def read_lines(conn, kinds):
+    """Returns the stored points of each kind of line, keyed by TIME then kind."""
+    query = '''SELECT TIME, KIND, POINTS
+                FROM strokes
+                WHERE KIND IN ({0})
+                ORDER BY TIME, SEQ'''.format(", ".join("?" * len(kinds)))
+    lines = {}
+    for time, kind, points in conn.execute(query, kinds):
+        lines.setdefault(time, {})[kind] = np.frombuffer(points, dtype = "<f4").astype(float)
+    return lines
+
+def case_measurements(conn, scale = 1):
+    """Computes the measured columns of every body with stored measurement lines.
+
+    Args:
+        conn: A connection to the case database.
+        scale (float): Length units per pixel.
+
+    Returns:
+        measured (dict): Dicts of the angle, log, dprong1 and lprong2 columns keyed by TIME.
+    """
+    saved = {row[0]: row[1:] for row in conn.execute('''SELECT TIME, BODY_NAME, ANGLE FROM bodies''')}
+    measured = {}
+
+    # lines of a tool are only used while the body is still a type that tool measures
+    ring = {time: lines for time, lines in read_lines(conn, ring_kinds).items()
+            if time in saved and saved[time][0] in config.kbell_types
+            and all(kind in lines for kind in ring_kinds)}
+    if ring:
+        times = list(ring)
+        log, distance, length = ring_measurements([ring[time]["distance"] for time in times],
+                                                  [ring[time]["length"] for time in times], scale)
+        for i, time in enumerate(times):
+            measured[time] = {"angle": None, "log": float(log[i]),
+                              "dprong1": float(distance[i]), "lprong2": float(length[i])}
+
+    angle = {time: lines for time, lines in read_lines(conn, angle_kinds).items()
+             if time in saved and saved[time][0] in config.angler_types
+             and all(kind in lines for kind in angle_kinds) and len(lines["angle"]) == 6}
+    if angle:
+        times = list(angle)
+        reference = [np.nan if saved[time][1] is None else saved[time][1] for time in times]
+        angle_values = angles([angle[time]["angle"] for time in times], reference)
+        prong1 = np.round(polyline_lengths([angle[time]["prong1"] for time in times]) * scale, 4)
+        prong2 = np.round(polyline_lengths([angle[time]["prong2"] for time in times]) * scale, 4)
+        for i, time in enumerate(times):
+            measured[time] = {"angle": float(angle_values[i]), "log": None,
+                              "dprong1": float(prong1[i]), "lprong2": float(prong2[i])}
+    return measured
+
+def recompute_case(folder_path, scale = 1, dry_run = False):
+    """Rewrites ANGLE, LOG, DPRONG1 and LPRONG2 of every body from its stored lines.
+
+    Bodies saved before lines were stored keep their values.
+
+    Returns:
+        changed (int): Number of bodies whose values changed.
+        measured (int): Number of bodies with stored lines.
+        total (int): Number of bodies in the case.
+    """
+    conn = sqlite3.connect(folder_path + "body_database.db")
+    schema.migrate(conn)
+    total = conn.execute('''SELECT COUNT(*) FROM bodies''').fetchone()[0]
+    measured = case_measurements(conn, scale)
+    columns = ("angle", "log", "dprong1", "lprong2")
+    changed = []
+    for row in conn.execute('''SELECT TIME, ANGLE, LOG, DPRONG1, LPRONG2 FROM bodies''').fetchall():
+        time = row[0]
+        values = measured.get(time)
+        if values is None:
+            continue
+        new = tuple(values[column] for column in columns)
+        if any(a != b and not (a is not None and b is not None and abs(a - b) < 1e-6)
+               for a, b in zip(row[1:], new)):
+            changed.append(new + (time,))
+    if not dry_run:
+        conn.executemany('''UPDATE bodies
+                            SET ANGLE = ?,
+                            LOG = ?,
+                            DPRONG1 = ?,
+                            LPRONG2 = ?
+                            WHERE TIME = ?''', changed)
+        conn.commit()
+    conn.close()
+    return len(changed), len(measured), total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Recomputes the angle and ring measurements of cases from their stored lines.")
+    parser.add_argument("folders", nargs = "+")
+    parser.add_argument("--scale", type = float, default = 1, help = "length units per pixel, 1 keeps pixels")
+    parser.add_argument("--dry-run", action = "store_true", help = "report the changes without saving them")
+    args = parser.parse_args()
+    for folder in args.folders:
+        changed, measured, total = recompute_case(folder.rstrip("/\\") + "/", args.scale, args.dry_run)
+        print("{0}: {1} of {2} measured bodies changed, {3} bodies have no stored lines".format(
+              folder, changed, measured, total - measured))
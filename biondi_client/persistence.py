@@ -0,0 +1,313 @@
+"""Writes saved bodies to the case in the background so the editor closes at once.
+
+Typical usage example:
+    writer = WriteBehind.of(folder_path)
+    writer.save_image(body_info, body_img, strokes)
+    writer.flush()
+"""
+import sqlite3
+import os
+import json
+import time
+import atexit
+import threading
+from PIL import Image
+from case_session import CaseSession
+from file_management import FileManagement
+from image_store import ImageStore
+from thumbnails import ThumbnailStore
+from annotations import Stroke
+import annotations
+from instrumentation import timed
+
+class WriteBehind():
+    """A background writer with a durable queue for one case folder.
+
+    Saving a body used to png encode the screenshot, insert the row and commit
+    on the Tk thread before the editor closed. Saves are now put in the
+    write_queue table of the case with the raw pixels of the screenshot, which
+    takes a few milliseconds, and a background thread with its own connection
+    encodes the image and writes the rows in the order they were queued. Each
+    queued save is deleted in the same transaction that writes it, so a save is
+    written exactly once even if the client is closed or crashes; anything left
+    in the queue is written the next time the case is opened. The body counter
+    is updated when a save is queued so counts never wait on the writer. Readers
+    that need every save on disk, like the image viewer, call flush first, with a
+    timeout when they run on the Tk thread.
+
+    A save that fails write_tries times in a row is moved to the write_failed
+    table with its error so the saves queued behind it are still written. The Tk
+    thread calls take_failed to undo the counts of those saves and report them.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+        session (CaseSession): The shared session the Tk thread queues saves on.
+        pending (int): Number of queued saves not written yet.
+        failed (int): Number of saves in write_failed, including earlier sessions.
+        error (str): The last error of the writer, None while saves are written.
+
+    Typical usage example:
+        writer = WriteBehind.of(folder_path)
+        writer.save_annotation(time, size, strokes, overlay_kinds)
+        label.configure(text = "{0} saves pending".format(writer.pending))
+    """
+    retry_seconds = 5
+    write_tries = 3
+    exit_timeout = 60
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.session = CaseSession.get(folder_path)
+        self.error = None
+        self._condition = threading.Condition()
+        self.pending = self.session.conn.execute('''SELECT COUNT(*) FROM write_queue''').fetchone()[0]
+        self.failed = self.session.conn.execute('''SELECT COUNT(*) FROM write_failed''').fetchone()[0]
+        # changes made on the Tk thread when a save was queued, undone if it ends up in write_failed
+        self._undo = {}
+        self._newly_failed = []
+        # body name and flags of bodies with queued saves by time, the database is up to date once the queue is empty
+        self._counted = {}
+        self.session.writer = self
+        self._thread = threading.Thread(target = self._work, daemon = True)
+        self._thread.start()
+
+    @classmethod
+    def of(cls, folder_path):
+        """Returns the writer of a case folder, starting it on first use.
+
+        Saves left in the queue by an earlier run are written before this returns,
+        so the body counter of the case is loaded with them included.
+        """
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with cls._writers_lock:
+            writer = cls._writers.get(key)
+            if writer is None:
+                writer = cls(folder_path)
+                cls._writers[key] = writer
+                recovered = writer.pending
+            else:
+                recovered = 0
+        if recovered:
+            print("writing {0} saves left from the last session".format(recovered))
+            if not writer.flush(cls.exit_timeout):
+                print("{0} saves are still being written".format(writer.pending))
+        return writer
+
+    @classmethod
+    def flush_all(cls):
+        """Waits for every writer to finish its queue. Registered to run on exit."""
+        with cls._writers_lock:
+            writers = list(cls._writers.values())
+        for writer in writers:
+            if not writer.flush(cls.exit_timeout):
+                print("{0} saves left in the queue of {1}, they are written when the case is opened again"
+                      .format(writer.pending, writer.folder_path))
+
+    def _queue(self, kind, args, image = None, undo = None):
+        """Adds a save to the durable queue on the shared connection and wakes the writer.
+
+        Args:
+            undo (function): Called on the Tk thread by take_failed if the save is
+                moved to write_failed.
+        """
+        c = self.session.conn.execute('''INSERT INTO write_queue (KIND, ARGS, IMAGE) VALUES (?, ?, ?)''',
+                                      (kind, json.dumps(args), image))
+        if undo is not None:
+            self._undo[c.lastrowid] = undo
+        self.session.commit()
+        with self._condition:
+            self.pending += 1
+            self._condition.notify_all()
+
+    def take_failed(self):
+        """Undoes the counts of saves moved to write_failed since the last call.
+
+        Only call from the Tk thread, the body counter notifies the widgets.
+
+        Returns:
+            list: (kind, error) of every save moved to write_failed since the last call.
+        """
+        with self._condition:
+            failed, self._newly_failed = self._newly_failed, []
+        for seq, kind, error in failed:
+            undo = self._undo.pop(seq, None)
+            if undo is not None:
+                undo()
+        return [(kind, error) for seq, kind, error in failed]
+
+    def save_image(self, body_info, body_img, strokes):
+        """Queues a new body, see FileManagement.save_image.
+
+        The body is counted right away and body_info gets its body number the same
+        way FileManagement.save_image sets it.
+        """
+        image_args = {"mode": body_img.mode, "size": body_img.size}
+        counted = self._counted_info(body_info)
+        self._queue("save_image", {"body_info": body_info, "image": image_args,
+                                   "strokes": [list(stroke) for stroke in strokes]},
+                    body_img.tobytes(), lambda: self._uncount(body_info["time"], counted, None))
+        with self._condition:
+            self._counted[body_info["time"]] = counted
+        self.session.counter.add(body_info)
+        body_info["body_number"] = self.session.counter.count_type(body_info["body_name"]) + 1
+
+    def edit_info(self, edited_info):
+        """Queues an edit of a body, see FileManagement.edit_info.
+
+        The body moves to the group of its new name and flags in the body counter
+        right away, like the angle and ring tools need after a type change.
+        """
+        time = edited_info[-1]
+        new_info = self._counted_info(dict(zip(("body_name", "GR", "MAF", "MP", "unsure"), edited_info[:5])))
+        with self._condition:
+            old_info = self._counted.get(time)
+        if old_info is None:
+            row = self.session.conn.execute('''SELECT BODY_NAME, GR, MAF, MP, UNSURE FROM bodies WHERE TIME = ?''',
+                                            (time,)).fetchone()
+            if row is not None:
+                old_info = self._counted_info(dict(zip(("body_name", "GR", "MAF", "MP", "unsure"), row)))
+        self._queue("edit_info", {"edited_info": list(edited_info)},
+                    undo = None if old_info is None else lambda: self._uncount(time, new_info, old_info))
+        if old_info is not None:
+            with self._condition:
+                self._counted[time] = new_info
+            self.session.counter.change(old_info, new_info)
+
+    @staticmethod
+    def _counted_info(body_info):
+        """Returns the body name and flags the body counter groups a body by."""
+        return {key: body_info[key] for key in ("body_name", "GR", "MAF", "MP", "unsure")}
+
+    def _uncount(self, time, counted, previous):
+        """Undoes the count of a save moved to write_failed.
+
+        Args:
+            time (int): The unix time of the body.
+            counted (dict): The body name and flags counted when the save was queued.
+            previous (dict): The body name and flags before the save, None for a new body.
+        """
+        with self._condition:
+            # a later edit of the body may have moved it to another group since
+            current = self._counted.get(time, counted)
+            if previous is None:
+                self._counted.pop(time, None)
+            elif current == counted:
+                self._counted[time] = previous
+        if previous is None:
+            self.session.counter.remove(current)
+        elif current == counted:
+            self.session.counter.change(counted, previous)
+
+    def save_annotation(self, time, size, strokes, kinds = None):
+        """Queues new annotation strokes of a saved body, see FileManagement.save_annotation."""
+        self._queue("save_annotation", {"time": time, "size": list(size),
+                                        "strokes": [list(stroke) for stroke in strokes],
+                                        "kinds": None if kinds is None else list(kinds)})
+
+    def flush(self, timeout = None):
+        """Waits until every queued save is written.
+
+        Returns:
+            bool: True if the queue is empty, False if the timeout ran out first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.pending == 0, timeout)
+
+    def _work(self):
+        conn = sqlite3.connect(self.session.db_path)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        tries = {}
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending > 0)
+            row = conn.execute('''SELECT SEQ, KIND, ARGS, IMAGE FROM write_queue ORDER BY SEQ LIMIT 1''').fetchone()
+            if row is None:
+                # the count only runs ahead of the table between a commit and the notify
+                time.sleep(0.05)
+                continue
+            try:
+                thumbnail = self._write(conn, *row)
+            except (sqlite3.Error, OSError, ValueError, KeyError) as error:
+                conn.rollback()
+                self.error = str(error)
+                tries[row[0]] = tries.get(row[0], 0) + 1
+                print("unable to write queued save", row[0], error)
+                if tries[row[0]] < self.write_tries or not self._move_to_failed(conn, row, error):
+                    time.sleep(self.retry_seconds)
+                continue
+            tries.pop(row[0], None)
+            self._undo.pop(row[0], None)
+            self.error = None
+            if row[1] in ("save_image", "edit_info"):
+                self.session.queries.invalidate()
+            with self._condition:
+                self.pending -= 1
+                if self.pending == 0:
+                    self._counted.clear()
+                self._condition.notify_all()
+            if thumbnail is not None:
+                ThumbnailStore.of(self.folder_path).schedule([thumbnail])
+
+    def _move_to_failed(self, conn, row, error):
+        """Moves a save that keeps failing out of the queue into write_failed.
+
+        Returns:
+            bool: False if the move failed too, the save is then retried.
+        """
+        seq, kind, args, image = row
+        try:
+            conn.execute('''INSERT OR REPLACE INTO write_failed (SEQ, KIND, ARGS, IMAGE, ERROR) VALUES (?, ?, ?, ?, ?)''',
+                         (seq, kind, args, image, str(error)))
+            conn.execute('''DELETE FROM write_queue WHERE SEQ = ?''', (seq,))
+            conn.commit()
+        except sqlite3.Error as move_error:
+            conn.rollback()
+            print("unable to move queued save", seq, "to write_failed", move_error)
+            return False
+        print("gave up on queued save", seq, "after", self.write_tries, "tries, it is kept in write_failed")
+        self.error = None
+        with self._condition:
+            self.pending -= 1
+            self.failed += 1
+            self._newly_failed.append((seq, kind, str(error)))
+            self._condition.notify_all()
+        return True
+
+    @timed("writer.write")
+    def _write(self, conn, seq, kind, args, image):
+        """Writes one queued save and removes it from the queue in one transaction.
+
+        Returns:
+            tuple: The time and body file name of a body whose thumbnail is out of date.
+        """
+        args = json.loads(args)
+        thumbnail = None
+        c = conn.cursor()
+        if kind == "save_image":
+            body_info = args["body_info"]
+            body_img = Image.frombytes(args["image"]["mode"], tuple(args["image"]["size"]), image)
+            # the image is written first, writing it again after an interruption is harmless
+            ImageStore.of(self.folder_path).save(body_info["body_file_name"], body_img)
+            c.execute(FileManagement.insert_query, tuple(body_info.values()))
+            annotations.save_strokes(c, body_info["time"], body_img.size,
+                                     [Stroke(*stroke) for stroke in args["strokes"]])
+            thumbnail = (body_info["time"], body_info["body_file_name"])
+        elif kind == "edit_info":
+            c.execute(FileManagement.edit_query, args["edited_info"])
+        elif kind == "save_annotation":
+            # a body deleted after its annotation was queued keeps no strokes
+            row = c.execute('''SELECT BODY_FILE_NAME FROM bodies WHERE TIME = ?''', (args["time"],)).fetchone()
+            if row is not None:
+                annotations.save_strokes(c, args["time"], args["size"], [Stroke(*stroke) for stroke in args["strokes"]],
+                                         args["kinds"])
+                thumbnail = (args["time"], row[0])
+        else:
+            raise ValueError("unknown queued save " + kind)
+        c.execute('''DELETE FROM write_queue WHERE SEQ = ?''', (seq,))
+        conn.commit()
+        return thumbnail
+
+# registered after the sessions so it runs before they are closed
+atexit.register(WriteBehind.flush_all)
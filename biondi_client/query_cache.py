@@ -0,0 +1,65 @@
+import threading
+
+class QueryCache():
+    """Remembers the results of the body filter queries of one case.
+
+    The image viewer, the body list and the option bar ask for the same few
+    combinations of body types and secondary flags over and over, and the
+    answer only changes when a body or ignored marker is written. Results are
+    kept under the normalized filter, the set of body types and the four flags,
+    until any write to the case clears them. Writes made by the background
+    writer clear the cache from its thread; a result queried while a write
+    happened is not kept, so a stale result is never stored. Changes made by
+    another process are not seen until the session is opened again.
+
+    Attributes:
+        results (dict): Query results keyed by the query name and normalized filter.
+        hits (int): Number of queries answered from the cache.
+        misses (int): Number of queries that ran on the database.
+        invalidations (int): Number of times a write cleared the cache.
+
+    Typical usage example:
+        key = QueryCache.key("query_images", body_param, GR_param, MAF_param, MP_param, unsure_param)
+        rows = cache.get(key, lambda: run_query())
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query, body_param, GR_param, MAF_param, MP_param, unsure_param):
+        """Returns the cache key of a filter. The order and repeats of body types do not matter."""
+        return (query, frozenset(body_param), bool(GR_param), bool(MAF_param), bool(MP_param), bool(unsure_param))
+
+    def get(self, key, compute):
+        """Returns the cached result of key, calling compute to query it on a miss."""
+        with self._lock:
+            if key in self.results:
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+            generation = self._generation
+        result = compute()
+        with self._lock:
+            # a write during the query may not be part of the result
+            if generation == self._generation:
+                self.results[key] = result
+        return result
+
+    def invalidate(self):
+        """Forgets every result, called after any write to the case."""
+        with self._lock:
+            self.results.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Returns the hits, misses, invalidations and kept results as a dict."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations, "kept": len(self.results)}
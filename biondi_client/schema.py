@@ -0,0 +1,302 @@
+"""Versioned schema of the biondi case database and its in place migrator.
+
+Version 1 is the original layout created by FileManagement.initiate_folder with no
+primary key or indexes. Version 2 makes TIME the primary key and adds indexes.
+Version 3 derives body numbers on read instead of storing them, the BODY_NUMBER
+column is kept for older clients but is no longer maintained. Version 4 adds the
+annotations and strokes tables holding annotations as vectors. Version 5 adds the
+write_queue table of saves not yet written by the background writer. Version 6 adds
+the grid_layout table with the rows, columns and order seed of the grid. Version 7 adds
+the write_failed table of queued saves the writer gave up on. Every later version
+is reached through a migration step so an existing case folder can be upgraded
+when it is opened.
+
+Typical usage example:
+    schema.migrate(conn)
+
+    python schema.py "path/to/case folder" ["path/to/another case"]
+"""
+import sqlite3
+import sys
+
+SCHEMA_VERSION = 7
+
+BODY_COLUMNS = ("TIME", "ANNOTATOR_NAME", "BODY_NAME", "BODY_NUMBER", "X_POSITION", "Y_POSITION",
+                "GRID_ID", "GR", "MAF", "MP", "UNSURE", "NOTES", "BODY_FILE_NAME",
+                "ANNOTATION_FILE_NAME", "ANGLE", "LOG", "DPRONG1", "LPRONG2")
+
+create_bodies_query = '''CREATE TABLE IF NOT EXISTS {0} (TIME INTEGER PRIMARY KEY,
+                                                    ANNOTATOR_NAME TEXT,
+                                                    BODY_NAME TEXT NOT NULL,
+                                                    BODY_NUMBER INTEGER NOT NULL,
+                                                    X_POSITION INTEGER NOT NULL,
+                                                    Y_POSITION INTEGER NOT NULL,
+                                                    GRID_ID TEXT NOT NULL,
+                                                    GR INTEGER,
+                                                    MAF INTEGER,
+                                                    MP INTEGER,
+                                                    UNSURE INTEGER,
+                                                    NOTES TEXT,
+                                                    BODY_FILE_NAME TEXT,
+                                                    ANNOTATION_FILE_NAME TEXT,
+                                                    ANGLE REAL,
+                                                    LOG REAL,
+                                                    DPRONG1 REAL,
+                                                    LPRONG2 REAL)'''
+
+create_grid_query = '''CREATE TABLE IF NOT EXISTS grid (GRID_ID TEXT NOT NULL,
+                                                            FINISHED INTEGER)'''
+
+create_ignored_query = '''CREATE TABLE IF NOT EXISTS ignored (X INTEGER NOT NULL,
+                                                            Y INTEGER NOT NULL)'''
+
+create_name_query = '''CREATE TABLE IF NOT EXISTS name (NAME TEXT NOT NULL)'''
+
+# one row per vector annotation, bodies without one still have an annotation png
+create_annotations_query = '''CREATE TABLE IF NOT EXISTS annotations (TIME INTEGER PRIMARY KEY,
+                                                                    WIDTH INTEGER NOT NULL,
+                                                                    HEIGHT INTEGER NOT NULL,
+                                                                    MODIFIED INTEGER NOT NULL)'''
+
+# POINTS is a packed array of little endian 32 bit float x, y pairs, see annotations.py
+create_strokes_query = '''CREATE TABLE IF NOT EXISTS strokes (TIME INTEGER NOT NULL,
+                                                            SEQ INTEGER NOT NULL,
+                                                            KIND TEXT NOT NULL,
+                                                            COLOR TEXT,
+                                                            WIDTH REAL,
+                                                            POINTS BLOB NOT NULL,
+                                                            TEXT TEXT,
+                                                            PRIMARY KEY (TIME, SEQ)) WITHOUT ROWID'''
+
+# saves waiting for the background writer, see persistence.py. ARGS is json and
+# IMAGE holds the raw pixels of a screenshot so queueing it does not encode a png
+create_write_queue_query = '''CREATE TABLE IF NOT EXISTS write_queue (SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                                    KIND TEXT NOT NULL,
+                                                                    ARGS TEXT NOT NULL,
+                                                                    IMAGE BLOB)'''
+
+# queued saves that failed write_tries times in a row, kept with their last error so
+# nothing is lost and the writer can move on to the saves behind them
+create_write_failed_query = '''CREATE TABLE IF NOT EXISTS write_failed (SEQ INTEGER PRIMARY KEY,
+                                                                    KIND TEXT NOT NULL,
+                                                                    ARGS TEXT NOT NULL,
+                                                                    IMAGE BLOB,
+                                                                    ERROR TEXT)'''
+
+# one row with the grid geometry of the case, see grid_tracker.GridLayout. SEED is
+# NULL for cases whose grid order was made before seeds were stored
+create_grid_layout_query = '''CREATE TABLE IF NOT EXISTS grid_layout (ROWS INTEGER NOT NULL,
+                                                                    COLUMNS INTEGER NOT NULL,
+                                                                    SEED INTEGER)'''
+
+create_version_query = '''CREATE TABLE IF NOT EXISTS schema_version (VERSION INTEGER NOT NULL)'''
+
+# body numbers are the chronological position of a body within its type
+numbered_columns = '''TIME,
+                    ANNOTATOR_NAME,
+                    BODY_NAME,
+                    ROW_NUMBER() OVER (PARTITION BY BODY_NAME ORDER BY TIME) AS BODY_NUMBER,
+                    X_POSITION,
+                    Y_POSITION,
+                    GRID_ID,
+                    GR,
+                    MAF,
+                    MP,
+                    UNSURE,
+                    NOTES,
+                    BODY_FILE_NAME,
+                    ANNOTATION_FILE_NAME,
+                    ANGLE,
+                    LOG,
+                    DPRONG1,
+                    LPRONG2'''
+
+create_numbered_view_query = '''CREATE VIEW IF NOT EXISTS numbered_bodies AS
+                                SELECT {0}
+                                FROM bodies'''.format(numbered_columns)
+
+# numbering and get_image walk a type in TIME order, query_images and count_bodies
+# filter on the name and the four secondary flags. TIME is the rowid so it is
+# included in every index for free.
+index_queries = ('''CREATE INDEX IF NOT EXISTS bodies_name_time ON bodies (BODY_NAME, TIME)''',
+                 '''CREATE INDEX IF NOT EXISTS bodies_filter ON bodies (BODY_NAME, GR, MAF, MP, UNSURE)''',
+                 '''CREATE INDEX IF NOT EXISTS ignored_coords ON ignored (X, Y)''')
+
+def _table_exists(c, table):
+    c.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?''', (table,))
+    return c.fetchone() is not None
+
+# the newest table or view each migration adds, newest version first
+version_markers = [(7, "write_failed"),
+                   (6, "grid_layout"),
+                   (5, "write_queue"),
+                   (4, "strokes"),
+                   (3, "numbered_bodies")]
+
+def _inferred_version(c):
+    """Returns the version a database with a schema_version table but no stored version is at."""
+    for version, name in version_markers:
+        c.execute('''SELECT 1 FROM sqlite_master WHERE name = ?''', (name,))
+        if c.fetchone() is not None:
+            return version
+    return 2
+
+def get_version(conn):
+    """Returns the schema version of a case database.
+
+    Args:
+        conn: A connection to the case database.
+
+    Returns:
+        version (int): 0 if the folder was never initiated, 1 for the original
+            layout without a schema_version table, otherwise the stored version.
+            An empty schema_version table gets the version its tables show.
+    """
+    c = conn.cursor()
+    if _table_exists(c, "schema_version"):
+        c.execute('''SELECT MAX(VERSION) FROM schema_version''')
+        version = c.fetchone()[0]
+        return version if version is not None else _inferred_version(c)
+    if _table_exists(c, "bodies"):
+        return 1
+    return 0
+
+def _set_version(c, version):
+    c.execute(create_version_query)
+    c.execute('''DELETE FROM schema_version''')
+    c.execute('''INSERT INTO schema_version (VERSION) VALUES(?)''', (version,))
+
+def create_schema(c):
+    """Creates every table and index of the current schema in a new case folder.
+
+    The tables and the version are created in one transaction, so an interrupted
+    initiation never leaves tables behind that look like an older version.
+
+    Args:
+        c: A cursor to the new case database.
+    """
+    c.connection.commit()
+    try:
+        c.execute("BEGIN")
+        c.execute(create_bodies_query.format("bodies"))
+        c.execute(create_grid_query)
+        c.execute(create_ignored_query)
+        c.execute(create_name_query)
+        c.execute(create_annotations_query)
+        c.execute(create_strokes_query)
+        c.execute(create_write_queue_query)
+        c.execute(create_write_failed_query)
+        c.execute(create_grid_layout_query)
+        for index_query in index_queries:
+            c.execute(index_query)
+        c.execute(create_numbered_view_query)
+        _set_version(c, SCHEMA_VERSION)
+        c.connection.commit()
+    except sqlite3.Error:
+        c.connection.rollback()
+        raise
+
+def _migrate_1_to_2(c):
+    """Rebuilds bodies with TIME as the primary key and adds the indexes.
+
+    Two bodies saved within the same second share a TIME in version 1. The later
+    one is moved to the next unused second so the primary key holds; file names
+    are stored separately so no image is renamed.
+    """
+    c.execute(create_ignored_query)
+    c.execute(create_bodies_query.format("bodies_v2"))
+
+    c.execute('''SELECT rowid, TIME FROM bodies ORDER BY TIME, rowid''')
+    rows = c.fetchall()
+    used = set(row[1] for row in rows)
+    seen = set()
+    for rowid, time in rows:
+        if time in seen:
+            new_time = time + 1
+            while new_time in used:
+                new_time += 1
+            used.add(new_time)
+            print("moved duplicate body time {0} to {1}".format(time, new_time))
+            c.execute('''UPDATE bodies SET TIME = ? WHERE rowid = ?''', (new_time, rowid))
+            time = new_time
+        seen.add(time)
+
+    columns = ", ".join(BODY_COLUMNS)
+    c.execute('''INSERT INTO bodies_v2 ({0}) SELECT {0} FROM bodies'''.format(columns))
+    c.execute('''DROP TABLE bodies''')
+    c.execute('''ALTER TABLE bodies_v2 RENAME TO bodies''')
+    c.execute('''CREATE INDEX IF NOT EXISTS bodies_name_number ON bodies (BODY_NAME, BODY_NUMBER)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS bodies_filter ON bodies (BODY_NAME, GR, MAF, MP, UNSURE)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS ignored_coords ON ignored (X, Y)''')
+
+def _migrate_2_to_3(c):
+    """Replaces the stored body number index with the numbering view and index."""
+    c.execute('''DROP INDEX IF EXISTS bodies_name_number''')
+    for index_query in index_queries:
+        c.execute(index_query)
+    c.execute(create_numbered_view_query)
+
+def _migrate_3_to_4(c):
+    """Adds the vector annotation tables, existing annotation pngs are left as they are."""
+    c.execute(create_annotations_query)
+    c.execute(create_strokes_query)
+
+def _migrate_4_to_5(c):
+    """Adds the queue of the background writer."""
+    c.execute(create_write_queue_query)
+
+def _migrate_5_to_6(c):
+    """Adds the grid layout, every case made before it has the original 7x7 grid."""
+    c.execute(create_grid_layout_query)
+    c.execute('''INSERT INTO grid_layout (ROWS, COLUMNS, SEED) VALUES (7, 7, NULL)''')
+
+def _migrate_6_to_7(c):
+    """Adds the table of queued saves the writer could not write."""
+    c.execute(create_write_failed_query)
+
+migrations = {1: _migrate_1_to_2,
+              2: _migrate_2_to_3,
+              3: _migrate_3_to_4,
+              4: _migrate_4_to_5,
+              5: _migrate_5_to_6,
+              6: _migrate_6_to_7}
+
+def migrate(conn):
+    """Upgrades a case database to the current schema version in place.
+
+    Each step and the version it reaches run in one transaction, so an
+    interrupted upgrade leaves the case at the last completed version. Folders
+    that were never initiated are left alone.
+
+    Args:
+        conn: A connection to the case database.
+
+    Returns:
+        version (int): The schema version after migrating.
+    """
+    version = get_version(conn)
+    if version == 0:
+        return version
+    conn.commit()
+    while version < SCHEMA_VERSION:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN")
+            migrations[version](c)
+            _set_version(c, version + 1)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
+        version += 1
+    return version
+
+if __name__ == "__main__":
+    for folder in sys.argv[1:]:
+        conn = sqlite3.connect(folder.rstrip("/\\") + "/body_database.db")
+        old_version = get_version(conn)
+        new_version = migrate(conn)
+        conn.close()
+        print("{0}: version {1} -> {2}".format(folder, old_version, new_version))
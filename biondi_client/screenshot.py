@@ -1,8 +1,12 @@
 import tkinter as tk
-import pyautogui
-from PIL import ImageTk, Image, ImageDraw, ImageFont
+from PIL import ImageTk
 from tkinter.colorchooser import askcolor
 from file_management import FileManagement
+from persistence import WriteBehind
+from capture import get_backend
+from measurements import segment_length
+from annotations import Stroke, overlay_kinds
+from instrumentation import timed, span
 import config
 import math
 import time
@@ -17,6 +21,7 @@ class ScreenshotEditor(tk.Toplevel):
         body_info (dict): A collection of all relevant body information for use
             in different functions.
         folder_path (str): The string directory to the selected folder for saving.
+        fm (FileManagement): Database access to the opened case folder.
         marker_canvas (tk.Canvas): Canvas where markers are saved on the gridfile.
         im (PIL image): An image file of the screenshot.
         img (tk PhotoImage): An image file of the screenshot.
@@ -24,9 +29,11 @@ class ScreenshotEditor(tk.Toplevel):
         height (int): The height of the screenshot.
         new (Bool): True if the image inputted is new and False if the image inputted
         is from the Image Viewer.
-        annotation (PIL image): Empty image where the annotations are saved for a separate
-            file.
-        draw (PIL drawing): Pillow drawing for creating markups on annotation.
+        strokes (list): The finished brush strokes, saved as the annotation along with
+            the text placement.
+        stroke_points (list): Coordinates of the brush stroke being drawn.
+        measurements (list): Measurement lines from the angle or ring tool saved with
+            a new body.
         screenshot_frame (tk.Frame): Frame where the screenshot canvas is stored.
         screenshot_canvas (tk.Canvas): The canvas where the image is created and shown.
         toolbar_frame (tk.Frame): The frame where tool buttons are stored.
@@ -40,20 +47,22 @@ class ScreenshotEditor(tk.Toplevel):
     Typical usage example:
         ScreenshotEditor(body_info, folder_path, marker_canvas, im, new)   
     """
-    def __init__(self, body_info, folder_path, marker_canvas, im, new):
+    def __init__(self, body_info, folder_path, marker_canvas, im, new, measurements = ()):
         tk.Toplevel.__init__(self)
         self.title("Screenshot Editor")
         self.body_info = body_info
         self.folder_path = folder_path
+        self.fm = FileManagement(self.folder_path)
         self.marker_canvas = marker_canvas
         self.im = im
         self.img = ImageTk.PhotoImage(im)
         self.width = self.img.width()
         self.height = self.img.height()
         self.new = new
+        self.measurements = list(measurements)
         
-        self.annotation = Image.new("RGBA", (self.width, self.height))
-        self.draw = ImageDraw.Draw(self.annotation) #initialize a pillow drawing that runs in the background for saving annotations
+        self.strokes = []
+        self.stroke_points = []
         
         self.focus_set()
         self.grab_set()
@@ -96,6 +105,29 @@ class ScreenshotEditor(tk.Toplevel):
         self.screenshot_canvas.create_text(self.margin, self.margin, text = self.text_annotation, 
                                 font =("Calibri", 14), anchor = "nw", fill = 'white', tag ="text") 
         
+        # an edited annotation starts from the strokes that were saved, which need
+        # the queued saves written first
+        if self.new == False:
+            if not WriteBehind.of(self.folder_path).flush(config.write_wait_seconds):
+                self.refuse_edit()
+                return
+            for stroke in self.fm.get_strokes(self.body_info["time"], ("brush",)):
+                self.screenshot_canvas.create_line(*stroke.points, width = stroke.width, fill = stroke.color, 
+                                    capstyle = "round", smooth = True, splinesteps = 36, 
+                                    tag='line')
+                self.strokes.append(stroke)
+
+    def refuse_edit(self):
+        """Closes the editor while saves are still being written and tells the user to try again."""
+        self.grab_release()
+        self.destroy()
+        wait_screen = tk.Toplevel()
+        wait_screen.title("Screenshot Editor")
+        wait_label = tk.Label(wait_screen, text = "Saves are still being written, try editing again in a moment.")
+        wait_label.grid(row = 0, column = 0, sticky = 'nswe')
+        ok_button = tk.Button(wait_screen, text = "OK", command = wait_screen.destroy)
+        ok_button.grid(row = 1, column = 0, sticky = 's')
+        
     def create_screenshot_canvas(self):
         """Creates the screenshot canvas.
         
@@ -168,9 +200,8 @@ class ScreenshotEditor(tk.Toplevel):
                                     width = self.line_width, fill = self.color, 
                                     capstyle = "round", smooth = True, splinesteps = 36, 
                                     tag='line') 
-            # draws on the pillow annotation image for saving later
-            self.draw.line((self.old_x, self.old_y, event.x, event.y), fill = self.color, 
-                            width = self.line_width, joint = "curve")
+        # records the stroke for saving later
+        self.stroke_points.extend((event.x, event.y))
         self.old_x = event.x
         self.old_y = event.y
         
@@ -178,8 +209,12 @@ class ScreenshotEditor(tk.Toplevel):
         """Resets coordinates to create a new line.
         
         Callback function used to reset the coordinates so that paint will 
-        create a new line instead of connecting back up to the old.
+        create a new line instead of connecting back up to the old. The finished
+        line is kept as one brush stroke.
         """
+        if len(self.stroke_points) >= 4:
+            self.strokes.append(Stroke("brush", self.color, self.line_width, tuple(self.stroke_points), None))
+        self.stroke_points = []
         self.old_x, self.old_y = None, None
         
     def text(self): # moves text around
@@ -212,34 +247,36 @@ class ScreenshotEditor(tk.Toplevel):
         
         Used to clear the canvas to redo annotations if the user has messed up.
         """
-        self.annotation = Image.new("RGBA", (self.width, self.height))
-        self.draw = ImageDraw.Draw(self.annotation)
+        self.strokes = []
+        self.stroke_points = []
         
         self.screenshot_canvas.delete('line') # deletes line all lines
 
+    @timed("editor.save")
     def save(self):
-        """Commits the image and annotation to new files.
+        """Commits the image and annotation.
         
-        Saves the image and annotation as png files with an alpha channel for merging
-        later. If the image is new, it also adds it to the database.
+        Saves the image as a png file and the annotation as vector strokes that are
+        rendered for viewing and merging later. If the image is new, it also adds it
+        to the database. The save is queued for the case's background writer so the
+        editor closes without waiting on the encoding and commit.
         """
-        # parameters for the PIL annotations done in tandem with the seen tkinter annotations
-        self.font = ImageFont.truetype("calibrib.ttf", 20) 
         bounds = self.screenshot_canvas.bbox("text")
-        self.draw.text((bounds[0], bounds[1]), fill = 'white', 
-                        font = self.font, text = self.text_annotation) 
-                        #takes the bottom left coordinate of text and places the text on the pillow drawing
+        # takes the top left coordinate of text to place the text on the rendered annotation
+        text = Stroke("text", "white", 0, (bounds[0], bounds[1]), self.text_annotation)
+        strokes = self.strokes + [text]
         
         if self.new == True: # if the image is being saved from LilSnippy
-            FileManagement(self.folder_path).save_image(self.body_info, self.im, self.annotation)
+            WriteBehind.of(self.folder_path).save_image(self.body_info, self.im, strokes + self.measurements)
             from markings import GridMark
             GridMark(self.marker_canvas, self.folder_path, self.body_info)
         else: # if the annotations are being edited from Image Viewer
-            self.annotation.save(self.folder_path + self.body_info["annotation_file_name"])
+            WriteBehind.of(self.folder_path).save_annotation(self.body_info["time"], (self.width, self.height), 
+                                                             strokes, overlay_kinds)
         
         self.destroy()
         
-        number = FileManagement(self.folder_path).count_bodies(config.all_bodies, False, False, False, False)
+        number = self.fm.session.counter.total
         if number == 300: # opens a popup at 300 biondi bodies done
             done_screen = tk.Toplevel()
             done_screen.grab_set()
@@ -316,13 +353,14 @@ class Ringer(tk.Toplevel):
         self.ok_button = tk.Button(self.toolbar_frame, text = "ok", command = self.ok)
         self.ok_button.grid(row = 0, column = 3)
         
+    @timed("ringer.ok")
     def ok(self):
         if (self.l == []) | (self.d == None):
             return
         
         self.body_info["log"], self.body_info["dprong1"], self.body_info["lprong2"] = self.calc_log()
         if self.new:
-            ScreenshotEditor(self.body_info, self.folder_path, self.marker_canvas, self.im, True)
+            ScreenshotEditor(self.body_info, self.folder_path, self.marker_canvas, self.im, True, self.measurements())
         else:
             info = (self.body_info["body_name"], self.body_info["GR"], 
                     self.body_info["MAF"], self.body_info["MP"], 
@@ -330,9 +368,20 @@ class Ringer(tk.Toplevel):
                     self.body_info["angle"], self.body_info["log"], 
                     self.body_info["dprong1"], self.body_info["lprong2"],
                     self.body_info["time"])
-            FileManagement(self.folder_path).edit_info(info)
+            writer = WriteBehind.of(self.folder_path)
+            writer.edit_info(info)
+            writer.save_annotation(self.body_info["time"], (self.width, self.height), self.measurements(), 
+                               ("distance", "length"))
             
         self.destroy()
+
+    def measurements(self):
+        """Returns the distance and length lines as strokes so they are saved with the body."""
+        length = [self.l[0][0], self.l[0][1]]
+        for x in self.l:
+            length.extend((x[2], x[3]))
+        return [Stroke("distance", "purple", self.line_width, tuple(self.d), None),
+                Stroke("length", "cyan", self.line_width, tuple(length), None)]
         
     def create_screenshot_canvas(self):
         """Creates the screenshot canvas.
@@ -472,10 +521,9 @@ class Ringer(tk.Toplevel):
         return distance
         
     def calc_log(self):
-        distance = self.distance_form(self.d)
-        length = 0
-        for x in self.l:
-            length += self.distance_form(x)
+        # same formula the measurements module recomputes cases with
+        distance = segment_length([self.d])
+        length = segment_length(self.l)
             
         return round(math.log10(length / distance), 4), distance, length
     
@@ -540,6 +588,7 @@ class Angler(tk.Toplevel):
         self.ok_button = tk.Button(self.toolbar_frame, text = "ok", command = self.ok)
         self.ok_button.grid(row = 0, column = 4)
         
+    @timed("angler.ok")
     def ok(self):
         if (self.curr_angle == None) | (self.p1 == []) | (self.p2 == []):
             return
@@ -549,16 +598,29 @@ class Angler(tk.Toplevel):
             self.body_info["lprong2"] = self.calc_dist(self.p2)
         
         if self.new:
-            ScreenshotEditor(self.body_info, self.folder_path, self.marker_canvas, self.im, True)
+            ScreenshotEditor(self.body_info, self.folder_path, self.marker_canvas, self.im, True, self.measurements())
         else:
             info = (self.body_info["body_name"], self.body_info["GR"], 
                     self.body_info["MAF"], self.body_info["MP"], 
                     self.body_info["unsure"], self.body_info["notes"], 
                     self.body_info["angle"], self.body_info["log"], 
                     self.body_info["dprong1"], self.body_info["lprong2"], self.body_info["time"])
-            FileManagement(self.folder_path).edit_info(info)
+            writer = WriteBehind.of(self.folder_path)
+            writer.edit_info(info)
+            writer.save_annotation(self.body_info["time"], (self.width, self.height), self.measurements(), 
+                               ("angle", "prong1", "prong2"))
             
         self.destroy()
+
+    def measurements(self):
+        """Returns the angle and prong lines as strokes so they are saved with the body."""
+        strokes = [Stroke("angle", "white", 5, tuple(c for point in self.points for c in point), None)]
+        for kind, lines in (("prong1", self.p1), ("prong2", self.p2)):
+            points = [lines[0][0], lines[0][1]]
+            for x in lines:
+                points.extend((x[2], x[3]))
+            strokes.append(Stroke(kind, self.length_color, self.line_width, tuple(points), None))
+        return strokes
         
     def create_screenshot_canvas(self):
         """Creates the screenshot canvas.
@@ -833,10 +895,7 @@ class Angler(tk.Toplevel):
         return distance
     
     def calc_dist(self, coords):
-        length = 0
-        for x in coords:
-            length += self.distance_form(x)
-        return round(length, 4)
+        return round(segment_length(coords), 4)
     
     def clear_all(self):
         self.prev_axis_angle = 0
@@ -919,7 +978,8 @@ class LilSnippy(tk.Frame):
         """Save the screenshot as a PIL file.
         
         Using the diagonal points, this function take that area and saves it as 
-        a PIL image. This image is then piped into the Screenshot Editor.
+        a PIL image through the capture backend set by config.capture_backend.
+        This image is then piped into the Screenshot Editor.
         
         Args:
             x1 (int): X coordinate of the first click.
@@ -927,7 +987,8 @@ class LilSnippy(tk.Frame):
             x2 (int): X coordinate when the mouse is released.
             y2 (int): Y coordinate when the mouse is released.
         """
-        im = pyautogui.screenshot(region=(x1, y1, x2, y2))
+        with span("capture.grab"):
+            im = get_backend().grab(x1, y1, x2, y2)
         if self.body_info["body_name"] in config.angler_types:
             Angler(self.body_info, self.folder_path, self.marker_canvas, im, True)
         elif self.body_info["body_name"] == "ring_kettlebell":
@@ -0,0 +1,71 @@
+from math import floor
+
+class GridIndex():
+    """A spatial index that sorts points into square buckets.
+
+    Finding the points inside a rectangle only looks at the buckets the rectangle
+    overlaps, so the cost follows the size of the rectangle instead of the number
+    of points. Adding, moving and removing a point are constant time.
+
+    Attributes:
+        bucket_size (int): Width and height of a bucket in gridfile pixels.
+        buckets (dict): Set of keys keyed by (bucket column, bucket row).
+        positions (dict): (x, y) keyed by the key of every point.
+
+    Typical usage example:
+        index = GridIndex()
+        index.insert(("m", time), x, y)
+        keys = index.query(left, top, right, bottom)
+    """
+    def __init__(self, bucket_size = 256):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        self.positions = {}
+
+    def _bucket(self, x, y):
+        return (floor(x / self.bucket_size), floor(y / self.bucket_size))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def insert(self, key, x, y):
+        """Adds a point, moving it if the key is already in the index."""
+        if key in self.positions:
+            self.remove(key)
+        self.positions[key] = (x, y)
+        self.buckets.setdefault(self._bucket(x, y), set()).add(key)
+
+    def remove(self, key):
+        """Removes a point. Keys that are not in the index are ignored."""
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        bucket = self._bucket(*position)
+        keys = self.buckets[bucket]
+        keys.discard(key)
+        if not keys:
+            del self.buckets[bucket]
+
+    def query(self, left, top, right, bottom):
+        """Returns the keys of every point inside the rectangle, edges included."""
+        first_column, first_row = self._bucket(left, top)
+        last_column, last_row = self._bucket(right, bottom)
+        found = []
+        # a rectangle larger than the filled part of the index walks the buckets instead
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > len(self.buckets):
+            buckets = [keys for (column, row), keys in self.buckets.items()
+                       if first_column <= column <= last_column and first_row <= row <= last_row]
+        else:
+            buckets = [self.buckets[(column, row)]
+                       for row in range(first_row, last_row + 1)
+                       for column in range(first_column, last_column + 1)
+                       if (column, row) in self.buckets]
+        for keys in buckets:
+            for key in keys:
+                x, y = self.positions[key]
+                if left <= x <= right and top <= y <= bottom:
+                    found.append(key)
+        return found
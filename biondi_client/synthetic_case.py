@@ -0,0 +1,167 @@
+"""Makes case folders filled with random bodies for benchmarks and trying out the client.
+
+A synthetic case is initiated the same way as a real one, by
+FileManagement.initiate_folder, so it has the current schema, a randomized grid
+order and an annotator name. Bodies get a random type, position, flags and
+measurements, a small body image and an annotation, and a few spots are marked
+as ignored. The same seed always makes the same case.
+
+Typical usage example:
+    folder_path = generate_case("path/to/empty folder/", 1000, seed = 7)
+
+    python synthetic_case.py "path/to/empty folder" --bodies 1000 --grid-size 4000 4000
+"""
+import os
+import random
+import tempfile
+import argparse
+from math import log10
+from PIL import Image, ImageDraw
+from file_management import FileManagement
+from image_store import ImageStore
+from annotations import Stroke
+import annotations
+import config
+
+def make_gridfile(path, size, rnd):
+    """Saves a dark gridfile with faint blobs so it compresses like a real scan."""
+    image = Image.new("RGB", size, (8, 8, 12))
+    draw = ImageDraw.Draw(image)
+    for i in range(max(1, size[0] * size[1] // 40000)):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        r = rnd.randint(4, 40)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill = (rnd.randint(20, 80), rnd.randint(40, 160), 30))
+    image.save(path, quality = 85)
+
+def make_body_image(rnd, size):
+    """Returns a small screenshot-like body image: a dark field with a bright blob."""
+    image = Image.new("RGB", size, (rnd.randint(0, 20), rnd.randint(0, 20), rnd.randint(0, 30)))
+    draw = ImageDraw.Draw(image)
+    w, h = size
+    x, y = rnd.randint(w // 4, w // 2), rnd.randint(h // 4, h // 2)
+    draw.ellipse((x, y, x + rnd.randint(4, w // 2), y + rnd.randint(4, h // 2)),
+                 fill = (rnd.randint(60, 255), rnd.randint(120, 255), rnd.randint(0, 120)))
+    return image
+
+def make_strokes(rnd, size, location):
+    """Returns a brush stroke and the location text, like the screenshot editor saves."""
+    w, h = size
+    points = []
+    for i in range(rnd.randint(2, 12)):
+        points.extend((rnd.uniform(0, w), rnd.uniform(0, h)))
+    return [Stroke("brush", "white", 3, tuple(points), None),
+            Stroke("text", "white", 0, (2, 2), location)]
+
+def body_rows(bodies, layout, rnd, start_time, annotator_name):
+    """Returns the body_info dicts of random bodies in the order they were saved."""
+    grid_size = (layout.width, layout.height)
+    counts = {}
+    rows = []
+    for i in range(bodies):
+        body_name = rnd.choice(config.all_bodies)
+        counts[body_name] = counts.get(body_name, 0) + 1
+        time = start_time + i
+        x, y = rnd.randrange(grid_size[0]), rnd.randrange(grid_size[1])
+        body_info = {"time": time,
+                     "annotator_name": annotator_name,
+                     "body_name": body_name,
+                     "body_number": counts[body_name],
+                     "x": x,
+                     "y": y,
+                     "grid_id": layout.cell_at(x, y),
+                     "GR": rnd.random() < 0.2,
+                     "MAF": rnd.random() < 0.15,
+                     "MP": rnd.random() < 0.1,
+                     "unsure": rnd.random() < 0.05,
+                     "notes": "synthetic" if rnd.random() < 0.1 else "",
+                     "body_file_name": "{0}_{1}.png".format(body_name, time),
+                     "annotation_file_name": "{0}_{1}_ANNOTATION.png".format(body_name, time),
+                     "angle": None,
+                     "log": None,
+                     "dprong1": None,
+                     "lprong2": None}
+        if body_name in config.angler_types:
+            body_info["angle"] = round(rnd.uniform(5, 355), 4)
+            body_info["dprong1"] = round(rnd.uniform(5, 80), 4)
+            body_info["lprong2"] = round(rnd.uniform(5, 80), 4)
+        elif body_name in config.kbell_types:
+            body_info["dprong1"] = rnd.uniform(5, 40)
+            body_info["lprong2"] = body_info["dprong1"] * rnd.uniform(1, 6)
+            body_info["log"] = round(log10(body_info["lprong2"] / body_info["dprong1"]), 4)
+        rows.append(body_info)
+    return rows
+
+def generate_case(folder_path, bodies, grid_size = (4000, 4000), ignored = None, image_size = (64, 48),
+                  png_annotations = False, seed = 0, annotator_name = "SY", start_time = 1600000000,
+                  grid_rows = None, grid_columns = None):
+    """Fills an empty folder with a synthetic case.
+
+    Args:
+        folder_path (str): The directory to an empty case folder with a slash added.
+        bodies (int): The number of bodies.
+        grid_size (tuple): Width and height of the gridfile in pixels.
+        ignored (int): The number of ignored marks, a fiftieth of the bodies if None.
+        image_size (tuple): Width and height of every body image.
+        png_annotations (bool): Saves annotations as png files like cases made before
+            vector annotations, instead of as strokes.
+        seed (int): Seed of the random generator.
+        annotator_name (str): The annotator name of the case and its bodies.
+        start_time (int): The unix time of the first body, every next body is a second later.
+        grid_rows (int): Rows of grid squares, config.grid_rows if None.
+        grid_columns (int): Columns of grid squares, config.grid_columns if None.
+
+    Returns:
+        folder_path (str): The case folder.
+    """
+    rnd = random.Random(seed)
+    if ignored is None:
+        ignored = bodies // 50
+    with tempfile.TemporaryDirectory() as temp_dir:
+        gridfile_path = os.path.join(temp_dir, "gridfile.jpg")
+        make_gridfile(gridfile_path, grid_size, rnd)
+        fm = FileManagement(folder_path)
+        fm.initiate_folder(gridfile_path, annotator_name, grid_rows, grid_columns, seed)
+
+    store = ImageStore.of(folder_path)
+    rows = body_rows(bodies, fm.get_layout(*grid_size), rnd, start_time, annotator_name)
+    templates = [make_body_image(rnd, image_size) for i in range(16)]
+    for body_info in rows:
+        body_img = rnd.choice(templates)
+        location = "{0} {1}, {2}".format(body_info["grid_id"], body_info["x"], body_info["y"])
+        strokes = make_strokes(rnd, body_img.size, location)
+        store.save(body_info["body_file_name"], body_img)
+        if png_annotations:
+            store.save(body_info["annotation_file_name"], annotations.render(strokes, body_img.size))
+        else:
+            annotations.save_strokes(fm.c, body_info["time"], body_img.size, strokes)
+
+    fm.c.executemany(FileManagement.insert_query, [tuple(body_info.values()) for body_info in rows])
+    marks = set()
+    while len(marks) < ignored:
+        marks.add((rnd.randrange(grid_size[0]), rnd.randrange(grid_size[1])))
+    fm.c.executemany('''INSERT INTO ignored (X, Y) values (?, ?)''', sorted(marks))
+    fm.close()
+    fm.session.queries.invalidate()
+    return folder_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Makes a case folder filled with random bodies.")
+    parser.add_argument("folder", help = "an empty or missing folder for the case")
+    parser.add_argument("--bodies", type = int, default = 1000)
+    parser.add_argument("--grid-size", type = int, nargs = 2, default = (4000, 4000), metavar = ("WIDTH", "HEIGHT"))
+    parser.add_argument("--ignored", type = int, help = "ignored marks, a fiftieth of the bodies if left out")
+    parser.add_argument("--image-size", type = int, nargs = 2, default = (64, 48), metavar = ("WIDTH", "HEIGHT"))
+    parser.add_argument("--png-annotations", action = "store_true", help = "save annotations as png files like older cases")
+    parser.add_argument("--grid", type = int, nargs = 2, metavar = ("ROWS", "COLUMNS"),
+                        help = "grid squares of the case, config.grid_rows by config.grid_columns if left out")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    os.makedirs(args.folder, exist_ok = True)
+    if os.listdir(args.folder):
+        parser.error("{0} is not empty".format(args.folder))
+    folder_path = args.folder.rstrip("/\\") + "/"
+    generate_case(folder_path, args.bodies, tuple(args.grid_size), args.ignored, tuple(args.image_size),
+                  args.png_annotations, args.seed, grid_rows = args.grid[0] if args.grid else None,
+                  grid_columns = args.grid[1] if args.grid else None)
+    print("made {0} with {1} bodies".format(args.folder, args.bodies))
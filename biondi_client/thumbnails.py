@@ -0,0 +1,209 @@
+"""Thumbnails of every body in a case packed into one sqlite file.
+
+Typical usage example:
+    ThumbnailStore.of(folder_path).schedule([(time, body_file_name)])
+
+    python thumbnails.py "path/to/case folder"
+"""
+import sqlite3
+import os
+import io
+import sys
+import threading
+import queue
+from PIL import Image
+from image_store import ImageStore
+from annotations import AnnotationStore
+
+def make_thumbnail(folder_path, time, body_file_name, size):
+    """Returns a jpg of the body with its annotation on top, no larger than size."""
+    body_img = ImageStore.of(folder_path).open(body_file_name).convert("RGBA")
+    try:
+        annotation_img = AnnotationStore.of(folder_path).open(time).convert("RGBA")
+        body_img.paste(annotation_img, (0,0), annotation_img)
+    except OSError:
+        pass
+    body_img = body_img.convert("RGB")
+    body_img.thumbnail((size, size))
+    data = io.BytesIO()
+    body_img.save(data, "JPEG", quality = 85)
+    return data.getvalue()
+
+def source_stamp(folder_path, time, body_file_name):
+    """Returns a string that changes whenever the body image or annotation is saved."""
+    stamp = []
+    for source, name in ((ImageStore.of(folder_path), body_file_name), (AnnotationStore.of(folder_path), time)):
+        try:
+            stamp.append("{0}:{1}".format(*source.stamp(name)))
+        except OSError:
+            stamp.append("-")
+    return " ".join(stamp)
+
+class ThumbnailStore():
+    """The thumbnails of a case, kept in thumbnails.db in the case folder.
+
+    One file holds every thumbnail keyed by the body's TIME along with a stamp of
+    the files it was made from. Thumbnails are made on a background thread, either
+    right after a body is saved or edited or in bulk for cases made before
+    thumbnails existed. A thumbnail whose files have not changed is never made
+    twice. Each thread gets its own connection, so the store can be opened first
+    by the background writer and still be read from the Tk thread.
+
+    Attributes:
+        folder_path (str): The directory to the case folder with a slash added.
+        db_path (str): Path to the thumbnail file.
+        failed (set): TIMEs of bodies whose thumbnail could not be made.
+
+    Typical usage example:
+        store = ThumbnailStore.of(folder_path)
+        thumbnail = store.get(time)
+    """
+    size = 160
+    create_query = '''CREATE TABLE IF NOT EXISTS thumbnails (TIME INTEGER PRIMARY KEY,
+                                                            STAMP TEXT NOT NULL,
+                                                            JPG BLOB NOT NULL)'''
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.db_path = folder_path + "thumbnails.db"
+        self._local = threading.local()
+        self.failed = set()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(self.create_query)
+        conn.commit()
+        return conn
+
+    def connection(self):
+        """Returns the connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def of(cls, folder_path):
+        """Returns the store of a case folder, opening it on first use."""
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls(folder_path)
+                cls._stores[key] = store
+        return store
+
+    def get(self, time):
+        """Returns the thumbnail of a body as a PIL image, None if it is not made yet."""
+        row = self.connection().execute('''SELECT JPG FROM thumbnails WHERE TIME = ?''', (time,)).fetchone()
+        if row is None:
+            return None
+        return Image.open(io.BytesIO(row[0]))
+
+    def remove(self, time):
+        """Deletes the thumbnail of a deleted body.
+
+        Runs on the background thread after anything queued before it, so a
+        thumbnail being made for the body is not written back afterwards.
+        """
+        self._queue.put(("remove", time))
+        self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target = self._work, daemon = True)
+            self._thread.start()
+
+    def schedule(self, bodies):
+        """Makes or refreshes thumbnails on the background thread.
+
+        Args:
+            bodies (list): Tuples of time and body file name.
+        """
+        for body in bodies:
+            self._queue.put(body)
+        self._start()
+
+    @property
+    def pending(self):
+        """Number of bodies the background thread has not finished yet."""
+        return self._queue.unfinished_tasks
+
+    def schedule_case(self, fm):
+        """Queues every body of the case, bodies with current thumbnails are skipped quickly."""
+        self.schedule(fm.c.execute('''SELECT TIME, BODY_FILE_NAME
+                                    FROM bodies
+                                    ORDER BY TIME DESC''').fetchall())
+
+    def update(self, conn, time, body_file_name):
+        """Makes the thumbnail of one body unless the stored one is current.
+
+        Returns:
+            bool: True if a thumbnail was made.
+        """
+        stamp = source_stamp(self.folder_path, time, body_file_name)
+        row = conn.execute('''SELECT STAMP FROM thumbnails WHERE TIME = ?''', (time,)).fetchone()
+        if row is not None and row[0] == stamp:
+            return False
+        jpg = make_thumbnail(self.folder_path, time, body_file_name, self.size)
+        conn.execute('''INSERT OR REPLACE INTO thumbnails (TIME, STAMP, JPG) VALUES (?, ?, ?)''',
+                     (time, stamp, jpg))
+        return True
+
+    def _work(self):
+        conn = self.connection()
+        uncommitted = 0
+        while True:
+            body = self._queue.get()
+            time = body[1] if body[0] == "remove" else body[0]
+            try:
+                if body[0] == "remove":
+                    conn.execute('''DELETE FROM thumbnails WHERE TIME = ?''', (time,))
+                    uncommitted += 1
+                else:
+                    uncommitted += self.update(conn, *body)
+                self.failed.discard(time)
+            except OSError as error:
+                self.failed.add(time)
+                print("unable to make thumbnail", body[1], error)
+            except sqlite3.Error as error:
+                self.failed.add(time)
+                print("unable to write thumbnail", body[1], error)
+            # commits in batches while a bulk build is running
+            if uncommitted and (self._queue.qsize() == 0 or uncommitted >= 50):
+                conn.commit()
+                uncommitted = 0
+            self._queue.task_done()
+
+    def build(self, bodies, progress = None):
+        """Makes every missing or stale thumbnail on the calling thread.
+
+        Returns:
+            made (int): The number of thumbnails made.
+        """
+        conn = self._connect()
+        made = 0
+        for i, body in enumerate(bodies):
+            try:
+                made += self.update(conn, *body)
+            except OSError as error:
+                print("unable to make thumbnail", body[1], error)
+            if progress is not None:
+                progress(i + 1, len(bodies))
+        conn.commit()
+        conn.close()
+        return made
+
+if __name__ == "__main__":
+    for folder in sys.argv[1:]:
+        folder_path = folder.rstrip("/\\") + "/"
+        with sqlite3.connect(folder_path + "body_database.db") as case_conn:
+            bodies = case_conn.execute('''SELECT TIME, BODY_FILE_NAME FROM bodies''').fetchall()
+        made = ThumbnailStore(folder_path).build(bodies)
+        print("{0}: made {1} of {2} thumbnails".format(folder, made, len(bodies)))
@@ -0,0 +1,209 @@
+import os
+import json
+from math import floor, ceil, log2
+from PIL import Image, ImageTk
+
+def image_to_canvas(canvas, x, y):
+    """Converts gridfile image coordinates to the canvas coordinates at the current zoom."""
+    zoom = getattr(canvas, "zoom", 1)
+    return x * zoom, y * zoom
+
+def canvas_to_image(canvas, canvas_x, canvas_y):
+    """Converts canvas coordinates at the current zoom to gridfile image coordinates.
+
+    Markers, ignored marks and the database always use gridfile image coordinates.
+    """
+    zoom = getattr(canvas, "zoom", 1)
+    return canvas_x / zoom, canvas_y / zoom
+
+class TilePyramid():
+    """A cache of the gridfile cut into tiles at halving resolutions.
+
+    Level 0 is the full resolution image and every following level is half the
+    size of the one before it, until the whole image fits in one tile. Tiles are
+    saved as jpgs in a folder next to the gridfile on first use and reused until
+    the gridfile changes.
+
+    Attributes:
+        image_path (str): Path to the gridfile image.
+        cache_path (str): Folder the tiles are saved to with a slash added.
+        width (int): Width of the full resolution image.
+        height (int): Height of the full resolution image.
+        levels (list): (width, height) of every level.
+
+    Typical usage example:
+        pyramid = TilePyramid(folder_path + "gridfile.jpg", folder_path + "gridfile_tiles/")
+        tile = pyramid.tile(level, column, row)
+    """
+    tile_size = 256
+
+    def __init__(self, image_path, cache_path):
+        self.image_path = image_path
+        self.cache_path = cache_path
+        with Image.open(image_path) as image:
+            self.width, self.height = image.size
+        self.levels = [(self.width, self.height)]
+        while max(self.levels[-1]) > self.tile_size:
+            width, height = self.levels[-1]
+            # rounded up like Image.reduce, which makes the level images
+            self.levels.append(((width + 1) // 2, (height + 1) // 2))
+
+        if not self.is_cached():
+            self.build()
+
+    def source_info(self):
+        stat = os.stat(self.image_path)
+        # the level sizes are part of it so pyramids cut with other level sizes are cut again
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "tile_size": self.tile_size,
+                "levels": [list(level) for level in self.levels]}
+
+    def is_cached(self):
+        try:
+            with open(self.cache_path + "pyramid.json") as info_file:
+                return json.load(info_file) == self.source_info()
+        except (OSError, ValueError):
+            return False
+
+    def build(self):
+        """Cuts every level of the gridfile into tiles."""
+        os.makedirs(self.cache_path, exist_ok = True)
+        image = Image.open(self.image_path).convert("RGB")
+        for level, (width, height) in enumerate(self.levels):
+            if level > 0:
+                image = image.reduce(2)
+            for row in range(ceil(height / self.tile_size)):
+                for column in range(ceil(width / self.tile_size)):
+                    box = (column * self.tile_size, row * self.tile_size,
+                           min((column + 1) * self.tile_size, width), min((row + 1) * self.tile_size, height))
+                    image.crop(box).save(self.tile_path(level, column, row), quality = 90)
+        image.close()
+
+        # written last so an interrupted build is redone on the next open
+        with open(self.cache_path + "pyramid.json", "w") as info_file:
+            json.dump(self.source_info(), info_file)
+
+    def tile_path(self, level, column, row):
+        return "{0}{1}_{2}_{3}.jpg".format(self.cache_path, level, column, row)
+
+    def tile(self, level, column, row):
+        return Image.open(self.tile_path(level, column, row))
+
+class TiledCanvas():
+    """Shows a TilePyramid on a canvas, only creating the tiles in view.
+
+    The zoom is a power of two. Zooming out uses the matching smaller level of the
+    pyramid and zooming in enlarges the full resolution tiles. Tiles are only
+    resized when the zoom falls between levels. Every other item on
+    the canvas is scaled along with the image so grid lines and markers stay in
+    place, while anything stored uses gridfile coordinates through
+    canvas_to_image and image_to_canvas. The zoom is kept on the canvas as
+    canvas.zoom for those helpers.
+
+    Attributes:
+        canvas (tk.Canvas): The canvas the tiles are drawn on.
+        pyramid (TilePyramid): The tiles of the gridfile.
+        zoom (float): Canvas pixels per gridfile pixel.
+        tiles (dict): Canvas item and PhotoImage of every shown tile keyed by (level, column, row).
+
+    Typical usage example:
+        viewer = TiledCanvas(canvas, TilePyramid(image_path, cache_path))
+        viewer.set_zoom(0.5)
+    """
+    min_zoom = 1 / 32
+    max_zoom = 4
+
+    def __init__(self, canvas, pyramid):
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.zoom = 1
+        self.canvas.zoom = self.zoom
+        self.tiles = {}
+        self._pending = None
+
+        self.canvas.configure(scrollregion = (0, 0, pyramid.width, pyramid.height))
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw(), add = "+")
+
+    def level(self):
+        """Returns the pyramid level drawn at the current zoom."""
+        if self.zoom >= 1:
+            return 0
+        return min(int(round(-log2(self.zoom))), len(self.pyramid.levels) - 1)
+
+    def schedule_redraw(self):
+        """Redraws once the current burst of scroll and resize events is handled."""
+        if self._pending is None:
+            self._pending = self.canvas.after_idle(self.redraw)
+
+    def redraw(self):
+        """Creates the tiles in the viewport and removes the ones that scrolled out of it."""
+        self._pending = None
+        level = self.level()
+        level_width, level_height = self.pyramid.levels[level]
+        # canvas pixels covered by one tile of this level
+        span = self.pyramid.tile_size * (2 ** level) * self.zoom
+
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        right = left + self.canvas.winfo_width()
+        bottom = top + self.canvas.winfo_height()
+
+        columns = ceil(level_width / self.pyramid.tile_size)
+        rows = ceil(level_height / self.pyramid.tile_size)
+        visible = set()
+        for row in range(max(0, floor(top / span)), min(rows, ceil(bottom / span))):
+            for column in range(max(0, floor(left / span)), min(columns, ceil(right / span))):
+                visible.add((level, column, row))
+
+        for key in list(self.tiles):
+            if key not in visible:
+                self.canvas.delete(self.tiles.pop(key)[0])
+
+        for key in visible:
+            if key in self.tiles:
+                continue
+            level, column, row = key
+            tile = self.pyramid.tile(level, column, row)
+            scale = span / self.pyramid.tile_size
+            if scale != 1:
+                tile = tile.resize((max(1, round(tile.width * scale)), max(1, round(tile.height * scale))))
+            imagetk = ImageTk.PhotoImage(tile)
+            item = self.canvas.create_image(column * span, row * span, anchor = "nw", image = imagetk, tag = "tile")
+            self.canvas.lower(item)
+            self.tiles[key] = (item, imagetk)
+
+    def set_zoom(self, zoom, anchor_x = None, anchor_y = None):
+        """Changes the zoom, keeping the point under the anchor in place.
+
+        Args:
+            zoom (float): The new zoom, clamped to min_zoom and max_zoom.
+            anchor_x (int): Window x that should stay over the same point. Defaults to the center.
+            anchor_y (int): Window y that should stay over the same point. Defaults to the center.
+        """
+        zoom = min(max(zoom, self.min_zoom), self.max_zoom)
+        if zoom == self.zoom:
+            return
+        if anchor_x is None:
+            anchor_x = self.canvas.winfo_width() / 2
+        if anchor_y is None:
+            anchor_y = self.canvas.winfo_height() / 2
+        image_x, image_y = canvas_to_image(self.canvas, self.canvas.canvasx(anchor_x), self.canvas.canvasy(anchor_y))
+
+        self.canvas.delete("tile")
+        self.tiles.clear()
+        factor = zoom / self.zoom
+        self.canvas.scale("all", 0, 0, factor, factor)
+        self.zoom = zoom
+        self.canvas.zoom = zoom
+
+        width = self.pyramid.width * zoom
+        height = self.pyramid.height * zoom
+        self.canvas.configure(scrollregion = (0, 0, width, height))
+        self.canvas.xview_moveto((image_x * zoom - anchor_x) / width)
+        self.canvas.yview_moveto((image_y * zoom - anchor_y) / height)
+        self.schedule_redraw()
+
+    def zoom_in(self, anchor_x = None, anchor_y = None):
+        self.set_zoom(self.zoom * 2, anchor_x, anchor_y)
+
+    def zoom_out(self, anchor_x = None, anchor_y = None):
+        self.set_zoom(self.zoom / 2, anchor_x, anchor_y)
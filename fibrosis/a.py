@@ -6,14 +6,28 @@ from PIL import Image, ImageTk, ImageDraw
 import constants
 import time
 from database import Database
+from tile_cache import TileCache, TilePrefetcher
+from tile_store import TileStore, warm_case
+from tissue import tissue_fractions
+import threading
 import helper
 
 class TileImage:
     """Openslide Image Loader Class"""
-    def __init__(self, file_path):
+    def __init__(self, file_path, folder_path=None):
         self.wsi_image = openslide.open_slide(file_path) # create openslide object
         self.width, self.height = self.wsi_image.dimensions
         self.max_tiles = (self.width // constants.tile_size, self.height // constants.tile_size) # (x, y) max tiles
+        
+        # decoded tiles are kept so revisiting a tile does not read the slide again
+        # openslide can read regions from several threads, so the prefetcher shares the slide
+        self.cache = TileCache(constants.tile_cache_mb * 2**20)
+        self.prefetcher = TilePrefetcher(self.cache, self._read_tile)
+        
+        # tiles pre-rendered by warming the case are read before the slide
+        self.store = None
+        if folder_path is not None:
+            self.store = TileStore(folder_path, self.max_tiles)
 
     def calculate_coordinates(self, tile_number):
         # zero indexed tile_number
@@ -26,6 +40,28 @@ class TileImage:
         return [x * constants.tile_size, y * constants.tile_size]
 
     def load_tile(self, tile_num):
+        return self.cache.get(tile_num, self._read_tile)
+    
+    def prefetch(self, tile_nums):
+        # decode the tiles in the background, in the order given
+        self.prefetcher.prefetch(tile_nums)
+        
+    def close(self):
+        self.prefetcher.close()
+        self.cache.clear()
+        if self.store is not None:
+            self.store.close()
+        self.wsi_image.close()
+
+    def _read_tile(self, tile_num):
+        if self.store is not None:
+            tile = self.store.get(tile_num)
+            if tile is not None:
+                return tile
+        return self.render_tile(tile_num)
+
+    def render_tile(self, tile_num):
+        # decodes the padded region from the slide and draws the exclusion lines
         coords = self.calculate_coordinates(tile_num)
         # adding margins if needed
         # add 600 px padding
@@ -177,7 +213,7 @@ class ImageWindow(tk.Frame):
         self.db = Database(folder_path)
         self.wsi_path = self.db.get_wsi_path()
         
-        self.image_loader = TileImage(self.wsi_path)
+        self.image_loader = TileImage(self.wsi_path, folder_path)
         
         self._create_image_canvas()
         self._create_scrollbar()
@@ -218,9 +254,18 @@ class ImageWindow(tk.Frame):
         self._show_img(img, self.canvas)
         self.canvas.configure(scrollregion=self.canvas.bbox("all")) # updates scroll region so scrollbars dont break
         self.tile_num = tile_num
+        self.image_loader.prefetch(self._upcoming_tiles(tile_num))
         
         self.create_existing_annotations()
         
+    def _upcoming_tiles(self, tile_num):
+        # next tiles in the randomized order first, then the one before
+        last = len(self.randomized_tiles) - 1
+        upcoming = [self.randomized_tiles[i] for i in range(tile_num+1, min(tile_num+constants.prefetch_tiles, last)+1)]
+        if tile_num > 0:
+            upcoming.append(self.randomized_tiles[tile_num-1])
+        return upcoming
+        
     def _create_image_canvas(self):
         self.canvas = tk.Canvas(self, highlightthickness=0, bg='white')
         self.canvas.grid(row=1, column=1, sticky="nswe")
@@ -515,8 +560,8 @@ class InformationFrame(tk.Frame):
         self.canvas.bind('<MouseWheel>', self._verti_wheel)
 
     def _create_counter_bar(self):
-        counts = self.db.get_counts()
-        percentages = helper.get_percentages(counts)
+        counts = self.db.stats.counts()
+        percentages = self.db.stats.percentages()
         self.counter_frame = tk.Frame(self)
         self.counter_frame.grid(row=2, column=0)
         
@@ -594,6 +639,7 @@ class InformationFrame(tk.Frame):
 class Toolbar(tk.Frame):
     def __init__(self, master, folder_path):
         tk.Frame.__init__(self, master)
+        self.folder_path = folder_path
         self.db = Database(folder_path)
         
         self._create_file_menu_button()
@@ -608,6 +654,7 @@ class Toolbar(tk.Frame):
         
         # self.file_menu.add_command (label="Open New Folder", command=self.open_new_folder)
         self.file_menu.add_command(label="Export Data", command=self.export_data)
+        self.file_menu.add_command(label="Warm Tile Cache", command=self.warm_tiles)
         self.file_menu.add_command(label="Exit", command=root.quit)
 
     def _show_help_screen(self):
@@ -632,6 +679,41 @@ class Toolbar(tk.Frame):
         popup.geometry("+%d+%d" % (x + 500, y + 500))
         tk.Label(popup, text = message).pack()
         
+    def warm_tiles(self):
+        # renders the tiles on a process pool from a worker thread, the label is updated from tkinter
+        popup = tk.Toplevel(root)
+        popup.transient(root)
+        popup.title("Warm Tile Cache")
+        status = tk.Label(popup, text="Starting...", width=40)
+        status.pack(padx=10, pady=10)
+        
+        progress = {"done": 0, "total": 0, "finished": False, "error": None}
+        
+        def report(done, total):
+            progress["done"] = done
+            progress["total"] = total
+        
+        def work():
+            try:
+                warm_case(self.folder_path, progress=report)
+            except Exception as error:
+                progress["error"] = error
+            progress["finished"] = True
+        
+        def poll():
+            if not popup.winfo_exists():
+                return
+            if progress["error"] is not None:
+                status.config(text=f"Unable to warm tiles: {progress['error']}")
+            elif progress["finished"]:
+                status.config(text=f"Done, {progress['done']} tiles rendered")
+            else:
+                status.config(text=f"Rendered {progress['done']} of {progress['total']} tiles")
+                popup.after(500, poll)
+        
+        threading.Thread(target=work, daemon=True).start()
+        poll()
+        
     def export_data(self):
         export = tk.Toplevel()
         export.transient(root)
@@ -766,8 +848,10 @@ class OpeningWindow(tk.Frame):
         # get dimensions to save into database
         tile_image = TileImage(file_path)
         max_tiles = tile_image.max_tiles
+        tissue = tissue_fractions(tile_image.wsi_image, max_tiles) # skip tiles of glass and background
+        tile_image.close()
         
-        Database(folder_path).initiate(file_path, max_tiles)
+        Database(folder_path).initiate(file_path, max_tiles, tissue)
         done_screen = tk.Toplevel()
 
         success_label1 = tk.Label(done_screen, text = "Folder sucessfully initialized!")
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+from bisect import bisect_left
+import numpy as np
+import constants
+
+class CaseStats:
+    """Running statistics of a case, kept up to date as annotations change.
+
+    Holds the same series as Database.format_df: per tile area sums for every
+    tile with annotations in tile order, their cumulative sums, the percent of
+    papilla area and the moving coefficient of error over constants.ce_window
+    tiles. The case is read from the database once, afterwards Database calls
+    the add, delete, completion and impacted methods after each write. A change
+    only recomputes the rows from its tile to the end, which is the last row or
+    two while annotating tiles in order, and completing a tile changes no series.
+
+    Every Database of a folder shares one CaseStats through CaseStats.of.
+    """
+    _cases = {}
+
+    @classmethod
+    def of(cls, folder_path):
+        key = os.path.abspath(folder_path)
+        stats = cls._cases.get(key)
+        if stats is None:
+            stats = cls._cases[key] = cls(os.path.join(folder_path, "database.db"))
+        return stats
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.loaded = False
+
+    def _load(self):
+        conn = sqlite3.connect(self.database_path)
+        try:
+            tiles = conn.execute("""SELECT rel_tile, completed FROM tiles""").fetchall()
+            master = conn.execute("""SELECT tag, tile_id, pap_area, den_area, hy_area, min_area FROM master""").fetchall()
+            impacted = conn.execute("""SELECT tag FROM impacted""").fetchall()
+        finally:
+            conn.close()
+
+        self.completed = dict(tiles)
+        self.annotations = {tag: (tile_id, np.array(areas, dtype=float)) for tag, tile_id, *areas in master}
+        self.impacted = {}
+        for (tag,) in impacted:
+            self.impacted[tag] = self.impacted.get(tag, 0) + 1
+
+        # a tile gets a row once it has an annotation, like the inner join of format_df
+        self.tile_tags = {}
+        for tag, (tile_id, _) in self.annotations.items():
+            self.tile_tags.setdefault(tile_id, set()).add(tag)
+        self.tile_ids = sorted(self.tile_tags)
+        self.areas = np.array([self._tile_areas(tile_id) for tile_id in self.tile_ids]).reshape(-1, len(constants.ann_keys))
+        self.cumulative = np.zeros_like(self.areas)
+        self.perc = np.zeros((len(self.tile_ids), len(constants.perc_keys)))
+        self.ce = np.full_like(self.perc, np.nan)
+        self.type_counts = np.count_nonzero(self.areas_by_tag(), axis=0)
+
+        self._recompute(0)
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self._load()
+
+    def areas_by_tag(self):
+        return np.array([areas for _, areas in self.annotations.values()]).reshape(-1, len(constants.ann_keys))
+
+    def _recompute(self, start):
+        # refreshes the cumulative sums, percentages and moving ce of rows start to the end
+        n = len(self.tile_ids)
+        if start >= n:
+            return
+        base = self.cumulative[start-1] if start > 0 else 0
+        self.cumulative[start:] = base + np.cumsum(self.areas[start:], axis=0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            perc = self.cumulative[start:, 1:] / self.cumulative[start:, :1] * 100
+        self.perc[start:] = np.round(perc, 2)
+
+        window = constants.ce_window
+        self.ce[start:min(n, window-1)] = np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(max(start, window-1), n):
+                self.ce[i] = self.perc[i-window+1:i+1].std(axis=0, ddof=1) / self.perc[i] * 100
+
+    def _tile_areas(self, tile_id):
+        # summed from the tile's annotations so deletes leave no rounding behind
+        return np.sum([self.annotations[tag][1] for tag in self.tile_tags[tile_id]], axis=0)
+
+    def _update_tile(self, tile_id):
+        i = bisect_left(self.tile_ids, tile_id)
+        has_row = i < len(self.tile_ids) and self.tile_ids[i] == tile_id
+        if self.tile_tags.get(tile_id):
+            if not has_row:
+                self.tile_ids.insert(i, tile_id)
+                self.areas = np.insert(self.areas, i, 0, axis=0)
+                self.cumulative = np.insert(self.cumulative, i, 0, axis=0)
+                self.perc = np.insert(self.perc, i, 0, axis=0)
+                self.ce = np.insert(self.ce, i, np.nan, axis=0)
+            self.areas[i] = self._tile_areas(tile_id)
+        elif has_row:
+            # a tile without annotations has no row
+            self.tile_tags.pop(tile_id, None)
+            del self.tile_ids[i]
+            self.areas = np.delete(self.areas, i, axis=0)
+            self.cumulative = np.delete(self.cumulative, i, axis=0)
+            self.perc = np.delete(self.perc, i, axis=0)
+            self.ce = np.delete(self.ce, i, axis=0)
+        self._recompute(i)
+
+    def add_annotation(self, tag, tile_id, areas):
+        if not self.loaded:
+            return
+        areas = np.array(areas, dtype=float)
+        self.annotations[tag] = (tile_id, areas)
+        self.tile_tags.setdefault(tile_id, set()).add(tag)
+        self.type_counts += areas != 0
+        self._update_tile(tile_id)
+
+    def delete_annotation(self, tag):
+        if not self.loaded:
+            return
+        self.impacted.pop(tag, None)
+        if tag not in self.annotations:
+            return
+        tile_id, areas = self.annotations.pop(tag)
+        self.tile_tags[tile_id].discard(tag)
+        self.type_counts -= areas != 0
+        self._update_tile(tile_id)
+
+    def set_completed(self, tile_id, completed):
+        if not self.loaded:
+            return
+        self.completed[tile_id] = completed
+
+    def add_impacted(self, tag):
+        if not self.loaded:
+            return
+        self.impacted[tag] = self.impacted.get(tag, 0) + 1
+
+    def delete_impacted(self, tag):
+        if not self.loaded:
+            return
+        self.impacted.pop(tag, None)
+
+    def counts(self):
+        # same as Database.get_counts, annotations of each type and impacted tags
+        self.ensure_loaded()
+        return tuple(int(count) for count in self.type_counts) + (sum(self.impacted.values()),)
+
+    def percentages(self):
+        # each count as a percent of the papilla count
+        counts = self.counts()
+        if counts[0] == 0:
+            return tuple(0 for _ in counts)
+        return tuple(round(count / counts[0] * 100, constants.perc_digits) for count in counts)
+
+    def total_annotations(self):
+        self.ensure_loaded()
+        return len(self.annotations)
+
+    def row_completed(self):
+        # completed status of every row
+        self.ensure_loaded()
+        return np.array([self.completed.get(tile_id, 0) for tile_id in self.tile_ids])
+
+    def series(self):
+        # cumulative areas, percentages and moving ce, one row per tile with annotations
+        self.ensure_loaded()
+        return self.cumulative, self.perc, self.ce
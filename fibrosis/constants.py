@@ -35,7 +35,23 @@ max_annotations = 1500
 min_perc = 1
 max_ce = 5
 passed_tiles_req = 10
+ce_window = 10 # tiles in the moving coefficient of error
 
 # subtract 1200 from coords, 26 - 27 check excess fucks up modulus x coordinate
 
 #set rel x and y to top left of tile
+
+# tile cache, a tile is about 10 MB decoded
+tile_cache_mb = 256
+prefetch_tiles = 3 # tiles ahead in the randomized order decoded in the background
+
+# pre-rendered tiles made by warming a case
+tile_store_name = "tiles.db"
+tile_store_quality = 90
+warm_workers = None # one process per cpu
+
+# tissue detection when initiating a case
+tissue_downsample = 32 # slide level used, the closest one at or above this much detail
+tissue_min_chroma = 15 # pixels less coloured than this are glass
+tissue_max_brightness = 225 # pixels brighter than this are background
+min_tissue_fraction = 0.05 # tiles with less tissue are not visited
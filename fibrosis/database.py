@@ -4,6 +4,8 @@ import numpy as np
 import pandas as pd
 import constants
 import helper
+from tissue import tissue_order
+from case_stats import CaseStats
 from random import shuffle
 import openslide
 import matplotlib
@@ -11,19 +13,93 @@ import matplotlib.pyplot as plt
 
 from PIL import Image
 class Database:
+    create_polygons_query = """CREATE TABLE IF NOT EXISTS polygons
+                                (
+                                tag TEXT,
+                                fib_type TEXT,
+                                tile_id INTEGER,
+                                vertex_count INTEGER,
+                                min_x REAL,
+                                min_y REAL,
+                                max_x REAL,
+                                max_y REAL,
+                                points BLOB,
+                                PRIMARY KEY (tag, fib_type),
+                                CONSTRAINT fk_tag
+                                    FOREIGN KEY (tag)
+                                    REFERENCES master(tag)
+                                    ON DELETE CASCADE
+                                )"""
+    create_polygons_index_query = """CREATE INDEX IF NOT EXISTS polygons_tile ON polygons (tile_id)"""
+    
+    insert_polygon_query = """INSERT OR REPLACE INTO polygons (
+                                tag,
+                                fib_type,
+                                tile_id,
+                                vertex_count,
+                                min_x,
+                                min_y,
+                                max_x,
+                                max_y,
+                                points
+                                ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
     def __init__(self, parent_dir):
         self.parent_dir = parent_dir
         self.database_path = os.path.join(parent_dir, "database.db")
+        self.stats = CaseStats.of(parent_dir) # shared by every Database of the folder, loaded when first read
         try:
             self.conn = sqlite3.connect(self.database_path)
             self.c = self.conn.cursor()
             self.c.execute("PRAGMA foreign_keys = ON") # allows cascade deletes
             self.conn.commit()
+            self._upgrade_polygons()
         except sqlite3.Error as error:
             print("Error while connecting to sqlite", error)
             self.conn.close()
             self.c.close()
 
+    def _table_exists(self, name):
+        self.c.execute("""SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?""", (name,))
+        return len(self.c.fetchall()) > 0
+
+    def _upgrade_polygons(self):
+        # folders made before the polygons table stored one row per vertex in a table per fib type,
+        # a folder is upgraded while any of those tables is left so an interrupted upgrade is redone
+        old_tables = [fib_type for fib_type in constants.fib_types if self._table_exists(fib_type)]
+        if not self._table_exists("master") or not old_tables:
+            return
+        
+        # the whole upgrade is one transaction, either every table is moved or none are
+        self.conn.commit()
+        self.c.execute("BEGIN")
+        try:
+            self.c.execute(self.create_polygons_query)
+            self.c.execute(self.create_polygons_index_query)
+            
+            get_tiles_query = """SELECT tag, tile_id FROM master"""
+            self.c.execute(get_tiles_query)
+            tile_ids = dict(self.c.fetchall())
+            
+            for fib_type in old_tables:
+                # rowid keeps the order the vertices were clicked in
+                self.c.execute(f"""SELECT tag, rel_x, rel_y FROM {fib_type} ORDER BY rowid""")
+                rings = {}
+                for tag, x, y in self.c.fetchall():
+                    rings.setdefault(tag, []).append((x, y))
+                
+                polygons_data = [self._polygon_row(tag, fib_type, tile_ids.get(tag), points) for tag, points in rings.items()]
+                self.c.executemany(self.insert_polygon_query, polygons_data)
+                self.c.execute(f"""DROP TABLE {fib_type}""")
+            
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def _polygon_row(self, tag, fib_type, tile_id, points):
+        return (tag, fib_type, tile_id, len(points), *helper.points_bbox(points), helper.pack_points(points))
+
     def __del__(self):
         # ends any connections
         self.close()
@@ -33,7 +109,9 @@ class Database:
         self.c.close()
 
         
-    def initiate(self, wsi_dir, grid_dimensions):
+    def initiate(self, wsi_dir, grid_dimensions, tissue=None):
+        # tissue is the tissue fraction of every real tile, tiles below constants.min_tissue_fraction are left out
+
         create_master_query = """CREATE TABLE IF NOT EXISTS master
                                 (
                                 tag TEXT PRIMARY KEY,
@@ -55,19 +133,9 @@ class Database:
         insert_paths_query = """INSERT INTO paths (wsi) VALUES(?)"""
         self.c.execute(insert_paths_query, (self.wsi_dir,))
 
-        # make sure constants.fib_types is safe to prevent injections
-        for fib_type in constants.fib_types:
-            create_table_query = f"""CREATE TABLE IF NOT EXISTS {fib_type}
-                                    (
-                                    rel_x INTEGER,
-                                    rel_y INTEGER,
-                                    tag TEXT,
-                                    CONSTRAINT fk_tag
-                                        FOREIGN KEY (tag)
-                                        REFERENCEs master(tag)
-                                        ON DELETE CASCADE
-                                    )"""
-            self.c.execute(create_table_query)
+        # every traced ring is one row, its vertices packed into a blob
+        self.c.execute(self.create_polygons_query)
+        self.c.execute(self.create_polygons_index_query)
         
         create_grid_query = """CREATE TABLE IF NOT EXISTS tiles
                                 (
@@ -112,11 +180,23 @@ class Database:
         self.c.execute(insert_dimension_query, grid_dimensions)
         
         max_tile_size = grid_dimensions[0] * grid_dimensions[1]
-        randomized_tiles = [i for i in range(max_tile_size)]
+        if tissue is None:
+            randomized_tiles = [i for i in range(max_tile_size)]
+        else:
+            create_tissue_query = """CREATE TABLE IF NOT EXISTS tissue
+                                    (
+                                    real_tile INTEGER PRIMARY KEY,
+                                    fraction REAL
+                                    )"""
+            self.c.execute(create_tissue_query)
+            self.c.executemany("""INSERT OR REPLACE INTO tissue (real_tile, fraction) VALUES(?, ?)""",
+                               [(i, float(tissue[i])) for i in range(max_tile_size)])
+            randomized_tiles = tissue_order(tissue)
         shuffle(randomized_tiles)
         
         # randomizing the grid and pushing the data in
-        grids_data = [(i, randomized_tiles[i], False) for i in range(max_tile_size)]
+        # rel_tile counts the visited tiles only, real_tile keeps the position in the whole grid for exporting
+        grids_data = [(i, randomized_tiles[i], False) for i in range(len(randomized_tiles))]
         
         tile_data_query = """INSERT OR IGNORE INTO tiles(
                                             rel_tile,
@@ -159,6 +239,14 @@ class Database:
         
         return [result[i][1] for i in range(0, len(result))]
     
+    def get_render_order(self):
+        # real tiles in the order they are visited, unfinished tiles first
+        pull_query = """SELECT real_tile FROM tiles ORDER BY completed, rel_tile"""
+        self.c.execute(pull_query)
+        result = self.c.fetchall()
+        
+        return [result[i][0] for i in range(0, len(result))]
+    
     def get_first_unfinished(self):
         get_unfinished_query = """SELECT rel_tile FROM tiles WHERE completed = 0 LIMIT 1"""
         self.c.execute(get_unfinished_query)
@@ -190,11 +278,13 @@ class Database:
         add_query = """INSERT INTO impacted (tag) VALUES(?)"""
         self.c.execute(add_query, (tag,))
         self.conn.commit()
+        self.stats.add_impacted(tag)
         
     def delete_impacted(self, tag):
         delete_query = """DELETE FROM impacted WHERE tag = ?"""
         self.c.execute(delete_query, (tag,))
         self.conn.commit()
+        self.stats.delete_impacted(tag)
         
     def push_annotation_data(self, ann, tag, tile_id):
         for key in constants.fib_types:
@@ -222,17 +312,11 @@ class Database:
         self.c.execute(master_query, master_data)
         self.conn.commit()
             
-        for key, points in ann.items():
-            if points == []:
-                continue
-            
-            insert_data = [(tag, points[i][0], points[i][1]) for i in range(0, len(points))]
-            points_query = f"""INSERT INTO {key} (tag, rel_x, rel_y) VALUES (?, ?, ?)"""
-            # count_query = f"""UPDATE count SET {key} = {key} + 1"""
-            # self.c.execute(count_query)
-            self.c.executemany(points_query, insert_data)
+        polygons_data = [self._polygon_row(tag, key, tile_id, points) for key, points in ann.items() if points != []]
+        self.c.executemany(self.insert_polygon_query, polygons_data)
         
         self.conn.commit()
+        self.stats.add_annotation(tag, tile_id, master_data[2:])
         
     def delete_annotation(self, tag):
         delete_query = """DELETE FROM master where tag = ?"""
@@ -240,6 +324,7 @@ class Database:
         self.c.execute(delete_query, (tag,))
         self.c.execute(delete_query_2, (tag,))
         self.conn.commit()
+        self.stats.delete_annotation(tag)
 
     def get_counts(self):
         try:
@@ -294,22 +379,11 @@ class Database:
         }
         """
         
-        fib_type = "papilla"
-        for fib_type in constants.fib_types:
-            get_query = f"""SELECT master.tag,
-                                    {fib_type}.rel_x,
-                                    {fib_type}.rel_y
-                                    FROM {fib_type}
-                                    INNER JOIN master on {fib_type}.tag = master.tag
-                                    WHERE master.tile_id = ?"""
-            self.c.execute(get_query, (tile_id, ))
-            points = self.c.fetchall()
-            
-            for point in points:
-                cur_tag = point[0]
-                x = point[1]
-                y = point[2]
-                annotations[cur_tag][fib_type].append((x,y))
+        get_query = """SELECT tag, fib_type, points FROM polygons WHERE tile_id = ?"""
+        self.c.execute(get_query, (tile_id, ))
+        for cur_tag, fib_type, points in self.c.fetchall():
+            if cur_tag in annotations:
+                annotations[cur_tag][fib_type] = [tuple(point) for point in helper.unpack_points(points).tolist()]
         
         # i shouldve paid attention in data structure more pepela
         return annotations
@@ -319,6 +393,7 @@ class Database:
         
         self.c.execute(completion_query, (completion, tile_id))
         self.conn.commit()
+        self.stats.set_completed(tile_id, completion)
         
     def format_df(self):
         master_query = """SELECT tile_id, 
@@ -346,15 +421,32 @@ class Database:
                              "min_area"]].div(df["pap_area"], axis=0).multiply(100)).round(2)
         
         ce_keys = constants.ce_keys
-        df[ce_keys] = df[perc_keys].rolling(window=10, axis=0).std()
+        df[ce_keys] = df[perc_keys].rolling(window=constants.ce_window, axis=0).std()
         
         for i in range(len(ce_keys)):
             df[ce_keys[i]] = df[ce_keys[i]].div(df[perc_keys[i]]) * 100
         
         return df
     
+    def _points_df(self, rows):
+        # one row per vertex like the old per type tables, built from the packed rings
+        if rows:
+            tags, counts, blobs, tile_ids, real_tiles = zip(*rows)
+            points = np.concatenate([helper.unpack_points(blob) for blob in blobs])
+        else:
+            tags, counts, tile_ids, real_tiles = (), (), (), ()
+            points = np.zeros((0, 2))
+        if np.array_equal(points, np.round(points)):
+            points = points.astype(np.int64) # clicks on whole pixels export as integers
+        
+        return pd.DataFrame({"rel_x": points[:, 0],
+                             "rel_y": points[:, 1],
+                             "tag": np.repeat(tags, counts),
+                             "tile_id": np.repeat(np.asarray(tile_ids, dtype=np.int64), counts),
+                             "real_tile": np.repeat(np.asarray(real_tiles, dtype=np.int64), counts)})
+    
     def create_graphs(self):
-        df = self.format_df()
+        cumulative, perc, ce = self.stats.series()
         
         matplotlib.use("Agg") # defines backend as write only
         ann_keys = constants.ann_keys
@@ -367,12 +459,12 @@ class Database:
         max_plots = 2+len(perc_keys)
         fig, axs = plt.subplots(max_plots)
         fig.set_size_inches(4, 15)
-        pap_area = df[ann_keys[0]]
+        pap_area = cumulative[:, 0]
         
         # sunburst pie chart
-        try:
-            pie_sizes = list(df[ann_keys].iloc[-1, 0:4])
-        except:
+        if len(cumulative):
+            pie_sizes = list(cumulative[-1, 0:4])
+        else:
             pie_sizes = list([0,0,0,0])
 
         last_pap_area = pie_sizes[0]
@@ -388,7 +480,7 @@ class Database:
         for i in range(1, 1+len(perc_keys)):
             j = i-1 # to iterate through the smaller perc_keys
             label = f"{graph_title_keys[i]} Percent Area"
-            axs[i].plot(pap_area, df[perc_keys[j]], label=label, color=graph_colors[i])
+            axs[i].plot(pap_area, perc[:, j], label=label, color=graph_colors[i])
             axs[i].set_title(f"{label} v Total Papilla Area")
             axs[i].set_xlabel("Total Papilla Area")
             axs[i].set_ylabel(label)
@@ -396,7 +488,7 @@ class Database:
         last_plot= max_plots-1
         
         for i in range(len(ce_keys)):
-            axs[last_plot].plot(pap_area, df[ce_keys[i]], color=graph_colors[i+1]) 
+            axs[last_plot].plot(pap_area, ce[:, i], color=graph_colors[i+1]) 
         axs[last_plot].axhline(5, color="grey", alpha=.5, dashes=(1,1))
         axs[last_plot].set_title("Moving CE v Total Papilla Area")
         axs[last_plot].set_ylabel("Moving CE Percentage")
@@ -417,35 +509,35 @@ class Database:
         return Image.frombytes("RGB", fig.canvas.get_width_height(), fig.canvas.tostring_rgb())
     
     def check_completed(self):
-        df = self.format_df()
+        _, perc, ce = self.stats.series()
+        completed = self.stats.row_completed()
         
-        if len(df[df["completed"] == 1]) < constants.min_finished_tiles:
+        if (completed == 1).sum() < constants.min_finished_tiles:
             return False
         
-        df = df.iloc[-constants.passed_tiles_req:, :]
+        last = slice(-constants.passed_tiles_req, None)
         
-        bool_query = (df["completed"] == 1)
+        bool_query = (completed[last] == 1)
         
         perc_keys = constants.perc_keys
-        ce_keys = constants.ce_keys
         
         valid_tiles = False
         for i in range(len(perc_keys)):
-            try:
-                perc = df[perc_keys[i]].iloc[-1]
-            except:
-                perc = 0
+            if len(perc):
+                last_perc = perc[-1, i]
+            else:
+                last_perc = 0
             
-            if (perc > constants.min_perc):
+            if (last_perc > constants.min_perc):
                 valid_tiles = True # boolean check if atleast one type of body has surpassed min perc
-                bool_query = (bool_query * (df[ce_keys[i]] < constants.max_ce))
+                bool_query = (bool_query * (ce[last, i] < constants.max_ce))
 
         if valid_tiles:
-            num_passed_tiles = len(df[bool_query])
+            num_passed_tiles = int(bool_query.sum())
         else:
             num_passed_tiles = 0
 
-        total_annotations = self.get_total_annotations()
+        total_annotations = self.stats.total_annotations()
         
         if ((total_annotations < constants.max_annotations) and not valid_tiles):
             return True
@@ -514,15 +606,19 @@ class Database:
         count_df.to_csv(count_name)
         
         for fib_type in constants.fib_types:
-            points_query = f"""SELECT {fib_type}.*,
+            points_query = """SELECT polygons.tag,
+                                polygons.vertex_count,
+                                polygons.points,
                                 master.tile_id,
                                 tiles.real_tile
-                                FROM {fib_type}
-                                INNER JOIN master on master.tag = {fib_type}.tag
+                                FROM polygons
+                                INNER JOIN master on master.tag = polygons.tag
                                 INNER JOIN tiles on tiles.rel_tile = master.tile_id
+                                WHERE polygons.fib_type = ?
+                                ORDER BY polygons.rowid
                                 """
-                                
-            pt_df = pd.read_sql_query(points_query, self.conn)
+            self.c.execute(points_query, (fib_type, ))
+            pt_df = self._points_df(self.c.fetchall())
             # account of padding of the image in tkinter
             pt_df["real_x"] = (pt_df["rel_x"] * constants.zoom_multiplier) - constants.padding_size
             pt_df["real_y"] = (pt_df["rel_y"] * constants.zoom_multiplier) - constants.padding_size
@@ -29,4 +29,17 @@ def calc_longest_axis(points):
     
     p4 = (unit_vector * lbda) + p1
     
-    return tuple(points[d.argmax()]), tuple(p4), d.max()
\ No newline at end of file
+    return tuple(points[d.argmax()]), tuple(p4), d.max()
+
+def pack_points(points):
+    # polygon vertices as little endian float64 x, y pairs
+    return np.asarray(points, dtype="<f8").reshape(-1, 2).tobytes()
+
+def unpack_points(data):
+    return np.frombuffer(data, dtype="<f8").reshape(-1, 2)
+
+def points_bbox(points):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    min_x, min_y = points.min(axis=0)
+    max_x, max_y = points.max(axis=0)
+    return float(min_x), float(min_y), float(max_x), float(max_y)
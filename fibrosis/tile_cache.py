@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+class TileCache:
+    """LRU cache of decoded tiles bounded by the bytes of the images it holds.
+
+    A tile asked for while another thread is decoding it waits for that decode
+    instead of reading the same region twice. Only loads asked for with
+    count=True are added to the hit and miss counters, so prefetching does not
+    skew them.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0 # misses that were already being decoded by the prefetcher
+        self.evictions = 0
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, tile_num):
+        with self._lock:
+            return tile_num in self.tiles
+
+    def get(self, tile_num, load, count=True):
+        while True:
+            with self._lock:
+                if tile_num in self.tiles:
+                    self.tiles.move_to_end(tile_num)
+                    if count:
+                        self.hits += 1
+                    return self.tiles[tile_num]
+                loading = self._loading.get(tile_num)
+                if loading is None:
+                    loading = self._loading[tile_num] = threading.Event()
+                    if count:
+                        self.misses += 1
+                    break
+                if count:
+                    self.waits += 1
+                    count = False
+            # another thread is decoding this tile, use its result once it is done
+            loading.wait()
+
+        try:
+            tile = load(tile_num)
+            self._put(tile_num, tile)
+        finally:
+            with self._lock:
+                del self._loading[tile_num]
+            loading.set()
+        return tile
+
+    def _put(self, tile_num, tile):
+        nbytes = tile.width * tile.height * len(tile.getbands())
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            self.tiles[tile_num] = tile
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, old = self.tiles.popitem(last=False)
+                self.size -= old.width * old.height * len(old.getbands())
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.tiles.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "waits": self.waits,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / requests if requests else 0.0,
+                    "tiles": len(self.tiles),
+                    "mb": round(self.size / 2**20, 1)}
+
+class TilePrefetcher:
+    """Decodes upcoming tiles into a TileCache on a background thread.
+
+    Each call to prefetch replaces the tiles still waiting, so after a jump the
+    thread stops working on tiles around the old position. The thread only
+    reads the slide and builds PIL images, it never touches tkinter.
+    """
+    def __init__(self, cache, load):
+        self.cache = cache
+        self.load = load
+        self.prefetched = 0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def prefetch(self, tile_nums):
+        with self._cond:
+            if self._closed:
+                return
+            self._queue = [i for i in tile_nums if i not in self.cache]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="tile-prefetch", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                tile_num = self._queue.pop(0)
+            if tile_num in self.cache:
+                continue
+            try:
+                self.cache.get(tile_num, self.load, count=False)
+                self.prefetched += 1
+            except Exception as error:
+                # the tile is decoded again when it is shown, which reports the error there
+                print("unable to prefetch tile", tile_num, error)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._queue = []
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,145 @@
+"""Pre-rendered tiles of a case, stored in one SQLite file in the case folder.
+
+Warming a case renders every tile the same way TileImage does, padding and
+exclusion lines included, on a pool of processes and stores them as JPEGs.
+TileImage reads a stored tile before decoding the slide, so a warmed case
+opens tiles without touching the SVS file.
+
+    python tile_store.py path/to/case --workers 4
+"""
+import io
+import os
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import constants
+
+def render_signature(max_tiles):
+    # tiles rendered with other settings are thrown away instead of shown
+    return "{}-{}-{}-{}-{}-{}x{}-{}".format(constants.tile_size, constants.padding_size, constants.downscale_level,
+                                           constants.zoom_multiplier, constants.exclusion_line_width,
+                                           max_tiles[0], max_tiles[1], constants.tile_store_quality)
+
+def encode_tile(tile):
+    # areas outside the slide are transparent, flatten them onto the white canvas background
+    if tile.mode == "RGBA":
+        flat = Image.new("RGB", tile.size, (255, 255, 255))
+        flat.paste(tile, mask=tile.getchannel("A"))
+        tile = flat
+    data = io.BytesIO()
+    tile.save(data, format="JPEG", quality=constants.tile_store_quality, subsampling=0)
+    return data.getvalue()
+
+class TileStore:
+    """Stored tiles of one case keyed by the real tile number"""
+    def __init__(self, folder_path, max_tiles):
+        self.path = os.path.join(folder_path, constants.tile_store_name)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False) # shared with the prefetch thread
+        self._lock = threading.Lock()
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute("PRAGMA journal_mode = WAL") # viewer can read while a warm writes
+            c.execute("""CREATE TABLE IF NOT EXISTS info
+                            (
+                            signature TEXT
+                            )""")
+            c.execute("""CREATE TABLE IF NOT EXISTS rendered
+                            (
+                            real_tile INTEGER PRIMARY KEY,
+                            data BLOB
+                            )""")
+            signature = render_signature(max_tiles)
+            c.execute("""SELECT signature FROM info""")
+            result = c.fetchall()
+            if not result or result[0][0] != signature:
+                c.execute("""DELETE FROM rendered""")
+                c.execute("""DELETE FROM info""")
+                c.execute("""INSERT INTO info (signature) VALUES(?)""", (signature,))
+            self.conn.commit()
+            c.close()
+
+    def get(self, tile_num):
+        with self._lock:
+            result = self.conn.execute("""SELECT data FROM rendered WHERE real_tile = ?""", (tile_num,)).fetchone()
+        if result is None:
+            return None
+        tile = Image.open(io.BytesIO(result[0]))
+        tile.load()
+        return tile
+
+    def stored(self):
+        with self._lock:
+            return {row[0] for row in self.conn.execute("""SELECT real_tile FROM rendered""")}
+
+    def put_many(self, tiles):
+        # tiles is a list of (real_tile, jpeg bytes)
+        with self._lock:
+            self.conn.executemany("""INSERT OR REPLACE INTO rendered (real_tile, data) VALUES(?, ?)""", tiles)
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+# each worker process opens the slide once
+_worker_image = None
+
+def _init_worker(wsi_path):
+    global _worker_image
+    from a import TileImage
+    _worker_image = TileImage(wsi_path)
+
+def _render(tile_num):
+    return tile_num, encode_tile(_worker_image.render_tile(tile_num))
+
+def warm_case(folder_path, workers=None, progress=None):
+    """Renders every tile of the case not stored yet, unfinished tiles first in the order they are visited.
+
+    progress is called with the number of tiles done and the number to do after each batch.
+    Returns the number of tiles rendered.
+    """
+    from database import Database
+    db = Database(folder_path)
+    wsi_path = db.get_wsi_path()
+    store = TileStore(folder_path, db.get_dimensions())
+    stored = store.stored()
+    todo = [tile for tile in db.get_render_order() if tile not in stored]
+    db.close()
+
+    done = 0
+    if progress is not None:
+        progress(done, len(todo))
+    if todo:
+        workers = workers or constants.warm_workers or os.cpu_count()
+        # spawned rather than forked, the viewer calls this from a thread while other threads hold the slide
+        # and sqlite connections, and a forked child can deadlock on their locks
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(wsi_path,)) as pool:
+            batch = []
+            for tile in pool.map(_render, todo):
+                batch.append(tile)
+                if len(batch) == workers:
+                    store.put_many(batch)
+                    done += len(batch)
+                    batch = []
+                    if progress is not None:
+                        progress(done, len(todo))
+            if batch:
+                store.put_many(batch)
+                done += len(batch)
+                if progress is not None:
+                    progress(done, len(todo))
+    store.close()
+    return done
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-renders every tile of a fibrosis case into the case folder.")
+    parser.add_argument("folder", help="an initiated case folder")
+    parser.add_argument("--workers", type=int, help="rendering processes, one per cpu if left out")
+    args = parser.parse_args()
+
+    rendered = warm_case(args.folder, args.workers, lambda done, total: print(f"{done}/{total} tiles", end="\r"))
+    print(f"\nrendered {rendered} tiles into {os.path.join(args.folder, constants.tile_store_name)}")
@@ -0,0 +1,54 @@
+import numpy as np
+import constants
+
+def tissue_mask(region):
+    """Boolean array of the pixels of an RGBA region that look like stained tissue.
+
+    Glass and background are bright and grey, tissue is darker or coloured.
+    Pixels outside the scanned area are transparent and never tissue.
+    """
+    pixels = np.asarray(region)
+    rgb = pixels[..., :3].astype(np.int16)
+    chroma = rgb.max(axis=-1) - rgb.min(axis=-1)
+    brightness = rgb.mean(axis=-1)
+    return ((pixels[..., 3] > 0)
+            & (chroma >= constants.tissue_min_chroma)
+            & (brightness <= constants.tissue_max_brightness))
+
+def tissue_fractions(wsi_image, max_tiles):
+    """Fraction of each tile covered by tissue, indexed by real tile number.
+
+    Works on the slide level closest to constants.tissue_downsample. The level
+    is read one row of tiles at a time so a large slide is never held in memory
+    at once.
+    """
+    level = wsi_image.get_best_level_for_downsample(constants.tissue_downsample)
+    downsample = wsi_image.level_downsamples[level]
+    level_width, level_height = wsi_image.level_dimensions[level]
+
+    # tile edges in level pixels, tiles past the last full tile are not part of the grid
+    x_edges = np.minimum(np.floor(np.arange(max_tiles[0]+1) * constants.tile_size / downsample).astype(int), level_width)
+    y_edges = np.minimum(np.floor(np.arange(max_tiles[1]+1) * constants.tile_size / downsample).astype(int), level_height)
+    widths = np.diff(x_edges)
+
+    fractions = np.zeros((max_tiles[1], max_tiles[0]))
+    for row in range(max_tiles[1]):
+        height = y_edges[row+1] - y_edges[row]
+        # read_region takes level 0 coordinates for the location
+        location = (0, int(round(y_edges[row] * downsample)))
+        region = wsi_image.read_region(location=location, level=level, size=(int(x_edges[-1]), int(height)))
+        column_counts = tissue_mask(region).sum(axis=0)
+        tile_counts = np.add.reduceat(column_counts, x_edges[:-1])
+        fractions[row] = tile_counts / (widths * height)
+
+    return fractions.ravel()
+
+def tissue_order(fractions, threshold=None):
+    """Real tile numbers with at least threshold tissue, every tile if none reach it."""
+    if threshold is None:
+        threshold = constants.min_tissue_fraction
+    fractions = np.asarray(fractions)
+    tiles = np.flatnonzero(fractions >= threshold)
+    if len(tiles) == 0:
+        tiles = np.arange(len(fractions))
+    return [int(tile) for tile in tiles]